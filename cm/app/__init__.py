@@ -6,8 +6,6 @@ from flask import Flask, jsonify, g
 from .constant import SIGNATURE,CM_NAME
 import logging.config
 from .decorators import json, no_cache, rate_limit
-from flasgger import Swagger
-import pika
 # get log from the application
 log_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '', 'logging.conf')
 logging.config.fileConfig(log_file_path)
@@ -15,6 +13,8 @@ log = logging.getLogger(__name__)
 
 class CalculationModuleRpcClient(object):
     def __init__(self):
+        import pika
+
         parameters = pika.URLParameters(constant.CELERY_BROKER_URL)
         self.connection = pika.BlockingConnection(parameters)
 
@@ -32,6 +32,8 @@ class CalculationModuleRpcClient(object):
             print (self.response)
 
     def call(self,data):
+        import pika
+
         log.info('%s',data)
         self.response = None
         self.corr_id = constant.CM_REGISTER_Q
@@ -52,6 +54,8 @@ class CalculationModuleRpcClient(object):
 
 def create_app(config_name):
     """Create an application instance."""
+    from flasgger import Swagger
+
     app = Flask(__name__)
     """Create swagger documentation"""
     swagger = Swagger(app)
@@ -75,3 +79,20 @@ def create_app(config_name):
 
 
     return app
+
+
+def preload():
+    """Import the heavy geospatial and GRASS modules used to compute the
+    CM, when the application is preloaded by the gunicorn master process
+    the modules are imported once and shared by the forked workers. The
+    KD-tree of the location is loaded too, so the workers share it."""
+    import gc
+
+    from .api_v1 import calculation_module
+
+    calculation_module.load_engines()
+    # keep the objects loaded so far out of the garbage collector, so the
+    # workers do not write (and copy) the shared pages
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+    return calculation_module
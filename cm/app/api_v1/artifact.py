@@ -0,0 +1,135 @@
+"""
+Prepared GRASS location artifacts
+=================================
+
+The GRASS location with the CLC raster, the urban areas and the data of the
+engines is prepared once, when the image is built, as a versioned artifact:
+a GIS database directory, or a tarball of it, with a `manifest.json` that
+records the CLC dataset and the urban categories. The version of the
+manifest is part of the keys of the plants store, so a new CLC release or
+different urban categories never reuse old classifications.
+
+The workers attach the artifact at startup hardlinking its files in their
+GIS database, the files of the artifact are read-only so they can be
+shared safely, while the directories are created by each worker so GRASS
+can add the temporary mapsets.
+"""
+import datetime
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import stat
+import tarfile
+import tempfile
+from typing import Dict, Iterable
+
+MANIFEST = "manifest.json"
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as fobj:
+        for chunk in iter(lambda: fobj.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def make_manifest(
+    clc: str, url: str, urban_cats: Iterable[int], location: str, epsg: int = 3035
+) -> Dict:
+    """Return the manifest of a location built from the CLC raster"""
+    urban_cats = sorted(int(cat) for cat in urban_cats)
+    clc_hash = file_hash(clc)
+    version = hashlib.sha1(
+        f"{clc_hash}|{','.join(map(str, urban_cats))}|{epsg}".encode()
+    ).hexdigest()[:16]
+    return dict(
+        version=version,
+        location=location,
+        epsg=epsg,
+        clc=dict(filename=os.path.basename(os.fspath(clc)), url=url, sha256=clc_hash),
+        urban_categories=urban_cats,
+        created=datetime.datetime.utcnow().isoformat(timespec="seconds"),
+    )
+
+
+def write_manifest(gisdb: str, manifest: Dict):
+    with open(os.path.join(os.fspath(gisdb), MANIFEST), "w") as jfile:
+        json.dump(manifest, jfile, indent=2)
+
+
+def read_manifest(gisdb: str) -> Dict:
+    """Return the manifest of the GIS database or an empty dictionary"""
+    try:
+        with open(os.path.join(os.fspath(gisdb), MANIFEST)) as jfile:
+            return json.load(jfile)
+    except OSError:
+        return {}
+
+
+def freeze(gisdb: str):
+    """Remove the write permissions from the files of the GIS database"""
+    for root, _, files in os.walk(os.fspath(gisdb)):
+        for fname in files:
+            path = os.path.join(root, fname)
+            mode = os.stat(path).st_mode
+            os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def pack(gisdb: str, tarball: str) -> str:
+    """Save the GIS database as an uncompressed tarball"""
+    with tarfile.open(tarball, "w") as tar:
+        tar.add(os.fspath(gisdb), arcname=".")
+    return tarball
+
+
+def unpack(tarball: str, directory: str) -> pathlib.Path:
+    """Extract the tarball once in directory, return the GIS database"""
+    gisdb = pathlib.Path(directory, pathlib.Path(tarball).name.split(".")[0])
+    if not gisdb.exists():
+        os.makedirs(directory, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=directory)
+        try:
+            with tarfile.open(tarball) as tar:
+                tar.extractall(tmp)
+            os.replace(tmp, gisdb)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not gisdb.exists():
+                raise
+    return gisdb
+
+
+def link_tree(src: str, dst: str):
+    """Recreate the directories of src in dst and hardlink the files, the
+    files are copied if src and dst are on different file systems"""
+    for root, dirs, files in os.walk(os.fspath(src)):
+        target = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(target, exist_ok=True)
+        for fname in files:
+            try:
+                os.link(os.path.join(root, fname), os.path.join(target, fname))
+            except OSError:
+                shutil.copy2(os.path.join(root, fname), os.path.join(target, fname))
+
+
+def attach(artifact: str, gisdb: str) -> Dict:
+    """Attach the prepared GIS database (a directory or a tarball) as gisdb
+    if gisdb does not exist yet, return the manifest"""
+    gisdb = pathlib.Path(gisdb)
+    if not gisdb.exists():
+        artifact = pathlib.Path(artifact).resolve()
+        if artifact.is_file():
+            artifact = unpack(artifact, artifact.parent / "unpacked")
+        tmp = tempfile.mkdtemp(dir=gisdb.parent, prefix=gisdb.name)
+        try:
+            link_tree(artifact, tmp)
+            os.replace(tmp, gisdb)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            # another worker attached the artifact first
+            if not gisdb.exists():
+                raise
+    return read_manifest(gisdb)
@@ -1,6 +1,5 @@
 # from osgeo import gdal
 import datetime
-import io
 import logging
 import os
 import pathlib
@@ -12,13 +11,41 @@ from shutil import copyfile
 from zipfile import ZipFile
 import geopandas as gpd
 
+import numpy as np
 import pandas as pd
-import requests
+from pandas.api.types import is_numeric_dtype
 from grass_session import TmpSession
-
-from ..constant import CM_NAME
-from ..helper import create_zip_shapefiles, generate_output_file_shp
+from shapely import wkt
+
+from ..constant import (
+    CM_NAME,
+    GISDB,
+    OUTPUT_BUFFER,
+    OUTPUT_FORMAT,
+    OUTPUT_FORMATS,
+    OUTPUT_QUAD_SEGS,
+    PREPARED_LOCATION,
+    REGIONS,
+    REGIONS_ID,
+    STREAM_CHUNKSIZE,
+    STREAM_THRESHOLD,
+    TILES_MAXZOOM,
+    URBAN_ENGINE,
+)
+from .. import cancel, progress
+from ..exceptions import ValidationError
+from ..helper import (
+    create_zip_shapefiles,
+    generate_etag,
+    generate_output_file_fgb,
+    generate_output_file_mbtiles,
+    generate_output_file_parquet,
+    generate_output_file_shp,
+)
+from . import artifact, download
+from .heatsrc import classify, columnar, kdtree, pyramid, store, stream
 from .heatsrc import technical as tech
+from .heatsrc import tiles
 
 # set a logger
 LOG_FORMAT = (
@@ -34,6 +61,20 @@ WWTP_P = WWTP + "_power"
 CLC = "clc2018"
 URB = "urbanareas"
 
+# GRASS GIS working directory, location and CLC categories of urban areas
+GISDB = pathlib.Path(GISDB)
+LOCATION = "wwtp"
+URBAN_CATS = [111, 112, 121]
+
+# per-plant classification shared by all the workers
+PLANTS_STORE = pathlib.Path(tempfile.gettempdir(), "wwtp_plants.sqlite")
+# classification of the reference dataset computed offline by precompute.py
+REFERENCE_STORE = pathlib.Path(
+    os.environ.get(
+        "REFERENCE_STORE", pathlib.Path(tempfile.gettempdir(), "wwtp_reference.sqlite")
+    )
+)
+
 BASEURL = "https://gitlab.com/hotmaps/potential/" "{repo}/-/raw/master/data/{filename}"
 
 PARAMS = (("inline", "false"),)
@@ -102,6 +143,35 @@ URLS = {
 }
 
 
+# symbology of the vector layers of the CM result
+SYMBOLOGY = [
+    {
+        "red": 24,
+        "green": 139,
+        "blue": 125,
+        "opacity": 0.8,
+        "value": "Suitable",
+        "label": "Suitable",
+    },
+    {
+        "red": 217,
+        "green": 194,
+        "blue": 89,
+        "opacity": 0.8,
+        "value": "Conditionally",
+        "label": "Conditionally",
+    },
+    {
+        "red": 243,
+        "green": 70,
+        "blue": 22,
+        "opacity": 0.8,
+        "value": "Not suitable",
+        "label": "Not suitable",
+    },
+]
+
+
 def read_csv(csvpath):
     try:
         return pd.read_csv(csvpath, header=0, index_col=0)
@@ -110,55 +180,243 @@ def read_csv(csvpath):
         raise exc
 
 
+def _data_source(repo, filename, url=BASEURL, **kwargs):
+    """Return the download arguments of a dataset stored in the repository"""
+    kwargs["url"] = url.format(repo=repo, filename=filename)
+    kwargs["filepath"] = pathlib.Path(tempfile.gettempdir(), filename)
+    return kwargs
+
+
 def get_data(repo, filename, url=BASEURL, **kwargs):
     """Retrieve/read agricultural residues data"""
     # TODO: once the dataset is integrated remove this function
     # check if the file exists and in case download
-    filepath = pathlib.Path(tempfile.gettempdir(), filename)
-    if not filepath.exists():
-        url = url.format(repo=repo, filename=filename)
-        print(f"Download {filepath} from: {url}")
-        with requests.get(url, stream=True, **kwargs) as response:
-            response.raise_for_status()
-
-            with open(filepath, mode="wb") as cfile:
-                for chunk in response.iter_content(chunk_size=1024):
-                    if chunk:
-                        cfile.write(chunk)
-    return filepath
+    return get_datasets(
+        {filename: dict(repo=repo, filename=filename, url=url, **kwargs)}
+    )[filename]
 
 
-def extract_inidicators(wwtp_plants, indicators=None):
-    indicators = indicators if indicators else []
-    # verify result (here abbreviated)
-    proc = tech.run_command(
-        "v.db.select",
-        map=wwtp_plants,
-        stdout_=sub.PIPE,
-        separator="pipe",
-        vertical_separator="newline",
+def get_datasets(sources):
+    """Retrieve in parallel the datasets, sources is a dictionary with key
+    the dataset name and value the arguments of `get_data`"""
+    return download.download_all(
+        {name: _data_source(**source) for name, source in sources.items()}
     )
 
-    stdout = proc.outputs["stdout"].value
+
+def read_input(path):
+    """Read the plants from a CSV or from a columnar file"""
+    if columnar.is_columnar(path):
+        return columnar.read_table(path)
+    return read_csv(path).reset_index()
+
+
+def read_inputs(wwtp_c, wwtp_p, power_col="power"):
+    """Read the WWTP capacity and join the power on the gid column"""
+    capacity = read_input(wwtp_c)
+    power = read_input(wwtp_p)
+    return capacity.merge(power[["gid", power_col]], on="gid", how="left")
+
+
+def select_plants(wwtp_plants):
+    """Return the attribute table of the WWTP vector map"""
+    return tech.read_table(wwtp_plants)
+
+
+def suitability_power(plants):
+    """Return the number of plants and the total power by suitability"""
+    return plants.groupby("suitability", sort=False)["power"].agg(["size", "sum"])
+
+
+def compute_indicators(plants, indicators=None, summary=None):
+    """Append the number of plants and the total power by suitability,
+    summary is the result of `suitability_power` if already computed"""
+    indicators = indicators if indicators else []
     # "indicators": [
     #     {"unit": "MWh","name": "Heat demand indicator with a factor divided by 2","value": 281244.5},
     # ],
-    if stdout:
-        res = pd.read_csv(io.StringIO(stdout), sep="|", header=0)
-        for suit in res["suitability"].drop_duplicates():
+    if summary is None and plants is not None:
+        summary = suitability_power(plants)
+    if summary is not None:
+        for suit, size, pwr in summary.itertuples():
             if str(suit).lower() != "nan":
-                idx = res["suitability"] == suit
-                pwr = res.loc[idx, "power"]
                 indicators.append(
                     dict(
                         unit="kW",
-                        name=f"{idx.sum()} heatsources classified as {suit}, total power",
-                        value=f"{pwr.sum()}",
+                        name=f"{size} heatsources classified as {suit}, total power",
+                        value=f"{pwr}",
                     )
                 )
     return indicators
 
 
+_regions = None
+
+
+def get_regions():
+    """Return the regions used to aggregate the plants, the file is read
+    only once per process"""
+    global _regions
+    if _regions is None:
+        _regions = gpd.read_file(REGIONS)
+    return _regions
+
+
+def region_stats(plants, inputs):
+    """Return the plants and the suitable and conditional power aggregated
+    by region"""
+    geoms = plants["gid"].map(inputs.set_index("gid")["geometry_wkt"])
+    return tech.tech_stats(
+        plants2gdf(plants.assign(geometry_wkt=geoms)), get_regions(), REGIONS_ID
+    )
+
+
+def compute_region_indicators(plants, inputs, indicators, stats=None):
+    """Append the number of plants and the suitable and conditional power
+    aggregated by region, if the regions are defined. stats is the result
+    of `region_stats` if already computed"""
+    if REGIONS is None or (plants is None and stats is None):
+        return indicators
+    stats = region_stats(plants, inputs) if stats is None else stats
+    for region, row in stats.iterrows():
+        for col in ("suitable", "conditional"):
+            indicators.append(
+                dict(
+                    unit="kW",
+                    name=(
+                        f"{region}: {int(row[col + '_count'])} of {int(row['count'])} "
+                        f"heatsources {col}, total power"
+                    ),
+                    value=f"{row[col + '_sum']}",
+                )
+            )
+    return indicators
+
+
+def extract_inidicators(wwtp_plants, indicators=None):
+    # verify result (here abbreviated)
+    return compute_indicators(select_plants(wwtp_plants), indicators)
+
+
+def plants_store(engine=URBAN_ENGINE):
+    """Return the path of the plants store of the engine, the engines can
+    give slightly different urban statistics so they do not share it"""
+    if engine == "buffer":
+        return PLANTS_STORE
+    return PLANTS_STORE.with_name(f"{PLANTS_STORE.stem}_{engine}.sqlite")
+
+
+def store_engine(path):
+    """Return the engine used to classify the plants of the store, the
+    stores without it were classified with the GRASS buffers"""
+    return store.PlantStore(path, create=False).get_meta("engine", "buffer")
+
+
+def store_plants(plants, inputs, dist_min, dist_max, path=None, engine=URBAN_ENGINE):
+    """Save the classification of the plants in the plants store, recording
+    the engine used to classify them"""
+    path = plants_store(engine) if path is None else path
+    geoms = plants["gid"].map(inputs.set_index("gid")["geometry_wkt"])
+    keys = store.plant_keys(
+        geoms, plants["capacity"], dist_min, dist_max, location_version()
+    )
+    pstore = store.PlantStore(path)
+    pstore.set_meta("engine", engine)
+    pstore.put(keys, plants, dist_min, dist_max)
+
+
+def lookup_plants(keys, dist_min, dist_max, engine=URBAN_ENGINE):
+    """Return the stored classification of the plants, looking first in the
+    precomputed reference store, if it was classified with the same engine,
+    and then in the plants store of the engine"""
+    stores = [store.PlantStore(plants_store(engine))]
+    if REFERENCE_STORE.exists() and store_engine(REFERENCE_STORE) == engine:
+        stores.insert(0, store.PlantStore(REFERENCE_STORE, create=False))
+    missing = list(set(keys))
+    found = []
+    for pstore in stores:
+        stored = pstore.get(missing, dist_min, dist_max)
+        found.append(stored)
+        missing = [key for key in missing if key not in stored.index]
+        if not missing:
+            break
+    return pd.concat(found)
+
+
+def restore_plants(inputs, dist_min, dist_max, engine=URBAN_ENGINE):
+    """Return the classified plants if all the plants are in the plants
+    stores of the engine, only the power weighted columns are computed,
+    otherwise None"""
+    keys = store.plant_keys(
+        inputs["geometry_wkt"],
+        inputs["capacity"],
+        dist_min,
+        dist_max,
+        location_version(),
+    )
+    stored = lookup_plants(keys, dist_min, dist_max, engine=engine)
+    if not set(keys).issubset(stored.index):
+        print(f"=> {len(stored)}/{len(set(keys))} plants in the stores")
+        return None
+
+    classes = stored.reindex(keys)
+    classes.index = inputs.index
+    plants = pd.concat([inputs, classes], axis=1)
+    tech.power_potential(plants)
+    colors = plants["suitability"].map(tech.COLORS).astype(object)
+    colors = colors.where(colors.notna(), None)
+    plants["color"] = colors
+    plants["fillColor"] = colors
+    plants["opacity"] = colors.notna().map({True: 0.8, False: None}).astype(object)
+    return plants
+
+
+def plants2gdf(plants):
+    """Convert the plants DataFrame into a GeoDataFrame of points"""
+    srid = int(plants["srid"].iloc[0]) if "srid" in plants.columns and len(plants) else 3035
+    return gpd.GeoDataFrame(
+        plants.drop(columns="geometry_wkt"),
+        geometry=[wkt.loads(geom) for geom in plants["geometry_wkt"]],
+        crs=f"EPSG:{srid}",
+    )
+
+
+def fill_style(gdf):
+    """Return a copy of the plants with the default style assigned to the
+    plants that are not classified"""
+    # shallow copy, the style columns are replaced and not written in place
+    gdf = gdf.copy(deep=False)
+    non_rows = gdf.color.isna()
+    if non_rows.any():
+        gdf['color'] = gdf.color.where(~non_rows, "#F34616")
+        gdf['fillColor'] = gdf.fillColor.where(~non_rows, "#F34616")
+        gdf['opacity'] = "0.8"
+    return gdf
+
+
+def export_layer(gdf, wwtp_out):
+    """Prepare the layer for the rendering and save it to wwtp_out"""
+    prepare_layer(gdf).to_file(wwtp_out)
+
+
+def prepare_layer(gdf):
+    """Assign the style, buffer the plants and sort the columns for the
+    rendering"""
+    gdf = fill_style(gdf)
+    if gdf.crs != 'EPSG:3035':
+        gdf = gdf.to_crs('EPSG:3035')
+    # buffer all the geometries at once, vectorized with pygeos
+    gdf['geometry'] = gdf.geometry.buffer(
+        OUTPUT_BUFFER, resolution=OUTPUT_QUAD_SEGS
+    )
+    cols = list(gdf.columns)
+    # send color columns to the end
+    for item in ['color', 'fillColor', 'opacity', 'geometry']:
+        cols.pop(cols.index(item))
+        cols.append(item)
+    return gdf[cols]
+
+
 def gen_zip(shpfile, fname, odir):
     print("shafefile", shpfile)
     odir = pathlib.Path(odir)
@@ -181,6 +439,210 @@ def gen_zip(shpfile, fname, odir):
         return zip_file
 
 
+def build_location(gisdb, engines=(), overwrite=False):
+    """Create the GRASS location with the urban areas and the data used by
+    the engines in gisdb, return the manifest of the location"""
+    clc = get_datasets({CLC: URLS[CLC]})[CLC]
+    actions = [(tech.clc2urban, (CLC, URB, URBAN_CATS, overwrite))]
+    if "pyramid" in engines:
+        path = pyramid.pyramid_path(gisdb, LOCATION, URB)
+        actions.append((pyramid.build_pyramid, (URB, path)))
+    tech.create_location(
+        gisdb,
+        LOCATION,
+        overwrite=overwrite,
+        rasters={CLC: clc},
+        vectors={},
+        actions=actions,
+    )
+    tech.create_template(gisdb, LOCATION, URB)
+    if "kdtree" in engines:
+        kdtree.get_tree(gisdb, LOCATION, URB)
+    manifest = artifact.make_manifest(
+        clc, _data_source(**URLS[CLC])["url"], URBAN_CATS, LOCATION
+    )
+    manifest["engines"] = list(engines)
+    artifact.write_manifest(gisdb, manifest)
+    return manifest
+
+
+def get_location(overwrite=False):
+    """Attach the prepared GRASS location or create it if it is missing,
+    return the GIS database and the location name"""
+    if not GISDB.exists():
+        if PREPARED_LOCATION:
+            print(f"=> Attach the prepared location: {PREPARED_LOCATION}")
+            artifact.attach(PREPARED_LOCATION, GISDB)
+        else:
+            # the directory do not exists and need to be created
+            engines = [URBAN_ENGINE] if URBAN_ENGINE == "pyramid" else []
+            build_location(GISDB, engines=engines, overwrite=overwrite)
+    return GISDB, LOCATION
+
+
+def load_engines():
+    """Load the KD-tree of the location, if it is already built, called in
+    the gunicorn master before the workers are forked so they share the
+    memory of the tree instead of loading a copy each. The KD-tree is also
+    used for the large inputs of the buffer engine"""
+    if not GISDB.exists():
+        return None
+    path = kdtree.tree_path(GISDB, LOCATION, URB)
+    if not os.path.exists(path):
+        return None
+    return kdtree.get_tree(GISDB, LOCATION, URB)
+
+
+def location_version():
+    """Return the version of the location, used in the keys of the plants"""
+    return artifact.read_manifest(GISDB).get("version", "")
+
+
+def query_plants(inputs, within_dist, near_dist, engine=URBAN_ENGINE):
+    """Classify the plants querying the urban cells of the location with
+    the KD-tree or with the pyramid instead of computing the buffers in a
+    GRASS mapset"""
+    progress.report("create location", 0, len(inputs))
+    gisdb, location = get_location()
+    progress.report(f"query urban areas ({engine})", 0, len(inputs))
+    points = plants2gdf(inputs).to_crs("EPSG:3035").geometry
+    x, y = points.x.values, points.y.values
+    dists = (within_dist, near_dist)
+    if engine == "pyramid":
+        classifier = classify.get_classifier()
+        urban = pyramid.get_pyramid(gisdb, location, URB)
+        sums, exact = urban.query(
+            x, y, dists, axes=(classifier.dmin, classifier.dmax)
+        )
+        # the pyramid counts the cells, it does not locate the nearest one
+        sums.insert(0, "urban_dist", np.nan)
+    else:
+        sums = kdtree.get_tree(gisdb, location, URB).query(x, y, dists)
+        exact = None
+    sums.index = inputs.index
+    plants = pd.concat([inputs, sums], axis=1)
+    cancel.check()
+    progress.report("classify plants", len(plants), len(plants))
+    classify.classify_plants(plants, within_dist, near_dist)
+    if exact is not None:
+        # the plants are classified with the lower bounds of the pyramid,
+        # but only the exact sums are stored and exported
+        exact.index = inputs.index
+        plants[sums.columns] = sums.where(exact)
+    return tech.power_potential(plants)
+
+
+def csv_sidecars(wwtp_c, wwtp_p):
+    """Write the csvt and prj files next to the CSV inputs"""
+    # download data from the repository
+    # wwtprepo = get_data(**URLS[WWTP])
+    datasets = get_datasets(
+        {name: URLS[name] for name in (WWTP + "csvt", WWTP + "prj")}
+    )
+    wwtprepocsvt = datasets[WWTP + "csvt"]
+    wwtprepoprj = datasets[WWTP + "prj"]
+
+    # create the csvt and prj file to the input file provided by the platform
+    # these files are requide to properly import the CSV considering the
+    # common type and the Geographical coordination system
+    # capacity
+    wwpth_c = pathlib.Path(wwtp_c)
+    wwfld_c = wwpth_c.parent
+    wwnam_c = wwpth_c.name
+
+    copyfile(wwtprepocsvt, wwfld_c / (wwnam_c[:-4] + ".csvt"))
+    copyfile(wwtprepoprj, wwfld_c / (wwnam_c[:-4] + ".prj"))
+
+    # power
+    wwpth_p = pathlib.Path(wwtp_p)
+    wwfld_p = wwpth_p.parent
+    wwnam_p = wwpth_p.name
+
+    copyfile(wwtprepocsvt, wwfld_p / (wwnam_p[:-4] + ".csvt"))
+    copyfile(wwtprepoprj, wwfld_p / (wwnam_p[:-4] + ".prj"))
+
+
+def compute_plants(wwtp_c, wwtp_p, within_dist, near_dist, wwtp_out=None):
+    """Classify the WWTP in a temporary GRASS mapset, return the attribute
+    table of the classified plants and if wwtp_out is given export the
+    vector map. GRASS imports only the CSV inputs, the columnar inputs are
+    classified with the other engines"""
+    if columnar.is_columnar(wwtp_c) or columnar.is_columnar(wwtp_p):
+        raise ValidationError("The GRASS engine accepts only CSV inputs")
+    csv_sidecars(wwtp_c, wwtp_p)
+
+    overwrite = False
+    progress.report("create location")
+    gisdb, location = get_location(overwrite=overwrite)
+
+    # clone the template in a new temporary mapset for computation and
+    # importing the wwtp points, the region and the urban areas are ready
+    progress.report("clone mapset")
+    mapset = f"mset_{secrets.token_urlsafe(8)}"
+    try:
+        tech.clone_mapset(
+            gisdb, location, mapset, template=tech.get_template(gisdb, location, URB)
+        )
+        with TmpSession(
+            gisdb=os.fspath(gisdb),
+            location=location,
+            mapset=mapset,
+            create_opts="",
+        ) as tmp:
+            # import user inputs
+            progress.report("import plants")
+            tech.run_command(
+                "v.import", input=os.fspath(wwtp_c), output=WWTP_C, overwrite=overwrite
+            )
+            tech.run_command(
+                "v.import", input=os.fspath(wwtp_p), output=WWTP_P, overwrite=overwrite
+            )
+            # create a copy
+            tech.run_command("g.copy", vector=(WWTP_C, WWTP), overwrite=overwrite)
+            # join the table
+            tech.run_command(
+                "v.db.join",
+                map=WWTP,
+                column="gid",
+                other_table=WWTP_P,
+                other_column="gid",
+                subset_columns="power",
+            )
+
+            print("=> Compute the tech potential")
+            try:
+                tech.tech_potential(
+                    wwtp_plants=WWTP,
+                    urban_areas=URB,
+                    dist_min=within_dist,
+                    dist_max=near_dist,
+                    capacity_col="capacity",
+                    power_col="power",
+                    suitability_col="suitability",
+                    dist_col="distance_label",
+                    plansize_col="plantsize_label",
+                    conditional_col="conditional",
+                    suitable_col="suitable",
+                    overwrite=overwrite,
+                )
+            except Exception as exc:
+                print(f"Issue in mapset: {tmp._kwopen['mapset']}")
+                raise exc
+
+            print("=> Extract the classified plants")
+            progress.report("extract plants")
+            plants = select_plants(WWTP)
+
+            if wwtp_out is not None:
+                print("=> export result")
+                progress.report("export layer", len(plants), len(plants))
+                tech.tech_export(wwtp_plants=WWTP, wwtp_out=wwtp_out, buffer=1.0, mapset=tmp._kwopen['mapset'])
+    finally:
+        # the killed modules of a cancelled computation leave the mapset
+        tech.remove_mapset(gisdb, location, mapset)
+    return plants
+
+
 # TODO: CM provider must "change this code"
 # TODO: CM provider must "not change input_raster_selection,output_raster  1 raster input => 1 raster output"
 # TODO: CM provider can "add all the parameters he needs to run his CM
@@ -231,12 +693,13 @@ def calculation(
     # {'wwtp_capacity': '/var/tmp/e36e76f0b70b4b2e8fe974c593ebac93.csv'}
     try:
         cpth = inputs_vector_selection["wwtp_capacity"]
-        proc = sub.Popen(f"head {cpth}", shell=True, stdout=sub.PIPE, stderr=sub.PIPE)
-        so, se = proc.communicate()
-        print(so.decode())
-        print("---")
-        print(se.decode())
-        print("---")
+        if not columnar.is_columnar(cpth):
+            proc = sub.Popen(f"head {cpth}", shell=True, stdout=sub.PIPE, stderr=sub.PIPE)
+            so, se = proc.communicate()
+            print(so.decode())
+            print("---")
+            print(se.decode())
+            print("---")
     except Exception:
         print("Not able to reat the wwtp_capacity csv file")
 
@@ -246,173 +709,262 @@ def calculation(
     wwtp_c = inputs_vector_selection["wwtp_capacity"]
     wwtp_p = inputs_vector_selection["wwtp_power"]
 
-    # download data from the repository
-    # wwtprepo = get_data(**URLS[WWTP])
-    wwtprepocsvt = get_data(**URLS[WWTP + "csvt"])
-    wwtprepoprj = get_data(**URLS[WWTP + "prj"])
-    clc = get_data(**URLS[CLC])
+    output_format = params.get("output_format", OUTPUT_FORMAT)
+    if output_format not in OUTPUT_FORMATS:
+        raise ValidationError(
+            f"output_format ({output_format}) must be one of: "
+            f"{', '.join(OUTPUT_FORMATS)}"
+        )
 
-    # create the csvt and prj file to the input file provided by the platform
-    # these files are requide to properly import the CSV considering the
-    # common type and the Geographical coordination system
-    # capacity
-    wwpth_c = pathlib.Path(wwtp_c)
-    wwfld_c = wwpth_c.parent
-    wwnam_c = wwpth_c.name
+    # generate the shape file
+    wwtp_out = generate_output_file_shp(output_directory)
 
-    copyfile(wwtprepocsvt, wwfld_c / (wwnam_c[:-4] + ".csvt"))
-    copyfile(wwtprepoprj, wwfld_c / (wwnam_c[:-4] + ".prj"))
+    # classify the large inputs in batches
+    if output_format == "shapefile" and stream.is_large(
+        wwtp_c, wwtp_p, threshold=STREAM_THRESHOLD
+    ):
+        print("=> Classify the plants in batches")
+        return stream_plants(
+            output_directory, wwtp_c, wwtp_p, within_dist, near_dist, wwtp_out, warnings
+        )
 
-    # power
-    wwpth_p = pathlib.Path(wwtp_p)
-    wwfld_p = wwpth_p.parent
-    wwnam_p = wwpth_p.name
+    engine = URBAN_ENGINE
+    if columnar.is_columnar(wwtp_c) or columnar.is_columnar(wwtp_p):
+        # the columnar inputs are read zero-copy, GRASS would need them
+        # converted to another file
+        engine = query_engine("columnar inputs", warnings)
+
+    # reuse the classification if only the power values changed
+    inputs = read_inputs(wwtp_c, wwtp_p)
+    cancel.check()
+    progress.report("restore plants", 0, len(inputs))
+    plants = restore_plants(inputs, within_dist, near_dist, engine=engine)
+    if plants is not None:
+        print("=> Reuse the stored classification, update the power columns")
+        indicators = compute_indicators(plants, warnings)
+        compute_region_indicators(plants, inputs, indicators)
+        return build_result(
+            indicators,
+            export_plants(output_directory, plants, output_format, wwtp_out),
+            engine=engine,
+        )
 
-    copyfile(wwtprepocsvt, wwfld_p / (wwnam_p[:-4] + ".csvt"))
-    copyfile(wwtprepoprj, wwfld_p / (wwnam_p[:-4] + ".prj"))
+    if engine != "buffer":
+        print(f"=> Query the urban areas with the {engine} engine")
+        plants = query_plants(inputs, within_dist, near_dist, engine=engine)
+        store_plants(plants, inputs, within_dist, near_dist, engine=engine)
+        indicators = compute_indicators(plants, warnings)
+        compute_region_indicators(plants, inputs, indicators)
+        return build_result(
+            indicators,
+            export_plants(output_directory, plants, output_format, wwtp_out),
+            engine=engine,
+        )
 
-    # define the path to the default GRASS GIS working directory
-    gisdb = pathlib.Path(tempfile.gettempdir(), "gisdb")
-    location = "wwtp"
+    plants = compute_plants(
+        wwtp_c,
+        wwtp_p,
+        within_dist,
+        near_dist,
+        wwtp_out if output_format == "shapefile" else None,
+    )
+    indicators = compute_indicators(plants, warnings)
+    compute_region_indicators(plants, inputs, indicators)
+    if plants is not None:
+        store_plants(plants, inputs, within_dist, near_dist)
+    print(
+        f"\n\n=> Compute the heatsource potential using: {within_dist} and {near_dist} m. Done!"
+    )
 
-    overwrite = False
-    rasters = {CLC: clc}
-    vectors = {}  # {WWTP: wwtp}
-    actions = [(tech.clc2urban, (CLC, URB, [111, 112, 121], overwrite))]
-
-    if not gisdb.exists():
-        # the directory do not exists and need to be created
-        tech.create_location(
-            gisdb,
-            location,
-            overwrite=overwrite,
-            rasters=rasters,
-            vectors=vectors,
-            actions=actions,
-        )
+    progress.report("export layer", len(inputs), len(inputs))
+    if output_format == "shapefile":
+        export_layer(gpd.read_file(wwtp_out), wwtp_out)
+        return build_result(indicators, [shapefile_layer(output_directory, wwtp_out)])
+
+    if plants is None:
+        # the attribute table is empty, export an empty layer as GRASS does
+        # for the shapefile
+        plants = empty_plants(inputs, within_dist, near_dist)
+    geoms = plants["gid"].map(inputs.set_index("gid")["geometry_wkt"])
+    return build_result(
+        indicators,
+        export_plants(
+            output_directory, plants.assign(geometry_wkt=geoms), output_format, wwtp_out
+        ),
+    )
+
+
+def empty_plants(inputs, dist_min, dist_max):
+    """Return the table of the classified plants without rows"""
+    return pd.DataFrame(
+        {
+            col: pd.Series(dtype=dtype)
+            for col, dtype in layer_dtypes(inputs, dist_min, dist_max).items()
+        }
+    )
 
-    # generate the shape file
-    wwtp_out = generate_output_file_shp(output_directory)
 
-    # create a new temporary mapset for computation and importing the wwtp points
-    with TmpSession(
-        gisdb=os.fspath(gisdb),
-        location=location,
-        mapset=f"mset_{secrets.token_urlsafe(8)}",
-        create_opts="",
-    ) as tmp:
-        # import user inputs
-        tech.run_command(
-            "v.import", input=os.fspath(wwtp_c), output=WWTP_C, overwrite=overwrite
+def layer_dtypes(inputs, dist_min, dist_max):
+    """Return the columns and the dtypes of the plants layer written in
+    batches: the input columns, the classification and the style"""
+    dtypes = {
+        col: "int64" if col == "gid" else "float64" if is_numeric_dtype(dtype) else "object"
+        for col, dtype in inputs.dtypes.items()
+        if col != "geometry_wkt"
+    }
+    dtypes.update(
+        {
+            "urban_dist": "float64",
+            f"dist{dist_min:d}m_sum": "float64",
+            f"dist{dist_max:d}m_sum": "float64",
+            "suitability": "object",
+            "distance_label": "object",
+            "plantsize_label": "object",
+            "conditional": "float64",
+            "suitable": "float64",
+            "color": "object",
+            "fillColor": "object",
+            "opacity": "float64",
+        }
+    )
+    return dtypes
+
+
+def query_engine(reason, indicators):
+    """Return the engine that queries the urban areas in place of the GRASS
+    buffers, the switch is logged and appended to the indicators"""
+    engine = URBAN_ENGINE if URBAN_ENGINE != "buffer" else "kdtree"
+    if engine != URBAN_ENGINE:
+        LOGGER.warning(
+            f"{reason}, the plants are classified with the {engine} "
+            f"engine in place of the {URBAN_ENGINE} engine"
         )
-        tech.run_command(
-            "v.import", input=os.fspath(wwtp_p), output=WWTP_P, overwrite=overwrite
+        indicators.append(
+            {
+                "unit": "-",
+                "name": (
+                    f"{reason}: the plants are classified with the {engine} "
+                    f"engine in place of the {URBAN_ENGINE} engine"
+                ),
+                "value": "",
+            }
         )
-        # create a copy
-        tech.run_command("g.copy", vector=(WWTP_C, WWTP), overwrite=overwrite)
-        # join the table
-        tech.run_command(
-            "v.db.join",
-            map=WWTP,
-            column="gid",
-            other_table=WWTP_P,
-            other_column="gid",
-            subset_columns="power",
+    return engine
+
+
+def stream_plants(output_directory, wwtp_c, wwtp_p, within_dist, near_dist, wwtp_out, indicators):
+    """Classify the plants in batches, append each batch to the shapefile
+    and aggregate the indicators, so the memory does not depend on the
+    number of plants. The GRASS engine needs the whole inputs, so the
+    KD-tree is used in its place: the urban sums can differ slightly from
+    the buffers, the result reports the engine and warns of the switch"""
+    engine = query_engine("large inputs", indicators)
+    summaries, stats = [], []
+    done = 0
+    dtypes = None
+    with stream.LayerWriter(wwtp_out) as writer:
+        for inputs in stream.read_batches(wwtp_c, wwtp_p, chunksize=STREAM_CHUNKSIZE):
+            cancel.check()
+            progress.report("classify batches", done)
+            plants = restore_plants(inputs, within_dist, near_dist, engine=engine)
+            if plants is None:
+                plants = query_plants(inputs, within_dist, near_dist, engine=engine)
+                store_plants(plants, inputs, within_dist, near_dist, engine=engine)
+            summaries.append(suitability_power(plants))
+            if REGIONS is not None:
+                stats.append(region_stats(plants, inputs))
+            if dtypes is None:
+                dtypes = layer_dtypes(inputs, within_dist, near_dist)
+            writer.write(stream.project(prepare_layer(plants2gdf(plants)), dtypes))
+            done += len(plants)
+    print(f"=> Classified {done} plants in batches of {STREAM_CHUNKSIZE}")
+    indicators = compute_indicators(
+        None, indicators, summary=pd.concat(summaries).groupby(level=0, sort=False).sum()
+    )
+    if stats:
+        compute_region_indicators(
+            None, None, indicators, stats=pd.concat(stats).groupby(level=0).sum()
         )
+    return build_result(
+        indicators, [shapefile_layer(output_directory, wwtp_out)], engine=engine
+    )
 
-        print("=> Compute the tech potential")
-        try:
-            tech.tech_potential(
-                wwtp_plants=WWTP,
-                urban_areas=URB,
-                dist_min=int(params["within_dist"]),
-                dist_max=int(params["near_dist"]),
-                capacity_col="capacity",
-                power_col="power",
-                suitability_col="suitability",
-                dist_col="distance_label",
-                plansize_col="plantsize_label",
-                conditional_col="conditional",
-                suitable_col="suitable",
-                overwrite=overwrite,
-            )
-        except Exception as exc:
-            print(f"Issue in mapset: {tmp._kwopen['mapset']}")
-            raise exc
-
-        print("=> Extract indicators")
-        indicators = extract_inidicators(WWTP, warnings)
-
-        print("=> export result")
-        tech.tech_export(wwtp_plants=WWTP, wwtp_out=wwtp_out, buffer=1.0, mapset=tmp._kwopen['mapset'])
-        # copy the output back to the repository to have a cache
-        print(
-            f"\n\n=> Compute the heatsource potential using: {within_dist} and {near_dist} m. Done!"
-        )
-    
-    
-    gdf = gpd.read_file(wwtp_out)
-    non_rows = gdf.color.values == None
-    if True in non_rows:
-        gdf.loc[non_rows, 'color'] = "#F34616"
-        gdf.loc[non_rows, 'fillColor'] = "#F34616"
-        gdf.loc[:, 'opacity'] = "0.8"
-    gdf = gdf.to_crs('EPSG:3035')
-    cols = list(gdf.columns)
-    # send color columns to the end
-    for item in ['color', 'fillColor', 'opacity', 'geometry']:
-        cols.pop(cols.index(item))
-        cols.append(item)
-    gdf = gdf[cols].copy()   
-    geometries = []
-    for geom in gdf.geometry:
-        geometries.append(geom.buffer(2000))
-    gdf.loc[:, 'geometry'] = geometries
-    gdf.to_file(wwtp_out)
-    gdf = None
-    
+
+def export_plants(output_directory, plants, output_format, wwtp_out):
+    """Export the plants with their input geometries and return the vector
+    layers of the CM result"""
+    cancel.check()
+    progress.report("export layer", len(plants), len(plants))
+    if output_format == "shapefile":
+        export_layer(plants2gdf(plants), wwtp_out)
+        return [shapefile_layer(output_directory, wwtp_out)]
+    if output_format == "mvt":
+        return [tiles_layer(output_directory, plants2gdf(plants))]
+    return [points_layer(output_directory, plants2gdf(plants), output_format)]
+
+
+def shapefile_layer(output_directory, wwtp_out):
+    """Zip the shapefile and return the vector layer of the CM result"""
     wwtp_zip = create_zip_shapefiles(output_directory, wwtp_out)
+    generate_etag(os.path.join(output_directory, wwtp_zip))
     print(f"CM OUTPUT {datetime.datetime.now():%Y-%m-%d %H:%M:%S}: {output_directory} => {wwtp_out} => {wwtp_zip}")
-    
+    return {
+        "name": "Heatsource potential - shapefile",
+        "path": wwtp_zip,
+        "type": "custom",
+        "symbology": SYMBOLOGY,
+    }
+
+
+def tiles_layer(output_directory, gdf):
+    """Write the plants as vector tiles and return the vector layer of the
+    CM result"""
+    wwtp_tiles = generate_output_file_mbtiles(output_directory)
+    tiles.write_mbtiles(fill_style(gdf), wwtp_tiles, maxzoom=TILES_MAXZOOM)
+    generate_etag(wwtp_tiles)
+    print(f"CM OUTPUT {datetime.datetime.now():%Y-%m-%d %H:%M:%S}: {output_directory} => {wwtp_tiles}")
+    return {
+        "name": "Heatsource potential - vector tiles",
+        "path": os.path.basename(wwtp_tiles),
+        # served tile by tile by the CM
+        "tiles": f"tiles/{os.path.basename(wwtp_tiles)}/{{z}}/{{x}}/{{y}}.pbf",
+        "type": "custom",
+        "symbology": SYMBOLOGY,
+    }
+
+
+def points_layer(output_directory, gdf, output_format):
+    """Write the plants as points with the full column names, as GeoParquet
+    or as FlatGeobuf with a spatial index, and return the vector layer of
+    the CM result"""
+    gdf = fill_style(gdf)
+    if output_format == "geoparquet":
+        wwtp_points = generate_output_file_parquet(output_directory)
+        columnar.write_geoparquet(gdf, wwtp_points)
+        name = "GeoParquet"
+    else:
+        wwtp_points = generate_output_file_fgb(output_directory)
+        gdf.to_file(wwtp_points, driver="FlatGeobuf", SPATIAL_INDEX="YES")
+        name = "FlatGeobuf"
+    generate_etag(wwtp_points)
+    print(f"CM OUTPUT {datetime.datetime.now():%Y-%m-%d %H:%M:%S}: {output_directory} => {wwtp_points}")
+    return {
+        "name": f"Heatsource potential - {name}",
+        "path": os.path.basename(wwtp_points),
+        "type": "custom",
+        "symbology": SYMBOLOGY,
+    }
+
+
+def build_result(indicators, vector_layers, engine=URBAN_ENGINE):
+    """Return the CM result, with the engine that computed the urban sums"""
     result = dict()
     result["name"] = CM_NAME
+    result["engine"] = engine
     result["indicator"] = indicators
     result["graphics"] = []
-
-    result["vector_layers"] = [
-        {
-            "name": "Heatsource potential - shapefile",
-            "path": wwtp_zip,
-            "type": "custom",
-            "symbology": [
-                {
-                    "red": 24,
-                    "green": 139,
-                    "blue": 125,
-                    "opacity": 0.8,
-                    "value": "Suitable",
-                    "label": "Suitable",
-                },
-                {
-                    "red": 217,
-                    "green": 194,
-                    "blue": 89,
-                    "opacity": 0.8,
-                    "value": "Conditionally",
-                    "label": "Conditionally",
-                },
-                {
-                    "red": 243,
-                    "green": 70,
-                    "blue": 22,
-                    "opacity": 0.8,
-                    "value": "Not suitable",
-                    "label": "Not suitable",
-                },
-            ],
-        },
-    ]
-
+    result["vector_layers"] = vector_layers
     result["raster_layers"] = []
     print("result", result)
     return result
+
@@ -0,0 +1,153 @@
+"""
+Download the files required by the calculation module
+=====================================================
+
+All the downloads share a pooled HTTP session with bounded retries, files
+are streamed with large buffered writes in a temporary file that is renamed
+only once the download is complete, so a partial file is never left behind.
+"""
+import logging
+import os
+import pathlib
+import stat
+import tempfile
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Any, Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ..constant import (
+    DOWNLOAD_CHUNK_SIZE,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_TIMEOUT,
+    DOWNLOAD_WORKERS,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+_file_mode = None
+
+
+def file_mode() -> int:
+    """Return the mode of the files created with open(), the temporary
+    files are created with mode 0600 and changed to it before they are
+    renamed. The mode is read from a new file, so the process umask is
+    never changed"""
+    global _file_mode
+    if _file_mode is None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "mode")
+            with open(path, "wb"):
+                pass
+            _file_mode = stat.S_IMODE(os.stat(path).st_mode)
+    return _file_mode
+
+
+def get_session() -> requests.Session:
+    """Return the HTTP session shared by all the downloads of the process"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=DOWNLOAD_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+            )
+            adapter = HTTPAdapter(
+                pool_connections=DOWNLOAD_WORKERS,
+                pool_maxsize=DOWNLOAD_WORKERS,
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+    return _session
+
+
+def download(
+    url: str, filepath: str, timeout: float = DOWNLOAD_TIMEOUT, **kwargs
+) -> pathlib.Path:
+    """Download the url to filepath, the file is renamed atomically only
+    once the whole content is on disk.
+
+    Args:
+        url: the URL of the file to download
+        filepath: the destination path
+        timeout: connect/read timeout in seconds
+        kwargs: additional arguments passed to `requests.Session.get`
+                (e.g. params, headers, cookies)
+    Return:
+        filepath: the path of the downloaded file
+    """
+    filepath = pathlib.Path(filepath)
+    print(f"Download {filepath} from: {url}")
+    with get_session().get(url, stream=True, timeout=timeout, **kwargs) as response:
+        response.raise_for_status()
+        fd, tmppath = tempfile.mkstemp(
+            dir=filepath.parent, prefix=f".{filepath.name}.", suffix=".part"
+        )
+        try:
+            with os.fdopen(fd, mode="wb", buffering=DOWNLOAD_CHUNK_SIZE) as tmpfile:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    tmpfile.write(chunk)
+            os.chmod(tmppath, file_mode())
+            os.replace(tmppath, filepath)
+        except BaseException:
+            os.unlink(tmppath)
+            raise
+    return filepath
+
+
+def download_all(
+    files: Dict[str, Dict[str, Any]],
+    max_workers: int = DOWNLOAD_WORKERS,
+    overwrite: bool = False,
+) -> Dict[str, pathlib.Path]:
+    """Download in parallel all the files.
+
+    Args:
+        files: a dictionary with key the name of the file and value
+               a dictionary with the `url`, the `filepath` and the other
+               arguments accepted by `download`
+        max_workers: maximum number of concurrent downloads
+        overwrite: download again the files that are already on disk
+    Return:
+        paths: a dictionary with key the name of the file and value the path.
+               The function returns once all the files are on disk or
+               raises the first error, cancelling the pending downloads.
+    """
+    paths = {}
+    todo = {}
+    for name, kwargs in files.items():
+        filepath = pathlib.Path(kwargs["filepath"])
+        if filepath.exists() and not overwrite:
+            paths[name] = filepath
+        else:
+            todo[name] = kwargs
+
+    if not todo:
+        return paths
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(todo)))
+    futures = {
+        executor.submit(download, **kwargs): name for name, kwargs in todo.items()
+    }
+    done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+    for future in pending:
+        future.cancel()
+    # do not wait the downloads that are still running if something failed
+    executor.shutdown(wait=not pending)
+    for future in done:
+        exc = future.exception()
+        if exc is not None:
+            LOGGER.error(f"Failed to download: {futures[future]} >> {exc}")
+            raise exc
+        paths[futures[future]] = future.result()
+    return paths
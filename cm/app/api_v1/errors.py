@@ -1,7 +1,7 @@
 from flask import jsonify
 
 from . import api
-from ..exceptions import ValidationError
+from ..exceptions import Cancelled, DeadlineExceeded, ValidationError
 
 
 @api.errorhandler(ValidationError)
@@ -11,10 +11,25 @@ def bad_request(e):
     response.status_code = 400
     return response
 
+@api.errorhandler(Cancelled)
+def cancelled(e):
+    response = jsonify({'status': 409, 'error': 'cancelled',
+                        'message': e.args[0]})
+    response.status_code = 409
+    return response
+
+@api.errorhandler(DeadlineExceeded)
+def deadline_exceeded(e):
+    response = jsonify({'status': 504, 'error': 'timeout',
+                        'message': e.args[0]})
+    response.status_code = 504
+    return response
+
 @api.errorhandler(404)
-def request_not_passing():
-    response = {'status': 444,'status_code': 404, 'error': 'look like the request is not passing',
-                        'message': 'look like the request is not passing'}
+def request_not_passing(e):
+    response = jsonify({'status': 444,'status_code': 404, 'error': 'look like the request is not passing',
+                        'message': 'look like the request is not passing'})
+    response.status_code = 404
     return response
 
 
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Classify heat sources with a lookup table
+=========================================
+
+The suitability matrix, the distance conditions and the plant size classes
+are compiled once into sorted break points and an integer lookup array.
+Each plant is then classified locating its capacity and its urban sums
+among the break points with `searchsorted` and reading the lookup array
+with a single fancy-index.
+
+The classes are applied in the order of the suitability matrix, the same
+order of the SQL updates once run in the GRASS table, so when more
+conditions hold the last one wins. All the engines, the GRASS buffers
+included, classify the plants with this lookup table.
+"""
+import json
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ...constant import CLASSIFIER_CONFIG
+
+CONDITION = re.compile(r"^\s*(<=|>=|<|>|=)\s*(-?\d+(?:\.\d+)?)\s*$")
+
+OPERATORS = {
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "=": np.equal,
+}
+
+
+def parse_condition(condition: str) -> Tuple[str, float]:
+    """Split a condition like `>= 25` in the operator and the value"""
+    match = CONDITION.match(condition)
+    if match is None:
+        raise ValueError(f"Invalid condition: {condition!r}")
+    return match.group(1), float(match.group(2))
+
+
+def size_conditions(cmin: float, cmax: Optional[float]) -> List[Tuple[str, float]]:
+    """Return the conditions of a plant size class (cmin, cmax]"""
+    conds = [(">", float(cmin))]
+    if cmax is not None:
+        conds.append(("<=", float(cmax)))
+    return conds
+
+
+class Axis(object):
+    """Break points of a variable, the values are mapped to the elementary
+    segments delimited by the break points: (-inf, b0), [b0], (b0, b1), ...
+    """
+
+    def __init__(self, conditions: Sequence[Tuple[str, float]]):
+        self.breaks = np.unique([value for _, value in conditions])
+
+    @property
+    def size(self) -> int:
+        return 2 * len(self.breaks) + 1
+
+    def representatives(self) -> np.ndarray:
+        """Return a value for each elementary segment"""
+        brk = self.breaks
+        if len(brk) == 0:
+            return np.zeros(1)
+        inner = (brk[:-1] + brk[1:]) / 2.0
+        gaps = np.concatenate([[brk[0] - 1], inner, [brk[-1] + 1]])
+        reps = np.empty(self.size)
+        reps[0::2] = gaps
+        reps[1::2] = brk
+        return reps
+
+    def locate(self, values: np.ndarray) -> np.ndarray:
+        """Return the index of the elementary segment of each value"""
+        values = np.asarray(values, dtype=float)
+        return np.searchsorted(self.breaks, values, side="left") + np.searchsorted(
+            self.breaks, values, side="right"
+        )
+
+
+def _matches(conditions: Sequence[Tuple[str, float]], reps: np.ndarray) -> np.ndarray:
+    mask = np.ones(len(reps), dtype=bool)
+    for oper, value in conditions:
+        mask &= OPERATORS[oper](reps, value)
+    return mask
+
+
+class Classifier(object):
+    """Classify plants given their capacity and the urban sums computed
+    within the minimum and maximum distances."""
+
+    def __init__(
+        self,
+        matrix: pd.DataFrame,
+        distances: Dict[str, Sequence[str]],
+        sizes: Dict[str, Sequence[Optional[float]]],
+        colors: Dict[str, str],
+    ):
+        self.colors = dict(colors)
+        dconds = {
+            label: [parse_condition(cond) for cond in conds]
+            for label, conds in distances.items()
+        }
+        sconds = {label: size_conditions(*bounds) for label, bounds in sizes.items()}
+
+        self.capacity = Axis([cond for conds in sconds.values() for cond in conds])
+        self.dmin = Axis([conds[0] for conds in dconds.values()])
+        self.dmax = Axis([conds[1] for conds in dconds.values()])
+
+        # cells of the matrix, column by column as the classes are applied
+        cells = list(matrix.unstack().items())
+        self.suitability = np.array([sustain for _, sustain in cells] + [None], dtype=object)
+        self.dist_labels = np.array([dlabel for (dlabel, _), _ in cells] + [None], dtype=object)
+        self.size_labels = np.array([clabel for (_, clabel), _ in cells] + [None], dtype=object)
+        self.color_labels = np.array(
+            [self.colors[sustain] for _, sustain in cells] + [None], dtype=object
+        )
+
+        # the last index is used for the plants that are not classified
+        self.unclassified = len(cells)
+        lut = np.full(
+            (self.capacity.size, self.dmin.size, self.dmax.size), self.unclassified
+        )
+        cap_reps = self.capacity.representatives()
+        dmin_reps = self.dmin.representatives()
+        dmax_reps = self.dmax.representatives()
+        for icell, ((dlabel, clabel), _) in enumerate(cells):
+            (dmin_cond, dmax_cond) = dconds[dlabel]
+            mask = (
+                _matches(sconds[clabel], cap_reps)[:, None, None]
+                & _matches([dmin_cond], dmin_reps)[None, :, None]
+                & _matches([dmax_cond], dmax_reps)[None, None, :]
+            )
+            lut[mask] = icell
+        self.lut = lut
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "Classifier":
+        """Create a classifier from a dictionary with the keys: `matrix`
+        (dictionary of rows with the plant size as key and a dictionary of
+        distance label and class as value), `distances`, `sizes` and
+        `colors`"""
+        matrix = pd.DataFrame.from_dict(config["matrix"], orient="index")
+        return cls(
+            matrix=matrix[list(config["distances"])].loc[list(config["sizes"])],
+            distances=config["distances"],
+            sizes=config["sizes"],
+            colors=config["colors"],
+        )
+
+    @classmethod
+    def from_json(cls, path: str) -> "Classifier":
+        with open(path) as jfile:
+            return cls.from_config(json.load(jfile))
+
+    def classify(
+        self, capacity: np.ndarray, dmin_sum: np.ndarray, dmax_sum: np.ndarray
+    ) -> np.ndarray:
+        """Return the index of the matrix cell of each plant, the plants
+        with NaN values are not classified"""
+        values = [np.asarray(val, dtype=float) for val in (capacity, dmin_sum, dmax_sum)]
+        idx = self.lut[
+            self.capacity.locate(values[0]),
+            self.dmin.locate(values[1]),
+            self.dmax.locate(values[2]),
+        ]
+        finite = np.isfinite(values[0]) & np.isfinite(values[1]) & np.isfinite(values[2])
+        return np.where(finite, idx, self.unclassified)
+
+    def labels(
+        self, capacity: np.ndarray, dmin_sum: np.ndarray, dmax_sum: np.ndarray
+    ) -> Dict[str, np.ndarray]:
+        """Return the class, the distance label, the size label and the
+        color of each plant, not classified plants are None"""
+        idx = self.classify(capacity, dmin_sum, dmax_sum)
+        return dict(
+            suitability=self.suitability[idx],
+            distance_label=self.dist_labels[idx],
+            plantsize_label=self.size_labels[idx],
+            color=self.color_labels[idx],
+        )
+
+
+def default_config() -> Dict:
+    """Return the configuration of the WWTP classifier"""
+    from . import technical as tech
+
+    return dict(
+        matrix=tech.SUSTAINABILITY.to_dict(orient="index"),
+        distances=tech.DIST_DICT,
+        sizes=tech.PLANT_SIZE,
+        colors=tech.COLORS,
+    )
+
+
+_classifiers = {}
+
+
+def get_classifier(path: Optional[str] = CLASSIFIER_CONFIG) -> Classifier:
+    """Return the classifier compiled from the JSON file or the WWTP
+    classifier if path is None, classifiers are compiled only once"""
+    if path not in _classifiers:
+        if path is None:
+            _classifiers[path] = Classifier.from_config(default_config())
+        else:
+            _classifiers[path] = Classifier.from_json(path)
+    return _classifiers[path]
+
+
+def classify_plants(
+    plants: pd.DataFrame,
+    dist_min: int = 150,
+    dist_max: int = 1000,
+    classifier: Optional[Classifier] = None,
+    capacity_col: str = "capacity",
+    suitability_col: str = "suitability",
+    dist_col: str = "distance_label",
+    plansize_col: str = "plantsize_label",
+) -> pd.DataFrame:
+    """Update the label and style columns of the plants given the urban
+    sums `dist{dist_min}m_sum` and `dist{dist_max}m_sum`"""
+    classifier = get_classifier() if classifier is None else classifier
+    labels = classifier.labels(
+        plants[capacity_col].values,
+        plants[f"dist{dist_min:d}m_sum"].values,
+        plants[f"dist{dist_max:d}m_sum"].values,
+    )
+    plants[suitability_col] = labels["suitability"]
+    plants[dist_col] = labels["distance_label"]
+    plants[plansize_col] = labels["plantsize_label"]
+    plants["color"] = labels["color"]
+    plants["fillColor"] = labels["color"]
+    plants["opacity"] = np.where(pd.notna(labels["color"]), 0.8, np.nan)
+    return plants
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Read and write the WWTP as columnar files
+=========================================
+
+Besides the CSV files the plants can be submitted as Parquet, GeoParquet
+or Arrow IPC (Feather v2) files. The columns are typed and the GeoParquet
+files carry the CRS of the geometries, so no sidecar files are needed.
+The format is detected from the magic bytes of the file, the platform
+does not always keep the extension, and then from the extension.
+
+The columnar files are converted to the same table read from the CSV
+files: the geometries as `geometry_wkt` and their EPSG code as `srid`.
+GRASS imports only the CSV files, so the columnar inputs are classified
+with the KD-tree or the pyramid engine, never converted to another file.
+The classified plants can be written as GeoParquet, keeping the full
+column names and the point geometries.
+"""
+import json
+import os
+from typing import Iterator, List
+
+import pandas as pd
+
+from ...exceptions import ValidationError
+
+PARQUET_MAGIC = b"PAR1"
+ARROW_MAGIC = b"ARROW1"
+EXTENSIONS = {
+    ".parquet": "parquet",
+    ".geoparquet": "parquet",
+    ".pq": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".ipc": "arrow",
+}
+# CRS of the GeoParquet geometries when the metadata do not define it
+DEFAULT_SRID = 4326
+
+
+def input_format(path: str) -> str:
+    """Return the format of the input file: parquet, arrow or csv"""
+    with open(path, "rb") as fobj:
+        magic = fobj.read(len(ARROW_MAGIC))
+    if magic.startswith(PARQUET_MAGIC):
+        return "parquet"
+    if magic == ARROW_MAGIC:
+        return "arrow"
+    return EXTENSIONS.get(os.path.splitext(os.fspath(path))[1].lower(), "csv")
+
+
+def is_columnar(path: str) -> bool:
+    return input_format(path) != "csv"
+
+
+def _srid(crs) -> int:
+    """Return the EPSG code of the GeoParquet CRS (PROJJSON), raise a
+    ValidationError if the CRS has no EPSG code"""
+    if crs is None:
+        return DEFAULT_SRID
+    if isinstance(crs, dict):
+        ident = crs.get("id", {})
+        if str(ident.get("authority", "")).upper() == "EPSG" and "code" in ident:
+            return int(ident["code"])
+        if ident.get("authority") == "OGC" and ident.get("code") == "CRS84":
+            return DEFAULT_SRID
+    from pyproj import CRS
+    from pyproj.exceptions import CRSError
+
+    try:
+        srid = CRS.from_user_input(crs).to_epsg()
+    except CRSError as exc:
+        raise ValidationError(f"Invalid CRS of the GeoParquet geometries: {exc}")
+    if srid is None:
+        raise ValidationError("The CRS of the GeoParquet geometries has no EPSG code")
+    return srid
+
+
+def to_frame(table) -> pd.DataFrame:
+    """Convert the Arrow table into the plants table, the GeoParquet
+    geometries are converted to WKT"""
+    frame = table.to_pandas(split_blocks=True)
+    metadata = table.schema.metadata or {}
+    if b"geo" not in metadata:
+        return frame
+    from shapely import wkb
+
+    geo = json.loads(metadata[b"geo"])
+    column = geo["primary_column"]
+    if column in frame.columns:
+        frame.insert(
+            0,
+            "geometry_wkt",
+            [None if geom is None else wkb.loads(bytes(geom)).wkt for geom in frame[column]],
+        )
+        if "srid" not in frame.columns:
+            frame.insert(1, "srid", _srid(geo["columns"][column].get("crs")))
+        frame = frame.drop(columns=column)
+    return frame
+
+
+def _columns(schema, columns: List[str]):
+    """Return the columns to read, with the geometry of the GeoParquet
+    files instead of geometry_wkt"""
+    if columns is None:
+        return None
+    metadata = schema.metadata or {}
+    if b"geo" in metadata and "geometry_wkt" in columns:
+        primary = json.loads(metadata[b"geo"])["primary_column"]
+        columns = [primary if col == "geometry_wkt" else col for col in columns]
+    return [col for col in columns if col in schema.names]
+
+
+def read_table(path: str, columns: List[str] = None) -> pd.DataFrame:
+    """Read the columnar file, the file is memory mapped"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = os.fspath(path)
+    if input_format(path) == "parquet":
+        pfile = pq.ParquetFile(path, memory_map=True)
+        table = pfile.read(columns=_columns(pfile.schema_arrow, columns))
+    else:
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        if columns is not None:
+            table = table.select(_columns(table.schema, columns))
+    return to_frame(table)
+
+
+def iter_batches(
+    path: str, chunksize: int, columns: List[str] = None
+) -> Iterator[pd.DataFrame]:
+    """Yield the rows of the columnar file in batches of chunksize rows"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = os.fspath(path)
+    if input_format(path) == "parquet":
+        pfile = pq.ParquetFile(path, memory_map=True)
+        schema = pfile.schema_arrow
+        batches = pfile.iter_batches(
+            batch_size=chunksize, columns=_columns(schema, columns)
+        )
+    else:
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        schema = reader.schema
+        table = reader.read_all()
+        if columns is not None:
+            table = table.select(_columns(schema, columns))
+        batches = table.to_batches(max_chunksize=chunksize)
+    for batch in batches:
+        yield to_frame(pa.Table.from_batches([batch]).replace_schema_metadata(schema.metadata))
+
+
+def write_geoparquet(gdf, path: str):
+    """Write the GeoDataFrame as GeoParquet (1.0.0) with WKB geometries"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    column = gdf.geometry.name
+    frame = pd.DataFrame(gdf.drop(columns=column))
+    frame[column] = [None if geom is None else geom.wkb for geom in gdf.geometry]
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    meta = dict(encoding="WKB", geometry_types=sorted(set(gdf.geom_type.dropna())))
+    if gdf.crs is not None:
+        meta["crs"] = gdf.crs.to_json_dict()
+    if len(gdf):
+        meta["bbox"] = [float(val) for val in gdf.total_bounds]
+    geo = dict(version="1.0.0", primary_column=column, columns={column: meta})
+    metadata = dict(table.schema.metadata or {}, geo=json.dumps(geo))
+    pq.write_table(table.replace_schema_metadata(metadata), os.fspath(path))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Query the urban areas with a KD-tree
+====================================
+
+Instead of buffering each plant and summing the urban cells inside the
+buffers with `v.rast.stats`, the centroids of the urban cells are indexed
+once per location with a KD-tree. Each batch of plants is then queried for
+the distance to the nearest urban cell and for the number of urban cells
+within the distance thresholds, the cost is O(n log m) and it does not
+depend on the buffer geometries.
+
+The tree is saved next to the GRASS location and it is loaded only once
+per process.
+"""
+import os
+import pickle
+import secrets
+import tempfile
+import threading
+from typing import Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+# number of raster rows read at once
+ROWS = 2048
+
+_trees = {}
+_trees_lock = threading.Lock()
+
+
+def urban_cells(urban_areas: str, rows: int = ROWS) -> Tuple[np.ndarray, float]:
+    """Return the coordinates of the centroids of the non-null cells of the
+    urban areas raster and the raster resolution, the raster is read in
+    bands of rows to bound the memory"""
+    from .technical import raster_bands, raster_region
+
+    reg = raster_region(urban_areas)
+    coords = []
+    for row, band in raster_bands(urban_areas, rows=rows):
+        irow, icol = np.nonzero(np.isfinite(band) & (band > 0))
+        coords.append(
+            np.column_stack(
+                [
+                    reg["w"] + (icol + 0.5) * reg["ewres"],
+                    reg["n"] - (row + irow + 0.5) * reg["nsres"],
+                ]
+            )
+        )
+    return np.concatenate(coords) if coords else np.empty((0, 2)), reg["nsres"]
+
+
+class UrbanTree(object):
+    """KD-tree of the centroids of the urban cells"""
+
+    def __init__(self, coords: np.ndarray, resolution: float):
+        self.resolution = resolution
+        self.tree = cKDTree(coords, balanced_tree=False, compact_nodes=False)
+
+    @classmethod
+    def from_raster(cls, urban_areas: str, rows: int = ROWS) -> "UrbanTree":
+        return cls(*urban_cells(urban_areas, rows=rows))
+
+    @classmethod
+    def load(cls, path: str) -> "UrbanTree":
+        with open(path, "rb") as pfile:
+            return pickle.load(pfile)
+
+    def save(self, path: str):
+        """Save the tree, the file is renamed atomically once written"""
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.fspath(path)))
+        try:
+            with os.fdopen(fd, "wb") as pfile:
+                pickle.dump(self, pfile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def query(
+        self, x: np.ndarray, y: np.ndarray, distances: Iterable[int]
+    ) -> pd.DataFrame:
+        """Return the distance to the nearest urban cell (`urban_dist`) and
+        the number of urban cells within each distance (`dist{d}m_sum`)"""
+        points = np.column_stack([np.asarray(x, float), np.asarray(y, float)])
+        result = {}
+        if self.tree.n:
+            result["urban_dist"], _ = self.tree.query(points)
+        else:
+            result["urban_dist"] = np.full(len(points), np.inf)
+        for distance in distances:
+            result[f"dist{distance:d}m_sum"] = self.tree.query_ball_point(
+                points, r=distance, return_length=True
+            ).astype(float)
+        return pd.DataFrame(result)
+
+
+def tree_path(gisdb: str, location: str, urban_areas: str) -> str:
+    return os.path.join(os.fspath(gisdb), location, f"{urban_areas}.kdtree")
+
+
+def get_tree(gisdb: str, location: str, urban_areas: str) -> UrbanTree:
+    """Return the tree of the urban areas of the location, the tree is
+    loaded from disk or built and saved if missing"""
+    path = tree_path(gisdb, location, urban_areas)
+    with _trees_lock:
+        if path not in _trees:
+            if not os.path.exists(path):
+                from grass_session import TmpSession
+
+                with TmpSession(
+                    gisdb=os.fspath(gisdb),
+                    location=location,
+                    mapset=f"mset_{secrets.token_urlsafe(8)}",
+                    create_opts="",
+                ):
+                    print(f"» Build the KD-tree of {urban_areas}")
+                    UrbanTree.from_raster(f"{urban_areas}@PERMANENT").save(path)
+            _trees[path] = UrbanTree.load(path)
+    return _trees[path]
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Classify the plants with a pyramid of the urban areas
+=====================================================
+
+Most of the plants are either deep in a city or far from any urban area,
+so the number of urban cells around them does not need to be exact to
+classify them. The pyramid keeps the urban mask at full resolution and
+its sum-pooled overviews, each level halving the resolution.
+
+For each distance the plants are first tested against the coarse blocks:
+the blocks completely inside the circle give a lower bound of the urban
+cells, the blocks touching the circle an upper bound. When both bounds fall
+in the same class of the classifier the plant is decided, otherwise the
+plant is tested again at the next finer level, down to the full
+resolution where the count is exact. The plants decided at a coarse level
+have only a lower bound of the urban cells, so their sums are returned
+together with a mask of the exact ones.
+
+The levels are saved as `.npy` files next to the GRASS location and they
+are memory mapped, so only the blocks around the plants are read.
+"""
+import json
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+from typing import Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# number of raster rows read at once
+ROWS = 2048
+# number of blocks of the window around the plants of the first level
+WINDOW = 8
+# maximum number of cells gathered at once
+BATCH = 1 << 22
+
+_pyramids = {}
+_pyramids_lock = threading.Lock()
+
+
+def pool(array: np.ndarray, out: np.ndarray, rows: int = ROWS):
+    """Sum the blocks of 2x2 cells of array into out, processing the rows
+    in bands"""
+    nrows, ncols = array.shape
+    rows += rows % 2
+    for row in range(0, nrows, rows):
+        band = np.asarray(array[row : row + rows], dtype=np.uint32)
+        # pad to an even number of rows and columns
+        band = np.pad(band, ((0, band.shape[0] % 2), (0, ncols % 2)))
+        out[row // 2 : row // 2 + band.shape[0] // 2] = band.reshape(
+            band.shape[0] // 2, 2, band.shape[1] // 2, 2
+        ).sum(axis=(1, 3))
+
+
+class UrbanPyramid(object):
+    """Urban mask and its sum-pooled overviews"""
+
+    def __init__(self, levels: List[np.ndarray], west: float, north: float, res: float):
+        self.levels = levels
+        self.west = west
+        self.north = north
+        self.res = res
+
+    @classmethod
+    def from_array(
+        cls, mask: np.ndarray, west: float, north: float, res: float
+    ) -> "UrbanPyramid":
+        """Build the pyramid in memory from the urban mask"""
+        levels = [np.asarray(mask > 0, dtype=np.uint8)]
+        while min(levels[-1].shape) > 1:
+            shape = ((levels[-1].shape[0] + 1) // 2, (levels[-1].shape[1] + 1) // 2)
+            coarse = np.empty(shape, dtype=np.uint32)
+            pool(levels[-1], coarse)
+            levels.append(coarse)
+        return cls(levels, west, north, res)
+
+    @classmethod
+    def build(cls, urban_areas: str, path: str, rows: int = ROWS) -> "UrbanPyramid":
+        """Build the pyramid of the urban areas raster in the path directory,
+        the directory is renamed atomically once all the levels are saved"""
+        from .technical import raster_bands, raster_region
+
+        reg = raster_region(urban_areas)
+        path = os.fspath(path)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(path))
+        try:
+            shape = (int(reg["rows"]), int(reg["cols"]))
+            level = np.lib.format.open_memmap(
+                os.path.join(tmp, "level0.npy"), mode="w+", dtype=np.uint8, shape=shape
+            )
+            for row, band in raster_bands(urban_areas, rows=rows):
+                level[row : row + band.shape[0]] = np.isfinite(band) & (band > 0)
+            nlevel = 0
+            while min(level.shape) > 1:
+                nlevel += 1
+                shape = ((level.shape[0] + 1) // 2, (level.shape[1] + 1) // 2)
+                coarse = np.lib.format.open_memmap(
+                    os.path.join(tmp, f"level{nlevel}.npy"),
+                    mode="w+",
+                    dtype=np.uint32,
+                    shape=shape,
+                )
+                pool(level, coarse, rows=rows)
+                level.flush()
+                level = coarse
+            level.flush()
+            with open(os.path.join(tmp, "pyramid.json"), "w") as jfile:
+                json.dump(
+                    dict(levels=nlevel + 1, west=reg["w"], north=reg["n"], res=reg["nsres"]),
+                    jfile,
+                )
+            os.replace(tmp, path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path: str) -> "UrbanPyramid":
+        with open(os.path.join(path, "pyramid.json")) as jfile:
+            meta = json.load(jfile)
+        levels = [
+            np.load(os.path.join(path, f"level{level}.npy"), mmap_mode="r")
+            for level in range(meta["levels"])
+        ]
+        return cls(levels, meta["west"], meta["north"], meta["res"])
+
+    def bounds(self, level: int, x: np.ndarray, y: np.ndarray, distance: float):
+        """Return the lower and the upper bound of the number of urban cells
+        with the centroid within distance from the points, at level 0 the
+        two bounds are the exact count"""
+        array = self.levels[level]
+        block = 2 ** level
+        side = block * self.res
+        # number of blocks of the window around the points
+        size = int(np.ceil(2 * distance / side)) + 2
+        offsets = np.arange(size)
+        lower = np.zeros(len(x), dtype=np.int64)
+        upper = np.zeros(len(x), dtype=np.int64)
+        step = max(1, BATCH // (size * size))
+        for start in range(0, len(x), step):
+            px, py = x[start : start + step], y[start : start + step]
+            col0 = np.floor((px - distance - self.west) / side).astype(np.int64)
+            row0 = np.floor((self.north - py - distance) / side).astype(np.int64)
+            cols = col0[:, None] + offsets[None, :]
+            rows = row0[:, None] + offsets[None, :]
+            # extent of the centroids of the cells of each block
+            xmin = self.west + cols * side + self.res / 2
+            xmax = xmin + side - self.res
+            ymax = self.north - rows * side - self.res / 2
+            ymin = ymax - side + self.res
+            dx = px[:, None] - np.clip(px[:, None], xmin, xmax)
+            dy = py[:, None] - np.clip(py[:, None], ymin, ymax)
+            fx = np.maximum(np.abs(px[:, None] - xmin), np.abs(px[:, None] - xmax))
+            fy = np.maximum(np.abs(py[:, None] - ymin), np.abs(py[:, None] - ymax))
+            touch = dy[:, :, None] ** 2 + dx[:, None, :] ** 2 <= distance ** 2
+            inside = fy[:, :, None] ** 2 + fx[:, None, :] ** 2 <= distance ** 2
+            valid = (
+                ((rows >= 0) & (rows < array.shape[0]))[:, :, None]
+                & ((cols >= 0) & (cols < array.shape[1]))[:, None, :]
+            )
+            counts = np.where(
+                valid,
+                array[
+                    np.clip(rows, 0, array.shape[0] - 1)[:, :, None],
+                    np.clip(cols, 0, array.shape[1] - 1)[:, None, :],
+                ],
+                0,
+            ).astype(np.int64)
+            lower[start : start + step] = (counts * inside).sum(axis=(1, 2))
+            upper[start : start + step] = (counts * touch).sum(axis=(1, 2))
+        return lower, upper
+
+    def start_level(self, distance: float) -> int:
+        """Return the level with about WINDOW blocks around the points"""
+        level = int(np.floor(np.log2(max(2 * distance / (WINDOW * self.res), 1))))
+        return min(level, len(self.levels) - 1)
+
+    def count(
+        self, x: np.ndarray, y: np.ndarray, distance: float, axis=None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the number of urban cells within distance from the points
+        and the mask of the exact counts. If the axis of the classifier is
+        given the count is exact only for the plants that could not be
+        classified with the coarse levels, for the others the lower bound
+        that gives the same class is returned"""
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        result = np.zeros(len(x))
+        exact = np.zeros(len(x), dtype=bool)
+        todo = np.arange(len(x))
+        level = self.start_level(distance) if axis is not None else 0
+        while len(todo):
+            lower, upper = self.bounds(level, x[todo], y[todo], distance)
+            if level == 0:
+                result[todo] = lower
+                exact[todo] = True
+                break
+            decided = axis.locate(lower) == axis.locate(upper)
+            result[todo[decided]] = lower[decided]
+            # the bounds of a block are the same when there is no partial
+            # block on the circle, then the count is exact at this level too
+            exact[todo[decided]] = lower[decided] == upper[decided]
+            todo = todo[~decided]
+            level -= 1
+        return result, exact
+
+    def query(
+        self, x: np.ndarray, y: np.ndarray, distances: Iterable[int], axes=None
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Return the number of urban cells within each distance
+        (`dist{d}m_sum`) and the mask of the exact counts, axes are the
+        classifier axes of each distance. The counts that are not exact are
+        lower bounds, to be used only to classify the plants"""
+        distances = list(distances)
+        axes = [None] * len(distances) if axes is None else axes
+        sums, exact = {}, {}
+        for distance, axis in zip(distances, axes):
+            col = f"dist{distance:d}m_sum"
+            sums[col], exact[col] = self.count(x, y, distance, axis)
+        return pd.DataFrame(sums), pd.DataFrame(exact)
+
+
+def pyramid_path(gisdb: str, location: str, urban_areas: str) -> str:
+    return os.path.join(os.fspath(gisdb), location, f"{urban_areas}.pyramid")
+
+
+def build_pyramid(urban_areas: str, path: str):
+    """Build the pyramid in the current GRASS session, it is used as action
+    when the location is created"""
+    print(f"» Build the pyramid of {urban_areas}")
+    UrbanPyramid.build(urban_areas, path)
+
+
+def get_pyramid(gisdb: str, location: str, urban_areas: str) -> UrbanPyramid:
+    """Return the pyramid of the urban areas of the location, the pyramid
+    is loaded from disk or built if missing"""
+    path = pyramid_path(gisdb, location, urban_areas)
+    with _pyramids_lock:
+        if path not in _pyramids:
+            if not os.path.exists(path):
+                from grass_session import TmpSession
+
+                with TmpSession(
+                    gisdb=os.fspath(gisdb),
+                    location=location,
+                    mapset=f"mset_{secrets.token_urlsafe(8)}",
+                    create_opts="",
+                ):
+                    build_pyramid(f"{urban_areas}@PERMANENT", path)
+            _pyramids[path] = UrbanPyramid.load(path)
+    return _pyramids[path]
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persist the WWTP classification
+===============================
+
+The urban statistics and the suitability classes computed by
+`technical.tech_potential` depend only on the plant geometry, on its
+capacity and on the distance thresholds, while the power only affects the
+power weighted columns. The store keeps the classification of each plant
+so a request that changes only the power values can skip the GRASS
+computation. The `meta` table records how the plants were classified, e.g.
+the urban engine.
+"""
+import hashlib
+import sqlite3
+from typing import Iterable, List, Optional
+
+import pandas as pd
+from shapely import wkt
+
+# columns persisted for each plant, {dmin} and {dmax} are replaced with the
+# distances used for the classification
+COLUMNS = (
+    "urban_dist",
+    "dist{dmin:d}m_sum",
+    "dist{dmax:d}m_sum",
+    "suitability",
+    "distance_label",
+    "plantsize_label",
+)
+
+# columns of the plants table, in the order of COLUMNS
+FIELDS = (
+    "urban_dist",
+    "dmin_sum",
+    "dmax_sum",
+    "suitability",
+    "distance_label",
+    "plantsize_label",
+)
+
+# maximum number of variables in a single SQLite query
+CHUNK = 500
+# decimals of the coordinates used in the keys
+PRECISION = 6
+
+
+def normalize(geometry: str, precision: int = PRECISION) -> str:
+    """Return the WKT of the geometry with rounded coordinates, so the same
+    point written with a different precision or formatting has the same
+    key"""
+    return wkt.dumps(wkt.loads(geometry), rounding_precision=precision, trim=True)
+
+
+def plant_keys(
+    geometries: Iterable[str],
+    capacities: Iterable[float],
+    dist_min: int,
+    dist_max: int,
+    version: str = "",
+) -> List[str]:
+    """Return the key of each plant given its WKT geometry, its capacity,
+    the distance thresholds used for the classification and the version of
+    the location with the urban areas"""
+    suffix = f"|{version}" if version else ""
+    return [
+        hashlib.sha1(
+            f"{normalize(geom)}|{float(cap)!r}|{dist_min:d}|{dist_max:d}{suffix}".encode()
+        ).hexdigest()
+        for geom, cap in zip(geometries, capacities)
+    ]
+
+
+class PlantStore(object):
+    """Store the urban statistics and the classes of the WWTP in a SQLite
+    database shared by all the workers."""
+
+    def __init__(self, path: str, timeout: float = 30.0, create: bool = True):
+        self.path = str(path)
+        self.timeout = timeout
+        if not create:
+            return
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS plants ("
+                "  key             TEXT PRIMARY KEY,"
+                "  dmin_sum        DOUBLE PRECISION,"
+                "  dmax_sum        DOUBLE PRECISION,"
+                "  suitability     TEXT,"
+                "  distance_label  TEXT,"
+                "  plantsize_label TEXT,"
+                "  urban_dist      DOUBLE PRECISION"
+                ")"
+            )
+            if "urban_dist" not in self.fields(conn):
+                # store written before the distance was saved
+                conn.execute("ALTER TABLE plants ADD COLUMN urban_dist DOUBLE PRECISION")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta ("
+                "  name  TEXT PRIMARY KEY,"
+                "  value TEXT"
+                ")"
+            )
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=self.timeout)
+
+    def fields(self, conn: sqlite3.Connection) -> List[str]:
+        return [row[1] for row in conn.execute("PRAGMA table_info(plants)")]
+
+    def get_meta(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """Return the value recorded for name, or default"""
+        try:
+            with self.connect() as conn:
+                row = conn.execute(
+                    "SELECT value FROM meta WHERE name = ?", (name,)
+                ).fetchone()
+        except sqlite3.OperationalError:
+            # store written before the meta table was added
+            return default
+        return default if row is None else row[0]
+
+    def set_meta(self, name: str, value: str):
+        with self.connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (name, value))
+
+    def get(self, keys: List[str], dist_min: int, dist_max: int) -> pd.DataFrame:
+        """Return a DataFrame indexed by key with the stored plants, the
+        keys that are not in the store are missing from the result"""
+        columns = [col.format(dmin=dist_min, dmax=dist_max) for col in COLUMNS]
+        frames = []
+        with self.connect() as conn:
+            # the reference stores are opened read-only, the old ones have
+            # no distance
+            existing = self.fields(conn)
+            fields = [f if f in existing else f"NULL AS {f}" for f in FIELDS]
+            for i in range(0, len(keys), CHUNK):
+                chunk = keys[i : i + CHUNK]
+                frames.append(
+                    pd.read_sql_query(
+                        f"SELECT key, {', '.join(fields)} "
+                        "FROM   plants "
+                        f"WHERE  key IN ({', '.join('?' * len(chunk))})",
+                        conn,
+                        params=chunk,
+                        index_col="key",
+                    )
+                )
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        res = pd.concat(frames)
+        res.columns = columns
+        res["urban_dist"] = res["urban_dist"].astype(float)
+        return res
+
+    def put(self, keys: List[str], plants: pd.DataFrame, dist_min: int, dist_max: int):
+        """Save the classification of the plants, plants must have the
+        columns listed in COLUMNS, the distance is optional, and the same
+        order of keys"""
+        columns = [col.format(dmin=dist_min, dmax=dist_max) for col in COLUMNS]
+        plants = plants.reindex(columns=columns)
+        rows = plants.astype(object).where(plants.notna(), None)
+        with self.connect() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO plants (key, {', '.join(FIELDS)}) "
+                f"VALUES ({', '.join('?' * (len(FIELDS) + 1))})",
+                [(key,) + tuple(row) for key, row in zip(keys, rows.itertuples(index=False))],
+            )
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stream the WWTP inputs
+======================
+
+Read the capacity and the power files, CSV or columnar, in batches, so the
+memory used by a computation does not depend on the number of plants. The power is first
+loaded in a temporary SQLite table indexed by gid, then each batch of
+capacities is joined with its power. The classified batches are appended
+to the output layer as soon as they are ready.
+"""
+import os
+import sqlite3
+import tempfile
+from typing import Dict, Iterator, List
+
+import pandas as pd
+
+from . import columnar
+
+# number of plants read at once
+CHUNKSIZE = 100000
+
+
+def is_large(*paths: str, threshold: int) -> bool:
+    """Return True if the files together are larger than threshold bytes"""
+    return sum(os.path.getsize(path) for path in paths) > threshold
+
+
+def read_chunks(path: str, chunksize: int, columns: List[str] = None):
+    """Return an iterator on the rows of the CSV or of the columnar file in
+    batches of chunksize rows"""
+    if columnar.is_columnar(path):
+        return columnar.iter_batches(path, chunksize, columns=columns)
+    return pd.read_csv(path, header=0, usecols=columns, chunksize=chunksize)
+
+
+def load_power(
+    conn: sqlite3.Connection, wwtp_p: str, power_col: str = "power", chunksize: int = CHUNKSIZE
+):
+    """Load the power of the plants in the power table of the connection"""
+    conn.execute("CREATE TABLE power (gid PRIMARY KEY, power DOUBLE PRECISION)")
+    for chunk in read_chunks(wwtp_p, chunksize, columns=["gid", power_col]):
+        conn.executemany(
+            "INSERT OR REPLACE INTO power VALUES (?, ?)",
+            zip(chunk["gid"].tolist(), chunk[power_col].tolist()),
+        )
+    conn.commit()
+
+
+def join_power(conn: sqlite3.Connection, batch: pd.DataFrame, power_col: str = "power"):
+    """Return the power of the plants of the batch, NaN if missing"""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS batch (pos INTEGER PRIMARY KEY, gid)")
+    conn.execute("DELETE FROM batch")
+    conn.executemany(
+        "INSERT INTO batch VALUES (?, ?)", enumerate(batch["gid"].tolist())
+    )
+    rows = conn.execute(
+        "SELECT power.power FROM batch LEFT JOIN power ON power.gid = batch.gid "
+        "ORDER BY batch.pos"
+    ).fetchall()
+    return pd.Series(
+        [row[0] for row in rows], index=batch.index, name=power_col, dtype=float
+    )
+
+
+def read_batches(
+    wwtp_c: str,
+    wwtp_p: str,
+    power_col: str = "power",
+    chunksize: int = CHUNKSIZE,
+    tmpdir: str = None,
+) -> Iterator[pd.DataFrame]:
+    """Yield the plants of the capacity file in batches of chunksize rows,
+    with the power of the power file joined on the gid column"""
+    with tempfile.TemporaryDirectory(dir=tmpdir) as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "power.sqlite"))
+        try:
+            load_power(conn, wwtp_p, power_col=power_col, chunksize=chunksize)
+            for batch in read_chunks(wwtp_c, chunksize):
+                batch[power_col] = join_power(conn, batch, power_col=power_col)
+                yield batch
+        finally:
+            conn.close()
+
+
+def project(gdf, dtypes: Dict[str, str]):
+    """Return the GeoDataFrame with the columns of dtypes, in the same order
+    and with the same dtype, the missing columns are empty. The batches
+    restored from the store and the queried ones do not have the same
+    columns and dtypes, the layer schema is taken from the first one"""
+    import geopandas as gpd
+
+    frame = pd.DataFrame(gdf.drop(columns=gdf.geometry.name)).reindex(
+        columns=list(dtypes)
+    )
+    for col, dtype in dtypes.items():
+        if dtype == "object":
+            values = frame[col].astype(object)
+            frame[col] = values.where(values.notna(), None)
+        else:
+            frame[col] = pd.to_numeric(frame[col], errors="coerce").astype(dtype)
+    return gpd.GeoDataFrame(frame, geometry=gdf.geometry, crs=gdf.crs)
+
+
+class LayerWriter(object):
+    """Append the batches of plants to a vector file, the schema of the
+    layer is taken from the first batch"""
+
+    def __init__(self, path: str, driver: str = "ESRI Shapefile"):
+        self.path = os.fspath(path)
+        self.driver = driver
+        self.layer = None
+        self.count = 0
+
+    def write(self, gdf):
+        import fiona
+        from geopandas.io.file import infer_schema
+
+        if self.layer is None:
+            self.layer = fiona.open(
+                self.path,
+                "w",
+                driver=self.driver,
+                schema=infer_schema(gdf),
+                crs_wkt=gdf.crs.to_wkt(),
+            )
+        self.layer.writerecords(gdf.iterfeatures())
+        self.count += len(gdf)
+
+    def close(self):
+        if self.layer is not None:
+            self.layer.close()
+            self.layer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
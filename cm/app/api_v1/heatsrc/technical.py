@@ -6,12 +6,20 @@ Compute WWTP technical potential
 
 
 """
+import fcntl
+import io
 import math
 import os
 import secrets
 import shutil
+import sqlite3
+import stat
+import subprocess
+import tempfile
 from typing import Any, Dict, List
 
+import geopandas as gpd
+import numpy as np
 import pandas as pd
 
 from grass_session import Session  # isort:skip
@@ -20,6 +28,8 @@ from grass.pygrass.modules import Module
 from grass.script import core as gcore
 from grass.script import mapcalc
 
+from ... import cancel, profiling, progress
+
 
 # Define constants values
 RADIUS = [150, 1000]
@@ -49,6 +59,13 @@ SUSTAINABILITY = pd.DataFrame(
 COLORS = {"Suitable": "#188B7D", "Conditionally": "#D9C259", "Not suitable": "#F34616"}
 
 
+# mapset cloned by the computations and files of the mapsets changed by
+# the computations
+TEMPLATE = "template"
+MAPSET_WRITABLE = ("WIND", "VAR", "SEARCH_PATH", "sqlite", ".tmp")
+# ioctl request to clone a file (reflink), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
 ## DATA NAMES
 CLC = "clc"
 URB = "urbanareas"
@@ -61,7 +78,14 @@ def run_command(*args, **kwargs):
     kwargs["quiet"] = True
     mod = Module(*args, **kwargs)
     # print(f"\n» Execute: `{' '.join(mod.make_cmd())}`")
-    mod.run()
+    profile = profiling.current()
+    # the module is killed if the computation is cancelled
+    with cancel.watch(mod):
+        if profile is None:
+            mod.run()
+        else:
+            with profile.grass_module(args[0]):
+                mod.run()
     return mod
 
 
@@ -99,6 +123,33 @@ def load_vectors(vectors: Dict[str, str], overwrite: bool = False):
         print(f"» {vname} imported!")
 
 
+def raster_region(raster: str) -> Dict[str, float]:
+    """Return the region of the raster without changing the current one"""
+    region = gcore.parse_command("g.region", raster=raster, flags="gu")
+    return {key: float(value) for key, value in region.items()}
+
+
+def raster_bands(raster: str, rows: int = 2048):
+    """Yield the index of the first row and the values of the raster read
+    in bands of rows, null cells are NaN"""
+    from grass.script import array as garray
+
+    reg = raster_region(raster)
+    gcore.use_temp_region()
+    try:
+        for row in range(0, int(reg["rows"]), rows):
+            nrows = min(rows, int(reg["rows"]) - row)
+            run_command("g.region", raster=raster)
+            run_command(
+                "g.region",
+                n=reg["n"] - row * reg["nsres"],
+                s=reg["n"] - (row + nrows) * reg["nsres"],
+            )
+            yield row, garray.array(raster, dtype=np.float32)
+    finally:
+        gcore.del_temp_region()
+
+
 def buffer(
     points: str,
     distance: int,
@@ -138,6 +189,48 @@ def buffer(
     )
 
 
+def read_table(vector: str, columns: List[str] = None) -> pd.DataFrame:
+    """Return the attribute table of the vector map, None if it is empty"""
+    kwargs = {} if columns is None else dict(columns=",".join(columns))
+    proc = run_command(
+        "v.db.select",
+        map=vector,
+        stdout_=subprocess.PIPE,
+        separator="pipe",
+        vertical_separator="newline",
+        **kwargs,
+    )
+    stdout = proc.outputs["stdout"].value
+    if stdout:
+        return pd.read_csv(io.StringIO(stdout), sep="|", header=0)
+
+
+def join_table(vector: str, frame: pd.DataFrame, types: Dict[str, str], key: str = "cat"):
+    """Join the columns of frame to the attribute table of the vector map on
+    the key column. The frame is written as a typed SQLite table, imported
+    at once and joined as the buffer sums are"""
+    table = f"{vector}__join"
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, f"{table}.sqlite")
+        conn = sqlite3.connect(path)
+        try:
+            frame.to_sql(table, conn, index=False, dtype=types)
+        finally:
+            conn.close()
+        run_command("db.in.ogr", input=path, layer=table, output=table)
+    try:
+        run_command(
+            "v.db.join",
+            map=vector,
+            column=key,
+            other_table=table,
+            other_column=key,
+            subset_columns=",".join(col for col in frame.columns if col != key),
+        )
+    finally:
+        run_command("db.droptable", table=table, flags="f")
+
+
 def clc2urban(clc: str, urbanareas: str, cats: List[int], overwrite: bool = False):
     """
     111: 230,  0, 77,255, Continuous_urban_fabric
@@ -195,6 +288,7 @@ def tech_potential(
     # create pid for tmp files
     for distance in (dist_min, dist_max):
         print(f"\n\n» Compute buffer around WWTP of {distance}")
+        progress.report(f"buffer {distance} m")
         buffer(
             points=wwtp_plants,
             distance=int(distance),
@@ -203,8 +297,37 @@ def tech_potential(
             overwrite=overwrite,
         )
 
-    # add columns
+    print("\n\n» Classify WWTP")
+    progress.report("classify plants")
+    # the plants are classified with the same lookup table of the other
+    # engines, the classes are joined to the table with a single import
+    from .classify import classify_plants
+
+    sums = [f"dist{dist_min:d}m_sum", f"dist{dist_max:d}m_sum"]
+    plants = read_table(wwtp_plants, ["cat", capacity_col, power_col] + sums)
+    if plants is None:
+        return
+    # the buffers do not locate the nearest urban cell, the column keeps
+    # the layer schema of the KD-tree engine
+    plants["urban_dist"] = np.nan
+    classify_plants(
+        plants,
+        dist_min,
+        dist_max,
+        capacity_col=capacity_col,
+        suitability_col=suitability_col,
+        dist_col=dist_col,
+        plansize_col=plansize_col,
+    )
+    power_potential(
+        plants,
+        power_col=power_col,
+        suitability_col=suitability_col,
+        conditional_col=conditional_col,
+        suitable_col=suitable_col,
+    )
     cols = [
+        ("urban_dist", "DOUBLE PRECISION"),
         (f"{suitability_col}", "varchar(16)"),
         (f"{dist_col}", "varchar(16)"),
         (f"{plansize_col}", "varchar(16)"),
@@ -215,89 +338,56 @@ def tech_potential(
         ("fillColor", "varchar(16)"),
         ("opacity", "DOUBLE PRECISION"),
     ]
+    join_table(wwtp_plants, plants[["cat"] + [cname for cname, _ in cols]], dict(cols))
 
-    run_command(
-        "v.db.addcolumn",
-        map=wwtp_plants,
-        columns=",".join(f"{cname} {ctype}" for cname, ctype in cols),
-    )
 
-    # run_command("db.describe", flags="c", table=wwtp_plants)
-    # run_command("db.describe", flags="c", table=f"{wwtp_plants}__buf{dist_min}m")
-    # run_command("db.describe", flags="c", table=f"{wwtp_plants}__buf{dist_max}m")
-
-    print("\n\n» Update WWTP columns")
-    for (dlabel, clabel), sustain in SUSTAINABILITY.unstack().items():
-        dmin, dmax = DIST_DICT[dlabel]
-        cmin, cmax = PLANT_SIZE[clabel]
-        if cmax:
-            cond_cap = (
-                f"( {capacity_col} >  {cmin}\n"
-                f"           AND {capacity_col} <= {cmax} )\n"
-            )
-        else:
-            cond_cap = f"( {capacity_col} >  {cmin} )\n"
-        where = (
-            f"( {cond_cap}"
-            f"         AND ( dist{dist_min:d}m_sum {dmin}\n"
-            f"               AND dist{dist_max:d}m_sum {dmax} ) )"
-        )
-
-        clr = COLORS[sustain]
-        sqlcmd = (
-            f"UPDATE {wwtp_plants}\n"
-            f"SET    {suitability_col}='{sustain}',\n"
-            f"       {dist_col}='{dlabel}',\n"
-            f"       {plansize_col}='{clabel}',\n"
-            f"       color='{clr}',\n"
-            f"       fillColor='{clr}',\n"
-            f"       opacity=0.8\n"
-            f"WHERE  {where}"
-        )
-        run_command("db.execute", sql=sqlcmd)
-
-    run_command(
-        "db.execute",
-        sql=(
-            f"UPDATE {wwtp_plants} "
-            f"SET    {conditional_col} = CASE"
-            f"          WHEN {suitability_col} = 'Conditional' THEN {power_col}"
-            f"          ELSE 0 END"
-        ),
-    )
-
-    run_command(
-        "db.execute",
-        sql=(
-            f"UPDATE {wwtp_plants} "
-            f"SET    {suitable_col} = CASE"
-            f"         WHEN {suitability_col} = 'Suitable' THEN {power_col}"
-            f"         ELSE 0 END;"
-        ),
-    )
-
-
-def tech_stats(wwtp_plants: str, areas: str, columns: List[str]):
-    # run_command(
-    #     "v.vect.stats",
-    #     points=wwtp_plants,
-    #     areas=nuts3,
-    #     method=sum,
-    #     points_column=yes,
-    #     count_column=yes_count,
-    #     stats_column=yes_sum,
-    # )
-
-    # run_command(
-    #     "v.vect.stats",
-    #     points=wwtp_plants,
-    #     areas=nuts3,
-    #     method=sum,
-    #     points_column=conditional,
-    #     count_column=conditional_count,
-    #     stats_column=conditional_sum,
-    # )
-    pass
+def power_potential(
+    plants: pd.DataFrame,
+    power_col: str = "power",
+    suitability_col: str = "suitability",
+    conditional_col: str = "conditional",
+    suitable_col: str = "suitable",
+) -> pd.DataFrame:
+    """Update the power weighted columns of the classified plants, the
+    rules are the same applied by `tech_potential` to the GRASS table"""
+    power = plants[power_col]
+    plants[conditional_col] = power.where(plants[suitability_col] == "Conditionally", 0)
+    plants[suitable_col] = power.where(plants[suitability_col] == "Suitable", 0)
+    return plants
+
+
+def tech_stats(
+    plants: gpd.GeoDataFrame,
+    regions: gpd.GeoDataFrame,
+    region_col: str,
+    columns: List[str] = ("suitable", "conditional"),
+    table: str = None,
+) -> pd.DataFrame:
+    """Aggregate the plants by region, return a DataFrame indexed by region
+    with the number of plants (`count`) and for each column the number of
+    plants with a non zero value (`{col}_count`) and the sum (`{col}_sum`).
+    If table is given the result is saved as CSV.
+
+    The points are located in the regions with a spatial join that queries
+    the R-tree bulk-loaded over the region polygons.
+    """
+    if regions.crs != plants.crs:
+        regions = regions.to_crs(plants.crs)
+    # how and predicate are positional, the keyword of the predicate
+    # changed between the geopandas versions
+    joined = gpd.sjoin(plants, regions[[region_col, "geometry"]], "inner", "within")
+    keys = joined[region_col]
+    values = joined[list(columns)]
+    counts = (values > 0).groupby(keys).sum()
+    sums = values.groupby(keys).sum()
+    stats = keys.value_counts().sort_index().to_frame("count")
+    stats.index.name = region_col
+    for col in columns:
+        stats[f"{col}_count"] = counts[col]
+        stats[f"{col}_sum"] = sums[col]
+    if table is not None:
+        stats.to_csv(table)
+    return stats
 
 
 def tech_export(wwtp_plants: str, wwtp_out: str, buffer: float = 1.0, mapset: str = None):
@@ -336,6 +426,74 @@ def tech_export(wwtp_plants: str, wwtp_out: str, buffer: float = 1.0, mapset: st
     print(f"Exported output to {wwtp_out}")
 
 
+def create_template(
+    gisdb: str, location: str, urban_areas: str, template: str = TEMPLATE
+):
+    """Create the template mapset cloned by the computations: the region is
+    aligned to the urban areas, the reclassified urban areas are saved as a
+    regular raster and the attribute database is set. The mapset is built
+    with a temporary name and renamed once complete."""
+    tmp = f"{template}_{secrets.token_urlsafe(8)}"
+    with Session(
+        gisdb=os.fspath(gisdb), location=location, mapset=tmp, create_opts=""
+    ):
+        run_command("g.region", raster=f"{urban_areas}@PERMANENT")
+        run_command(
+            "r.mapcalc", expression=f'{urban_areas} = "{urban_areas}@PERMANENT"'
+        )
+        run_command("db.connect", flags="d")
+    path = os.path.join(os.fspath(gisdb), location, template)
+    try:
+        os.rename(os.path.join(os.fspath(gisdb), location, tmp), path)
+    except OSError:
+        # another process created the template first
+        shutil.rmtree(os.path.join(os.fspath(gisdb), location, tmp))
+
+
+def _clone_file(src: str, dst: str):
+    """Copy the file sharing the blocks if the file system supports it"""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            shutil.copyfileobj(fsrc, fdst)
+    # the template of a prepared location is read-only
+    os.chmod(dst, os.stat(src).st_mode | stat.S_IWUSR)
+
+
+def clone_mapset(gisdb: str, location: str, mapset: str, template: str = TEMPLATE):
+    """Create the mapset cloning the template, the files that are only
+    read are hardlinked, the files changed by the computations (region,
+    settings and attribute database) are copied"""
+    src = os.path.join(os.fspath(gisdb), location, template)
+    dst = os.path.join(os.fspath(gisdb), location, mapset)
+    for root, dirs, files in os.walk(src):
+        rel = os.path.relpath(root, src)
+        os.makedirs(os.path.join(dst, rel), exist_ok=True)
+        for fname in files:
+            source = os.path.join(root, fname)
+            target = os.path.join(dst, rel, fname)
+            if fname in MAPSET_WRITABLE or rel.split(os.sep)[0] in MAPSET_WRITABLE:
+                _clone_file(source, target)
+            else:
+                os.link(source, target)
+    return dst
+
+
+def remove_mapset(gisdb: str, location: str, mapset: str):
+    """Remove the mapset of a computation, also when its modules were
+    killed"""
+    shutil.rmtree(os.path.join(os.fspath(gisdb), location, mapset), ignore_errors=True)
+
+
+def get_template(gisdb: str, location: str, urban_areas: str, template: str = TEMPLATE):
+    """Create the template mapset if it is missing, e.g. in the locations
+    prepared before the template was introduced"""
+    if not os.path.exists(os.path.join(os.fspath(gisdb), location, template)):
+        create_template(gisdb, location, urban_areas, template=template)
+    return template
+
+
 def create_location(
     gisdb: str,
     location: str,
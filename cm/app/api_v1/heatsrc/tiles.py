@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Export WWTP as vector tiles
+===========================
+
+Write the classified plants as a pyramid of Mapbox Vector Tiles stored in
+a MBTiles file, the points keep their style attributes so the frontend can
+fetch and render only the visible tiles. The CM serves the tiles of the
+MBTiles file one by one with `read_tile`.
+
+The plants are points, so the tiles are encoded directly following the
+Mapbox Vector Tile specification (v2.1) without external dependencies.
+"""
+import gzip
+import json
+import math
+import sqlite3
+import struct
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from pandas.api.types import is_numeric_dtype
+
+# half of the side of the web mercator square
+ORIGIN = 20037508.342789244
+EXTENT = 4096
+
+# attributes exported in the tiles
+ATTRIBUTES = (
+    "gid",
+    "capacity",
+    "power",
+    "suitability",
+    "distance_label",
+    "plantsize_label",
+    "conditional",
+    "suitable",
+    "color",
+    "fillColor",
+    "opacity",
+)
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number: int, wire: int) -> bytes:
+    return _varint((number << 3) | wire)
+
+
+def _message(number: int, payload: bytes) -> bytes:
+    return _field(number, 2) + _varint(len(payload)) + payload
+
+
+def _packed(number: int, values: Iterable[int]) -> bytes:
+    return _message(number, b"".join(_varint(val) for val in values))
+
+
+def _value(value) -> bytes:
+    if isinstance(value, (bool, np.bool_)):
+        return _field(7, 0) + _varint(int(value))
+    if isinstance(value, (int, np.integer)):
+        return _field(6, 0) + _varint(_zigzag(int(value)))
+    if isinstance(value, (float, np.floating)):
+        return _field(3, 1) + struct.pack("<d", float(value))
+    return _message(1, str(value).encode("utf-8"))
+
+
+def encode_layer(
+    name: str, points: List[Tuple[int, int]], properties: List[Dict]
+) -> bytes:
+    """Encode a layer of points, coordinates are in tile units"""
+    keys, values = {}, {}
+    features = []
+    for fid, ((x, y), props) in enumerate(zip(points, properties)):
+        tags = []
+        for key, val in props.items():
+            if val is None or (isinstance(val, float) and math.isnan(val)):
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(val).__name__, val), len(values)))
+        feature = (
+            _field(1, 0) + _varint(fid)
+            + _packed(2, tags)
+            + _field(3, 0) + _varint(1)  # POINT
+            + _packed(4, (9, _zigzag(int(x)), _zigzag(int(y))))  # MoveTo(1)
+        )
+        features.append(_message(2, feature))
+
+    layer = (
+        _field(15, 0) + _varint(2)
+        + _message(1, name.encode("utf-8"))
+        + b"".join(features)
+        + b"".join(_message(3, key.encode("utf-8")) for key in keys)
+        + b"".join(_message(4, _value(val)) for _, val in values)
+        + _field(5, 0) + _varint(EXTENT)
+    )
+    return _message(3, layer)
+
+
+def tile_coords(x: np.ndarray, y: np.ndarray, zoom: int):
+    """Return the XYZ tile index and the coordinates inside the tile of
+    points in web mercator (EPSG:3857)"""
+    ntiles = 2 ** zoom
+    fx = (x + ORIGIN) / (2 * ORIGIN) * ntiles
+    fy = (ORIGIN - y) / (2 * ORIGIN) * ntiles
+    tx = np.clip(np.floor(fx), 0, ntiles - 1).astype(int)
+    ty = np.clip(np.floor(fy), 0, ntiles - 1).astype(int)
+    px = np.round((fx - tx) * EXTENT).astype(int)
+    py = np.round((fy - ty) * EXTENT).astype(int)
+    return tx, ty, px, py
+
+
+def read_tile(path: str, zoom: int, x: int, y: int) -> bytes:
+    """Return the gzipped tile of the MBTiles file given its XYZ index, or
+    None if there are no plants in the tile"""
+    with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as conn:
+        row = conn.execute(
+            "SELECT tile_data FROM tiles "
+            "WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            # MBTiles uses the TMS scheme with the y axis flipped
+            (zoom, x, 2 ** zoom - 1 - y),
+        ).fetchone()
+    return None if row is None else row[0]
+
+
+def write_mbtiles(
+    gdf,
+    path: str,
+    layer: str = "wwtp",
+    minzoom: int = 0,
+    maxzoom: int = 12,
+    attributes: Iterable[str] = ATTRIBUTES,
+):
+    """Write the points of the GeoDataFrame as a MBTiles file of vector
+    tiles from minzoom to maxzoom"""
+    attributes = [col for col in attributes if col in gdf.columns]
+    merc = gdf.to_crs("EPSG:3857")
+    x, y = merc.geometry.x.values, merc.geometry.y.values
+    props = merc[attributes].astype(object).to_dict("records")
+
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+        conn.execute(
+            "CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, "
+            "tile_row INTEGER, tile_data BLOB)"
+        )
+        conn.execute(
+            "CREATE UNIQUE INDEX tile_index ON tiles "
+            "(zoom_level, tile_column, tile_row)"
+        )
+        for zoom in range(minzoom, maxzoom + 1):
+            tx, ty, px, py = tile_coords(x, y, zoom)
+            order = np.lexsort((ty, tx))
+            keys = np.stack([tx[order], ty[order]], axis=1)
+            splits = np.flatnonzero(np.any(np.diff(keys, axis=0), axis=1)) + 1
+            rows = []
+            for idx in np.split(order, splits):
+                data = encode_layer(
+                    layer,
+                    list(zip(px[idx], py[idx])),
+                    [props[i] for i in idx],
+                )
+                # MBTiles uses the TMS scheme with the y axis flipped
+                rows.append(
+                    (zoom, int(tx[idx[0]]), 2 ** zoom - 1 - int(ty[idx[0]]),
+                     gzip.compress(data))
+                )
+            conn.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", rows)
+
+        west, south, east, north = gdf.to_crs("EPSG:4326").total_bounds
+        metadata = {
+            "name": layer,
+            "format": "pbf",
+            "type": "overlay",
+            "version": "2",
+            "minzoom": str(minzoom),
+            "maxzoom": str(maxzoom),
+            "bounds": f"{west},{south},{east},{north}",
+            "center": f"{(west + east) / 2},{(south + north) / 2},{minzoom}",
+            "json": json.dumps(
+                {
+                    "vector_layers": [
+                        {
+                            "id": layer,
+                            "minzoom": minzoom,
+                            "maxzoom": maxzoom,
+                            "fields": {
+                                col: "Number"
+                                if is_numeric_dtype(gdf[col])
+                                else "String"
+                                for col in attributes
+                            },
+                        }
+                    ]
+                }
+            ),
+        }
+        conn.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+    return path
@@ -2,16 +2,21 @@ from flask import request, abort, jsonify, url_for, g, flash
 from . import api
 from .. import SIGNATURE, CM_NAME
 import json
-import requests
 import logging
 import os
-from flask import send_from_directory
+import re
+import uuid
+from flask import make_response, send_from_directory
+from app import cancel
 from app import helper
 from app import constant
+from app import profiling
+from app import jobs
+from app import progress
+from app import singleflight
 
 from app.api_v1 import errors
 import socket
-from . import calculation_module
 from app import CalculationModuleRpcClient
 
 LOG_FORMAT = (
@@ -29,8 +34,59 @@ if not os.path.exists(UPLOAD_DIRECTORY):
 
 @api.route("/files/<string:filename>", methods=["GET"])
 def get(filename):
-    # get file stored in the api directory
-    return send_from_directory(UPLOAD_DIRECTORY, filename, as_attachment=True)
+    # get file stored in the api directory, the etags are not outputs
+    if filename.endswith(".etag"):
+        abort(404)
+    rv = send_from_directory(UPLOAD_DIRECTORY, filename, as_attachment=True)
+    # use the content hash computed when the output was written
+    etag = helper.read_etag(os.path.join(UPLOAD_DIRECTORY, filename))
+    if etag is not None:
+        rv.set_etag(etag)
+        rv = rv.make_conditional(request)
+    return rv
+
+
+@api.route("/tiles/<string:filename>/<int:z>/<int:x>/<int:y>.pbf", methods=["GET"])
+def get_tile(filename, z, x, y):
+    """Return a vector tile of the MBTiles file, so the frontend fetches
+    only the visible tiles"""
+    from .heatsrc import tiles
+
+    path = os.path.join(UPLOAD_DIRECTORY, os.path.basename(filename))
+    if not filename.endswith(".mbtiles") or not os.path.isfile(path):
+        abort(404)
+    data = tiles.read_tile(path, z, x, y)
+    if data is None:
+        return "", 204
+    rv = make_response(data)
+    rv.headers["Content-Type"] = "application/vnd.mapbox-vector-tile"
+    rv.headers["Content-Encoding"] = "gzip"
+    return rv
+
+
+@api.route("/profiles/<string:job_id>", methods=["GET"])
+def get_profile(job_id):
+    """Return the wall time of the computation and of the GRASS modules"""
+    return send_from_directory(constant.PROFILE_DIRECTORY, job_id + ".json")
+
+
+@api.route("/profiles/<string:job_id>/folded", methods=["GET"])
+def get_profile_folded(job_id):
+    """Return the stack samples collapsed for the flame graph tools"""
+    return send_from_directory(
+        constant.PROFILE_DIRECTORY, job_id + ".folded", mimetype="text/plain"
+    )
+
+
+@api.route("/jobs/<string:job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """Cancel the computation, queued or running in any worker: the running
+    GRASS modules are killed and the job stops within a second"""
+    if not jobs.Registry().cancel(job_id):
+        abort(404)
+    response = jsonify(job_id=job_id, status="cancelled")
+    response.status_code = 202
+    return response
 
 
 @api.route("/register/", methods=["POST"])
@@ -70,23 +126,51 @@ def register():
 
 def savefile(filename, url):
     print("CM is Computing and will dowload files with url: ", url)
-    r = None
-    path = None
     try:
-        r = requests.get(url, stream=True)
-    except:
+        return savefiles({filename: url})[filename]
+    except Exception:
         LOGGER.error("API unable to download tif files")
 
-    print("image saved", r.status_code)
-    if r.status_code == 200:
-        path = os.path.join(UPLOAD_DIRECTORY, filename)
-        with open(path, "wb") as f:
-            for chunk in r.iter_content(1024):
-                f.write(chunk)
-    else:
-        LOGGER.error("API unable to download tif files")
 
-    return path
+def savefiles(urls):
+    """Download in parallel all the files referenced by a request, urls is a
+    dictionary with key the file name and value the url. Return a dictionary
+    with key the file name and value the path once all the files are saved
+    in the UPLOAD_DIRECTORY, or raise the first download error."""
+    # import the download stage only when it is needed
+    from . import download
+
+    paths = download.download_all(
+        {
+            filename: dict(url=url, filepath=os.path.join(UPLOAD_DIRECTORY, filename))
+            for filename, url in urls.items()
+        },
+        overwrite=True,
+    )
+    return {filename: os.fspath(path) for filename, path in paths.items()}
+
+
+def job_timeout(headers):
+    """Return the timeout of the job in seconds, the request can only
+    shorten JOB_TIMEOUT"""
+    timeouts = [constant.JOB_TIMEOUT] if constant.JOB_TIMEOUT else []
+    try:
+        timeouts.append(float(headers.get("X-Job-Timeout", "")))
+    except ValueError:
+        pass
+    return min(timeouts) if timeouts else None
+
+
+def coalesced(calculation, *selections):
+    """Run the calculation, identical requests running at the same time
+    share the result"""
+    if not constant.SINGLEFLIGHT:
+        return calculation()
+    key = singleflight.request_key(*selections)
+    result, shared = singleflight.SingleFlight().run(key, calculation)
+    if shared:
+        LOGGER.info(f"result shared with an identical request: {key}")
+    return result
 
 
 @api.route("/compute/", methods=["POST"])
@@ -138,15 +222,46 @@ def compute():
     LOGGER.info(f"inputs_vector_selection {inputs_vector_selection}")
 
     output_directory = UPLOAD_DIRECTORY
-    # call the calculation module function
-    result = calculation_module.calculation(
-        output_directory,
-        inputs_raster_selection,
-        inputs_vector_selection,
-        inputs_parameter_selection,
-    )
+    # the calculation module imports the geospatial and GRASS libraries,
+    # import it at the first computation and not when the worker starts
+    from . import calculation_module
+
+    # publish the progress if the request comes from the AMQP consumer, the
+    # correlation id is also the id used to cancel the job
+    correlation_id = request.headers.get("X-Correlation-Id")
+    job_id = correlation_id
+    if not job_id or not re.fullmatch(r"[\w-]+", job_id):
+        job_id = uuid.uuid4().hex
+
+    # profile the computation only if it is requested
+    profile = profiling.enabled(inputs_parameter_selection)
+
+    def calculation():
+        return calculation_module.calculation(
+            output_directory,
+            inputs_raster_selection,
+            inputs_vector_selection,
+            inputs_parameter_selection,
+        )
+
+    # call the calculation module function, the job is recorded in the
+    # registry read by the alive consumer and stops at its deadline or
+    # when it is cancelled
+    registry = jobs.Registry()
+    with registry.job(job_id):
+        with cancel.Token(job_id, timeout=job_timeout(request.headers), registry=registry):
+            with profiling.Profile(job_id) if profile else profiling.disabled():
+                with progress.Progress(correlation_id) if correlation_id else progress.disabled():
+                    result = coalesced(
+                        calculation,
+                        inputs_raster_selection,
+                        inputs_vector_selection,
+                        inputs_parameter_selection,
+                    )
 
     response = {"result": result}
+    if profile:
+        response["profile"] = url_for("api.get_profile", job_id=job_id)
 
     #   LOGGER.info('response', response)
 
@@ -0,0 +1,201 @@
+"""
+Cancel the computations
+=======================
+
+A computation runs with a `Token` that carries its deadline and is
+cancelled when the job is cancelled in the registry of the jobs, from any
+worker. The computation checks the token between its stages with
+`check()`, which raises Cancelled or DeadlineExceeded.
+
+The GRASS modules launched by `run_command` are watched: a background
+thread of the token polls the cancellation and kills the process tree of
+the running module, walking /proc, so a stuck module does not hold the
+worker and the abandoned work stops within a second. When no token is
+active `check()` does nothing.
+"""
+import collections
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+
+from .constant import JOB_TIMEOUT
+from .exceptions import Cancelled, DeadlineExceeded
+
+# interval between two checks of the watchdog and seconds given to the
+# killed processes to exit before SIGKILL
+POLL = 0.2
+GRACE = 0.5
+
+_local = threading.local()
+
+
+@contextmanager
+def disabled():
+    yield None
+
+
+def current():
+    """Return the token active in the current thread or None"""
+    return getattr(_local, "token", None)
+
+
+def check():
+    """Raise if the current computation is cancelled or late"""
+    token = current()
+    if token is not None:
+        token.check()
+
+
+def children():
+    """Return the children of each process, read from /proc"""
+    tree = collections.defaultdict(list)
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(os.path.join(entry.path, "stat"), "rb") as fobj:
+                stat = fobj.read()
+        except OSError:
+            continue
+        # the command name can contain spaces and parentheses
+        ppid = int(stat.rpartition(b")")[2].split()[1])
+        tree[ppid].append(int(entry.name))
+    return tree
+
+
+def descendants(pid):
+    """Return the pids of the descendants of the process"""
+    tree = children()
+    pids, stack = [], list(tree.get(pid, ()))
+    while stack:
+        child = stack.pop()
+        pids.append(child)
+        stack.extend(tree.get(child, ()))
+    return pids
+
+
+def _running(pid):
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as fobj:
+            state = fobj.read().rpartition(b")")[2].split()[0]
+    except OSError:
+        return False
+    return state not in (b"Z", b"X")
+
+
+def _signal(pids, sig):
+    for pid in pids:
+        try:
+            os.kill(pid, sig)
+        except OSError:
+            pass
+
+
+def kill_tree(pid, grace=GRACE):
+    """Terminate the process and its descendants, the processes still
+    running after grace seconds are killed. The tree is stopped first, so
+    no process can fork while it is collected"""
+    pids, found = [], [pid]
+    while found:
+        _signal(found, signal.SIGSTOP)
+        pids.extend(found)
+        found = [child for child in descendants(pid) if child not in pids]
+    _signal(pids, signal.SIGTERM)
+    _signal(pids, signal.SIGCONT)
+    deadline = time.monotonic() + grace
+    while time.monotonic() < deadline:
+        pids = [pid for pid in pids if _running(pid)]
+        if not pids:
+            return
+        time.sleep(0.01)
+    _signal(pids, signal.SIGKILL)
+
+
+class Token(object):
+    """Cancellation and deadline of the job run by the thread that enters
+    the token"""
+
+    def __init__(self, job_id=None, timeout=JOB_TIMEOUT, registry=None, poll=POLL):
+        self.job_id = job_id
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.registry = registry
+        self.poll = poll
+        self.event = threading.Event()
+        self.modules = []
+        self.killed = set()
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.stopped = threading.Event()
+        self.watchdog = threading.Thread(target=self.watch, daemon=True)
+        self.watchdog.start()
+        _local.token = self
+        return self
+
+    def __exit__(self, *exc):
+        _local.token = None
+        self.stopped.set()
+        self.watchdog.join()
+        return False
+
+    def cancel(self):
+        self.event.set()
+
+    def reason(self):
+        """Return why the job must stop: cancelled or timeout, or None"""
+        if self.event.is_set():
+            return "cancelled"
+        if self.registry is not None and self.registry.is_cancelled(self.job_id):
+            self.event.set()
+            return "cancelled"
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            return "timeout"
+        return None
+
+    def check(self):
+        reason = self.reason()
+        if reason == "timeout":
+            raise DeadlineExceeded(f"the job {self.job_id} exceeded its deadline")
+        if reason is not None:
+            raise Cancelled(f"the job {self.job_id} was cancelled")
+
+    def watch(self):
+        """Kill the running GRASS modules once the job must stop"""
+        while not self.stopped.wait(self.poll):
+            if self.reason() is None:
+                continue
+            with self.lock:
+                # the process is created when the module runs
+                pids = [
+                    mod.popen.pid
+                    for mod in self.modules
+                    if getattr(mod, "popen", None) is not None
+                    and mod.popen.pid not in self.killed
+                ]
+                self.killed.update(pids)
+            for pid in pids:
+                kill_tree(pid)
+
+
+@contextmanager
+def watch(module):
+    """Run the GRASS module under the watch of the current token, if the
+    module is killed raise Cancelled or DeadlineExceeded in place of the
+    error of the module"""
+    token = current()
+    if token is None:
+        yield module
+        return
+    token.check()
+    with token.lock:
+        token.modules.append(module)
+    try:
+        yield module
+    except Exception:
+        token.check()
+        raise
+    finally:
+        with token.lock:
+            token.modules.remove(module)
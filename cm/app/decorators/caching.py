@@ -35,7 +35,6 @@ def etag(f):
         # invoke the wrapped function and generate a response object from
         # its result
         rv = f(*args, **kwargs)
-        rv.direct_passthrough = False
         rv = make_response(rv)
 
         # etags only make sense for request that are cacheable, so only
@@ -48,10 +47,16 @@ def etag(f):
         if rv.status_code != 200:
             return rv
 
-        # compute the etag for this request as the MD5 hash of the response
-        # text and set it in the response header
-        etag = '"' + hashlib.md5(rv.get_data()).hexdigest() + '"'
-        rv.headers['ETag'] = etag
+        # use the etag set by the view (e.g. from the file metadata or from
+        # the hash computed when the file was written), otherwise compute
+        # the etag as the MD5 hash of the response text. Streamed responses
+        # are never read to compute the etag
+        etag = rv.headers.get('ETag')
+        if etag is None:
+            if rv.direct_passthrough or rv.is_streamed:
+                return rv
+            etag = '"' + hashlib.md5(rv.get_data()).hexdigest() + '"'
+            rv.headers['ETag'] = etag
 
         # handle If-Match and If-None-Match request headers if present
         if_match = request.headers.get('If-Match')
@@ -1,4 +1,7 @@
 import functools
+import heapq
+import sqlite3
+import threading
 from time import time
 
 from flask import current_app, g, jsonify, request
@@ -7,10 +10,14 @@ _limiter = None
 
 
 class MemRateLimit(object):
-    """Rate limiter that uses a Python dictionary as storage."""
+    """Rate limiter that uses a Python dictionary as storage. Counters are
+    grouped in buckets by reset time, so expired counters are removed a
+    bucket at a time with an amortized O(1) cost per hit."""
 
     def __init__(self):
         self.counters = {}
+        self.buckets = {}
+        self.resets = []
 
     def is_allowed(self, key, limit, period):
         """Check if the client's request should be allowed, based on the
@@ -26,6 +33,10 @@ class MemRateLimit(object):
             self.counters[key]['hits'] += 1
         else:
             self.counters[key] = {'hits': 1, 'reset': end_period}
+            if end_period not in self.buckets:
+                self.buckets[end_period] = []
+                heapq.heappush(self.resets, end_period)
+            self.buckets[end_period].append(key)
         allow = True
         remaining = limit - self.counters[key]['hits']
         if remaining < 0:
@@ -35,11 +46,81 @@ class MemRateLimit(object):
 
     def cleanup(self, now):
         """Eliminate expired keys."""
-        for key, value in list(self.counters.items()):
-            if value['reset'] < now:
+        while self.resets and self.resets[0] < now:
+            for key in self.buckets.pop(heapq.heappop(self.resets)):
                 del self.counters[key]
 
 
+class SQLiteRateLimit(object):
+    """Rate limiter that uses a SQLite database as storage, the counters are
+    shared by all the processes of the host that use the same file."""
+
+    def __init__(self, path, timeout=10.0):
+        self.conn = sqlite3.connect(path, timeout=timeout,
+                                    isolation_level=None,
+                                    check_same_thread=False)
+        self.lock = threading.Lock()
+        self.next_cleanup = 0
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS counters ('
+                          '  key   TEXT    NOT NULL,'
+                          '  reset INTEGER NOT NULL,'
+                          '  hits  INTEGER NOT NULL,'
+                          '  PRIMARY KEY (key, reset))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS counters_reset '
+                          'ON counters (reset)')
+
+    def is_allowed(self, key, limit, period):
+        """Check if the client's request should be allowed, see
+        MemRateLimit.is_allowed."""
+        now = int(time())
+        begin_period = now // period * period
+        end_period = begin_period + period
+
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                if now >= self.next_cleanup:
+                    self.cleanup(now)
+                    self.next_cleanup = end_period
+                self.conn.execute('INSERT OR IGNORE INTO counters '
+                                  'VALUES (?, ?, 0)', (key, end_period))
+                self.conn.execute('UPDATE counters SET hits = hits + 1 '
+                                  'WHERE key = ? AND reset = ?',
+                                  (key, end_period))
+                hits, = self.conn.execute('SELECT hits FROM counters '
+                                          'WHERE key = ? AND reset = ?',
+                                          (key, end_period)).fetchone()
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        allow = True
+        remaining = limit - hits
+        if remaining < 0:
+            remaining = 0
+            allow = False
+        return allow, remaining, end_period
+
+    def cleanup(self, now):
+        """Eliminate expired keys."""
+        self.conn.execute('DELETE FROM counters WHERE reset < ?', (now,))
+
+
+def get_limiter():
+    """Return the rate limiter of the process, counters are kept in memory
+    unless RATELIMIT_STORAGE is set to the path of a SQLite database."""
+    global _limiter
+    if _limiter is None:
+        storage = current_app.config.get('RATELIMIT_STORAGE')
+        if storage:
+            _limiter = SQLiteRateLimit(storage)
+        else:
+            _limiter = MemRateLimit()
+    return _limiter
+
+
 def rate_limit(limit, period):
     """Limits the rate at which clients can send requests to 'limit' requests
     per 'period' seconds. Once a client goes over the limit all requests are
@@ -53,16 +134,14 @@ def rate_limit(limit, period):
                 return f(*args, **kwargs)
             else:
                 # initialize the rate limiter the first time here
-                global _limiter
-                if _limiter is None:
-                    _limiter = MemRateLimit()
+                limiter = get_limiter()
 
                 # generate a unique key to represent the decorated function and
                 # the IP address of the client. Rate limiting counters are
                 # maintained on each unique key.
                 key = '{0}/{1}'.format(f.__name__, request.remote_addr)
-                allowed, remaining, reset = _limiter.is_allowed(key, limit,
-                                                                period)
+                allowed, remaining, reset = limiter.is_allowed(key, limit,
+                                                               period)
 
                 # set the rate limit headers in g, so that they are picked up
                 # by the after_request handler and attached to the response
@@ -1,2 +1,10 @@
 class ValidationError(ValueError):
     pass
+
+
+class Cancelled(Exception):
+    pass
+
+
+class DeadlineExceeded(Cancelled):
+    pass
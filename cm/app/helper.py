@@ -1,5 +1,7 @@
 import uuid
+import hashlib
 import ast
+import tempfile
 import json
 import zipfile
 import os
@@ -20,12 +22,51 @@ def generate_output_file_csv(output_directory):
 def generate_output_file_shp(output_directory):
     return generate_output_file_with_extension(output_directory, '.shp')
 
+def generate_output_file_mbtiles(output_directory):
+    return generate_output_file_with_extension(output_directory, '.mbtiles')
+
+def generate_output_file_parquet(output_directory):
+    return generate_output_file_with_extension(output_directory, '.parquet')
+
+def generate_output_file_fgb(output_directory):
+    return generate_output_file_with_extension(output_directory, '.fgb')
+
 
 def generate_output_file_with_extension(output_directory,extension):
     filename = str(uuid.uuid4()) + extension
     output_raster_path = output_directory+'/'+filename  # output raster
     return output_raster_path
 
+def etag_path(path):
+    return path + '.etag'
+
+def generate_etag(path, chunk_size=1 << 20):
+    """Compute once the MD5 hash of an output file and save it next to the
+    file, so the etag of the file can be returned without reading it"""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fobj:
+        for chunk in iter(lambda: fobj.read(chunk_size), b''):
+            md5.update(chunk)
+    etag = md5.hexdigest()
+    # write the etag atomically, the file can be requested meanwhile
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fobj:
+            fobj.write(etag)
+        os.replace(tmp, etag_path(path))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return etag
+
+def read_etag(path):
+    """Return the etag saved by generate_etag or None"""
+    try:
+        with open(etag_path(path)) as fobj:
+            return fobj.read().strip()
+    except OSError:
+        return None
+
 def validateJSON(value):
     #print (message + 'type', type(value))
     response = ast.literal_eval(json.dumps(value))
@@ -0,0 +1,150 @@
+"""
+Registry of the jobs of the CM
+==============================
+
+The workers record their jobs in JOBS_DIRECTORY: an empty file named
+`<job id>.<pid>` in the `queued` or in the `active` directory while the
+job waits or runs, and the duration of each computation appended to the
+`latency` file. A job is cancelled creating the file `cancelled/<job id>`,
+the computation polls it. The alive consumer reads the registry to answer with the
+load of the CM without waiting for the computations: listing two small
+directories and reading the tail of a file takes well below a millisecond.
+
+The entries of a dead process are ignored, so a crashed worker does not
+keep its slot.
+"""
+import errno
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from .constant import COMPUTE_SLOTS, JOBS_DIRECTORY, LATENCY_WINDOW
+
+STATES = ("queued", "active")
+# maximum length of a line of the latency file
+LINE = 16
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+
+class Registry(object):
+    def __init__(self, directory=JOBS_DIRECTORY, slots=COMPUTE_SLOTS, window=LATENCY_WINDOW):
+        self.directory = directory
+        self.slots = slots
+        self.window = window
+        for state in STATES + ("cancelled",):
+            os.makedirs(os.path.join(directory, state), exist_ok=True)
+
+    def path(self, state, job_id):
+        return os.path.join(self.directory, state, f"{job_id}.{os.getpid()}")
+
+    def mark(self, state, job_id):
+        """Record that the job is in the state"""
+        open(self.path(state, job_id), "w").close()
+
+    def unmark(self, state, job_id):
+        try:
+            os.unlink(self.path(state, job_id))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def job(self, job_id=None):
+        """Record the job as active and its duration once done"""
+        job_id = job_id or uuid.uuid4().hex
+        self.mark("active", job_id)
+        start = time.monotonic()
+        try:
+            yield job_id
+        finally:
+            self.unmark("active", job_id)
+            self.clear(job_id)
+            self.record(time.monotonic() - start)
+
+    def find(self, job_id):
+        """Return the states of the job in the live processes"""
+        states = []
+        for state in STATES:
+            for entry in os.scandir(os.path.join(self.directory, state)):
+                name, _, pid = entry.name.rpartition(".")
+                if name == job_id and pid.isdigit() and _alive(int(pid)):
+                    states.append(state)
+        return states
+
+    def cancel(self, job_id):
+        """Cancel the job if it is queued or active, return False if the
+        job is unknown"""
+        if not self.find(job_id):
+            return False
+        open(os.path.join(self.directory, "cancelled", job_id), "w").close()
+        return True
+
+    def is_cancelled(self, job_id):
+        return job_id is not None and os.path.exists(
+            os.path.join(self.directory, "cancelled", job_id)
+        )
+
+    def clear(self, job_id):
+        """Forget the cancellation of the job once it is done"""
+        try:
+            os.unlink(os.path.join(self.directory, "cancelled", job_id))
+        except FileNotFoundError:
+            pass
+
+    def record(self, seconds):
+        """Append the duration of a computation to the latency file, the
+        lines have a fixed width so the tail of the file can be read without
+        scanning it, the short appends of the workers are not interleaved"""
+        line = f"{seconds:.3f}\n"[-LINE:].rjust(LINE)
+        fd = os.open(
+            os.path.join(self.directory, "latency"),
+            os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+            0o644,
+        )
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+    def latencies(self):
+        """Return the durations of the last computations"""
+        try:
+            with open(os.path.join(self.directory, "latency"), "rb") as fobj:
+                size = fobj.seek(0, os.SEEK_END)
+                fobj.seek(max(0, size - self.window * LINE))
+                data = fobj.read()
+        except FileNotFoundError:
+            return np.array([])
+        return np.array([float(value) for value in data.split()][-self.window :])
+
+    def count(self, state):
+        """Return the number of jobs of live processes in the state"""
+        count = 0
+        for entry in os.scandir(os.path.join(self.directory, state)):
+            pid = entry.name.rpartition(".")[2]
+            if pid.isdigit() and _alive(int(pid)):
+                count += 1
+        return count
+
+    def snapshot(self):
+        """Return the load of the CM"""
+        active = self.count("active")
+        lat = self.latencies()
+        return dict(
+            active_jobs=active,
+            queued_jobs=self.count("queued"),
+            slots=self.slots,
+            free_slots=max(self.slots - active, 0),
+            latency_p50=round(float(np.percentile(lat, 50)), 3) if len(lat) else None,
+            latency_p95=round(float(np.percentile(lat, 95)), 3) if len(lat) else None,
+            latency_samples=len(lat),
+        )
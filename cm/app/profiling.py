@@ -0,0 +1,126 @@
+"""
+Profile the computations
+========================
+
+A profile samples the stack of the thread running the computation at a
+fixed interval and records the wall time of each GRASS module launched by
+`run_command`. The samples are saved as collapsed stacks, one line per
+stack with the number of samples, ready for the flame graph tools, and
+the GRASS module running when a sample is taken is added as leaf frame.
+
+Profiling is opt-in, when no profile is active `current()` returns None
+and nothing else is done.
+"""
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from .constant import PROFILE, PROFILE_DIRECTORY, PROFILE_INTERVAL
+
+_local = threading.local()
+
+
+def enabled(params):
+    """Return True if the computation must be profiled, given the input
+    parameters of the request"""
+    return PROFILE or str(params.get("profile", "false")).lower() in ("1", "true", "yes")
+
+
+@contextmanager
+def disabled():
+    yield None
+
+
+def current():
+    """Return the profile active in the current thread or None"""
+    return getattr(_local, "profile", None)
+
+
+def profile_path(job_id, ext=".json"):
+    # the job id is generated by the CM, but it is also used in the URL
+    return os.path.join(PROFILE_DIRECTORY, os.path.basename(job_id) + ext)
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profile(object):
+    """Sample the stack of the thread that enters the profile"""
+
+    def __init__(self, job_id, interval=PROFILE_INTERVAL):
+        self.job_id = job_id
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.modules = []
+        self.module = None
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        _local.profile = self
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._sampler.join()
+        _local.profile = None
+        self.wall_time = time.perf_counter() - self.start
+        self.save()
+        return False
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.reverse()
+            if self.module is not None:
+                stack.append(f"grass:{self.module}")
+            self.samples[";".join(stack)] += 1
+
+    @contextmanager
+    def grass_module(self, name):
+        """Record the wall time of a GRASS module"""
+        self.module = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.modules.append(dict(module=name, seconds=time.perf_counter() - start))
+            self.module = None
+
+    def collapsed(self):
+        """Return the samples as collapsed stacks"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.items())
+
+    def save(self):
+        os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+        with open(profile_path(self.job_id, ".folded"), "w") as ffile:
+            ffile.write(self.collapsed())
+        summary = collections.defaultdict(lambda: dict(calls=0, seconds=0.0))
+        for mod in self.modules:
+            summary[mod["module"]]["calls"] += 1
+            summary[mod["module"]]["seconds"] += mod["seconds"]
+        with open(profile_path(self.job_id), "w") as jfile:
+            json.dump(
+                dict(
+                    job_id=self.job_id,
+                    wall_time=self.wall_time,
+                    interval=self.interval,
+                    samples=sum(self.samples.values()),
+                    grass_modules=self.modules,
+                    grass_summary=summary,
+                ),
+                jfile,
+            )
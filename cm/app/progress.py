@@ -0,0 +1,142 @@
+"""
+Report the progress of the computations
+=======================================
+
+The computation reports its stages with `report(stage, done, total)`, the
+events are published on the progress queue of the CM with the correlation
+id of the AMQP request, so the platform can show the progress and detect
+stalled jobs.
+
+Reporting never slows the computation: the events are rate-limited and
+they are handed to a background thread that owns the AMQP connection, if
+the queue of the thread is full the event is dropped. When no progress is
+active `report` does nothing.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from .constant import (
+    CELERY_BROKER_URL,
+    CM_ID,
+    PROGRESS_INTERVAL,
+    PROGRESS_Q,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+_local = threading.local()
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+class Publisher(threading.Thread):
+    """Publish the events on the progress queue from a background thread"""
+
+    def __init__(self, url=CELERY_BROKER_URL, routing_key=PROGRESS_Q, maxsize=100):
+        super().__init__(daemon=True)
+        self.url = url
+        self.routing_key = routing_key
+        self.events = queue.Queue(maxsize=maxsize)
+        self.channel = None
+
+    def publish(self, correlation_id, event):
+        try:
+            self.events.put_nowait((correlation_id, event))
+        except queue.Full:
+            LOGGER.debug("progress queue is full, event dropped")
+
+    def connect(self):
+        import pika
+
+        connection = pika.BlockingConnection(pika.URLParameters(self.url))
+        channel = connection.channel()
+        channel.queue_declare(queue=self.routing_key)
+        return channel
+
+    def run(self):
+        import pika
+
+        while True:
+            correlation_id, event = self.events.get()
+            try:
+                if self.channel is None:
+                    self.channel = self.connect()
+                self.channel.basic_publish(
+                    exchange="",
+                    routing_key=self.routing_key,
+                    properties=pika.BasicProperties(correlation_id=correlation_id),
+                    body=json.dumps(event),
+                )
+            except Exception as exc:
+                # the event is lost, connect again with the next one
+                LOGGER.warning(f"Unable to publish the progress: {exc}")
+                self.channel = None
+
+
+def get_publisher():
+    """Return the publisher of the process, started at the first use"""
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None:
+            _publisher = Publisher()
+            _publisher.start()
+    return _publisher
+
+
+class Progress(object):
+    """Progress of the computation of an AMQP request"""
+
+    def __init__(self, correlation_id, interval=PROGRESS_INTERVAL, publisher=None):
+        self.correlation_id = correlation_id
+        self.interval = interval
+        self.publisher = get_publisher() if publisher is None else publisher
+        self.stage = None
+        self.last = 0.0
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        _local.progress = self
+        return self
+
+    def __exit__(self, *exc):
+        _local.progress = None
+        return False
+
+    def report(self, stage, done=None, total=None):
+        """Publish the event if the stage changed or if the last event is
+        older than the interval"""
+        now = time.monotonic()
+        if stage == self.stage and now - self.last < self.interval:
+            return
+        self.stage, self.last = stage, now
+        self.publisher.publish(
+            self.correlation_id,
+            dict(
+                cm_id=CM_ID,
+                stage=stage,
+                done=done,
+                total=total,
+                elapsed=round(now - self.start, 3),
+            ),
+        )
+
+
+@contextmanager
+def disabled():
+    yield None
+
+
+def current():
+    """Return the progress active in the current thread or None"""
+    return getattr(_local, "progress", None)
+
+
+def report(stage, done=None, total=None):
+    """Report the progress of the current computation, if any"""
+    progress = current()
+    if progress is not None:
+        progress.report(stage, done, total)
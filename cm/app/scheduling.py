@@ -0,0 +1,117 @@
+"""
+Schedule the computations by size
+=================================
+
+The compute consumer holds several requests and runs the shortest first,
+so the municipality requests are not stuck behind a country. The cost of
+a request is estimated before it starts from the number of plants and
+from the extent of the plants: the GRASS engine computes the buffers of
+each plant and the statistics of the urban areas in the region around the
+plants.
+
+To avoid starving the large requests, the cost of a request decreases
+linearly with the time it waits (aging). Since all the waiting requests
+age at the same rate, the order is given by `cost + aging * enqueued` and
+the queue is a plain heap.
+"""
+import heapq
+import itertools
+import json
+import os
+import re
+import threading
+import time
+
+from .constant import SCHEDULER_AGING
+
+# bytes of the CSV files read to estimate the cost
+SAMPLE = 1 << 22
+# cost of a km2 of the extent of the plants, in plants
+AREA_COST = 0.01
+POINT = re.compile(rb"POINT\s*\(\s*([-+\d.eE]+)\s+([-+\d.eE]+)")
+
+
+def csv_extent(path, sample=SAMPLE):
+    """Return the number of plants and the extent of the CSV file, read
+    from the first bytes and extrapolated to the file size"""
+    size = os.path.getsize(path)
+    with open(path, "rb") as fobj:
+        data = fobj.read(sample)
+    lines = max(data.count(b"\n") - 1, 0)
+    if size > len(data) and len(data):
+        lines = int(lines * size / len(data))
+    coords = [(float(x), float(y)) for x, y in POINT.findall(data)]
+    if not coords:
+        return lines, None
+    xs, ys = zip(*coords)
+    return lines, (min(xs), min(ys), max(xs), max(ys))
+
+
+def columnar_extent(path):
+    """Return the number of plants and the extent of a columnar file, read
+    from its metadata"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    from .api_v1.heatsrc import columnar
+
+    if columnar.input_format(path) == "parquet":
+        pfile = pq.ParquetFile(path)
+        rows, metadata = pfile.metadata.num_rows, pfile.schema_arrow.metadata
+    else:
+        reader = pa.ipc.open_file(pa.memory_map(path))
+        rows = sum(
+            reader.get_batch(i).num_rows for i in range(reader.num_record_batches)
+        )
+        metadata = reader.schema.metadata
+    geo = json.loads((metadata or {}).get(b"geo", b"{}"))
+    bbox = geo.get("columns", {}).get(geo.get("primary_column"), {}).get("bbox")
+    return rows, tuple(bbox) if bbox else None
+
+
+def estimate_cost(body):
+    """Return the cost of the request, in plants, given the body of the
+    AMQP message"""
+    from .api_v1.heatsrc import columnar
+
+    try:
+        path = json.loads(body)["inputs_vector_selection"]["wwtp_capacity"]
+        if columnar.is_columnar(path):
+            plants, bbox = columnar_extent(path)
+        else:
+            plants, bbox = csv_extent(path)
+    except (OSError, ValueError, KeyError, TypeError):
+        # unknown size, schedule it as a small request
+        return 0.0
+    area = 0.0
+    if bbox is not None:
+        # the coordinates of the platform are in meters (EPSG:3035)
+        area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) / 1e6
+    return plants + AREA_COST * area
+
+
+class Scheduler(object):
+    """Queue of the jobs, shortest first with aging"""
+
+    def __init__(self, aging=SCHEDULER_AGING):
+        self.aging = aging
+        self.heap = []
+        self.cond = threading.Condition()
+        self._count = itertools.count()
+
+    def push(self, cost, item):
+        with self.cond:
+            key = cost + self.aging * time.monotonic()
+            heapq.heappush(self.heap, (key, next(self._count), item))
+            self.cond.notify()
+
+    def pop(self, timeout=None):
+        """Return the next job, waiting up to timeout seconds, or None"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.heap, timeout):
+                return None
+            return heapq.heappop(self.heap)[2]
+
+    def __len__(self):
+        with self.cond:
+            return len(self.heap)
@@ -0,0 +1,169 @@
+"""
+Coalesce the identical computations
+===================================
+
+When several users open the same region at once the platform sends
+identical requests. The requests are identified by a key, the hash of the
+parameters and of the content of the input files, and the computation of
+each key runs once: the first request takes an exclusive lock on the key
+file and computes, the requests with the same key wait for the lock and
+read the result saved by the first one.
+
+The locks are `flock` locks on files in SINGLEFLIGHT_DIRECTORY, so they
+work across the gunicorn workers and they are released by the OS if a
+worker dies. If the computation fails no result is saved and the next
+waiting request computes again. The results and the unused lock files
+older than SINGLEFLIGHT_MAX_AGE are removed.
+
+The requests that share a result return the paths of the output files
+written by the first request, so the output files must outlive every
+request sharing them: they must be kept at least SINGLEFLIGHT_MAX_AGE
+after they are written.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from . import cancel, progress
+from .constant import SINGLEFLIGHT_DIRECTORY, SINGLEFLIGHT_MAX_AGE
+
+
+def _file_hash(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as fobj:
+        for chunk in iter(lambda: fobj.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def request_key(*selections):
+    """Return the key of a request given its inputs and parameters, the
+    values that are paths of existing files are replaced with the hash of
+    their content"""
+    normalized = []
+    for selection in selections:
+        normalized.append(
+            {
+                name: (
+                    _file_hash(value)
+                    if isinstance(value, str) and os.path.isfile(value)
+                    else value
+                )
+                for name, value in selection.items()
+            }
+        )
+    return hashlib.sha256(
+        json.dumps(normalized, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def _version(path):
+    """Return the version of the result file, it is replaced at each save"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _same_file(fobj, path):
+    """Return True if the open file is still the file at path"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return False
+    fstat = os.fstat(fobj.fileno())
+    return (stat.st_dev, stat.st_ino) == (fstat.st_dev, fstat.st_ino)
+
+
+class SingleFlight(object):
+    """Run once the computations with the same key"""
+
+    def __init__(self, directory=SINGLEFLIGHT_DIRECTORY, max_age=SINGLEFLIGHT_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+
+    def paths(self, key):
+        return (
+            os.path.join(self.directory, key + ".lock"),
+            os.path.join(self.directory, key + ".json"),
+        )
+
+    def run(self, key, func):
+        """Return the result of func, computed by this request or by an
+        identical request running at the same time. The result must be JSON
+        serializable. Return a tuple with the result and True if the result
+        comes from another request"""
+        os.makedirs(self.directory, exist_ok=True)
+        lock_path, result_path = self.paths(key)
+        while True:
+            with open(lock_path, "a") as lock:
+                waited = False
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # an identical computation is running, wait for its result
+                    waited, before = True, _version(result_path)
+                    progress.report("wait identical request")
+                    self.wait(lock)
+                if not _same_file(lock, lock_path):
+                    # the lock file was pruned meanwhile, lock the new one
+                    continue
+                if waited and _version(result_path) != before:
+                    with open(result_path) as rfile:
+                        return json.load(rfile), True
+                # the lock is released when the file is closed
+                result = func()
+                self.save(result_path, result)
+            break
+        self.prune()
+        return result, False
+
+    def wait(self, lock):
+        """Wait for the lock, stop waiting if the request is cancelled"""
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                cancel.check()
+                time.sleep(cancel.POLL)
+
+    def save(self, result_path, result):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as tfile:
+                json.dump(result, tfile)
+            os.replace(tmp, result_path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def prune(self):
+        """Remove the results and the lock files older than max_age, a lock
+        file is removed only if no request holds it"""
+        limit = time.time() - self.max_age
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime >= limit:
+                    continue
+                if entry.name.endswith(".json"):
+                    os.unlink(entry.path)
+                elif entry.name.endswith(".lock"):
+                    self.prune_lock(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def prune_lock(self, lock_path):
+        with open(lock_path, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            # the requests that opened the file meanwhile see that it was
+            # removed once they lock it
+            if _same_file(lock, lock_path):
+                os.unlink(lock_path)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+Run the engines of the urban statistics on the same inputs, compare the
+classification of the plants row by row and report the timings.
+
+    python3 compare_engines.py --synthetic 1000 --dists 150:1000 500:5000
+
+The first engine is the reference, the exit code is 1 if any plant is
+classified differently by the other engines.
+"""
+import argparse
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.api_v1 import calculation_module as cm
+from app.constant import URBAN_ENGINES
+from precompute import DEFAULT_DISTS, parse_dists
+
+DATADIR = pathlib.Path(__file__).parent / "tests" / "data"
+SAMPLE_C = DATADIR / "sample_data_c.csv"
+SAMPLE_P = DATADIR / "sample_data_p.csv"
+
+# columns that must be equal for all the engines
+COLUMNS = ["suitability", "distance_label", "plantsize_label", "conditional", "suitable"]
+# capacities on the boundaries of the plant size classes
+CAPACITIES = [1999, 2000, 2001, 5000, 5001, 50000, 50001, 150000, 150001]
+
+
+def synthetic_inputs(size, tmpdir, seed=42):
+    """Write capacity and power CSV files with random plants around the
+    sample plants, a share of the capacities is on the class boundaries"""
+    rng = np.random.default_rng(seed)
+    sample = cm.read_csv(SAMPLE_C).reset_index()
+    points = cm.plants2gdf(sample.assign(power=0)).geometry
+    centers = rng.integers(0, len(points), size)
+    x = points.x.values[centers] + rng.normal(0, 5000, size)
+    y = points.y.values[centers] + rng.normal(0, 5000, size)
+    capacity = np.where(
+        rng.random(size) < 0.2,
+        rng.choice(CAPACITIES, size),
+        rng.integers(1000, 300000, size),
+    )
+    plants = sample.iloc[np.zeros(size, dtype=int)].reset_index(drop=True)
+    plants["geometry_wkt"] = [f"POINT({px} {py})" for px, py in zip(x, y)]
+    plants["gid"] = np.arange(1, size + 1)
+    plants["capacity"] = capacity
+    wwtp_c = pathlib.Path(tmpdir, "synthetic_c.csv")
+    wwtp_p = pathlib.Path(tmpdir, "synthetic_p.csv")
+    plants.to_csv(wwtp_c, index=False)
+    plants["capacity"] = rng.integers(100, 50000, size)
+    plants.rename(columns={"capacity": "power"}).to_csv(wwtp_p, index=False)
+    return wwtp_c, wwtp_p
+
+
+def run_engine(engine, wwtp_c, wwtp_p, within_dist, near_dist):
+    """Classify the plants with the engine, return the plants and the
+    elapsed time in seconds"""
+    start = time.perf_counter()
+    if engine == "buffer":
+        plants = cm.compute_plants(wwtp_c, wwtp_p, within_dist, near_dist)
+    else:
+        inputs = cm.read_inputs(wwtp_c, wwtp_p)
+        plants = cm.query_plants(inputs, within_dist, near_dist, engine=engine)
+    return plants, time.perf_counter() - start
+
+
+def diff_plants(reference, plants, columns=COLUMNS):
+    """Return the rows of the plants classified differently from the
+    reference, the plants are matched on the gid column"""
+    left = reference.set_index("gid")[columns]
+    right = plants.set_index("gid")[columns].reindex(left.index)
+    same = (left == right) | (left.isna() & right.isna())
+    diff = ~same.all(axis=1)
+    return left[diff].join(right[diff], lsuffix="_ref", rsuffix="_engine")
+
+
+def compare(datasets, engines, dists):
+    """Run the engines and print the mismatches and the timings, return
+    the number of mismatched plants"""
+    timings = []
+    mismatches = 0
+    for name, (wwtp_c, wwtp_p) in datasets.items():
+        for within_dist, near_dist in dists:
+            results = {}
+            for engine in engines:
+                plants, elapsed = run_engine(engine, wwtp_c, wwtp_p, within_dist, near_dist)
+                results[engine] = plants
+                timings.append(
+                    dict(
+                        dataset=name,
+                        dists=f"{within_dist}:{near_dist}",
+                        engine=engine,
+                        plants=len(plants),
+                        seconds=elapsed,
+                    )
+                )
+            reference, *others = engines
+            for engine in others:
+                diff = diff_plants(results[reference], results[engine])
+                if len(diff):
+                    mismatches += len(diff)
+                    print(
+                        f"=> {name} {within_dist}:{near_dist}: {len(diff)} plants "
+                        f"classified differently by {engine} and {reference}"
+                    )
+                    print(diff.to_string())
+    timings = pd.DataFrame(timings)
+    timings["plants/s"] = timings["plants"] / timings["seconds"]
+    print(timings.to_string(index=False, float_format="{:.3f}".format))
+    return mismatches
+
+
+def main(argv=None):
+    """Compare the engines, return the exit code: 1 if any plant is
+    classified differently, 0 otherwise"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--engines",
+        nargs="+",
+        choices=URBAN_ENGINES,
+        default=URBAN_ENGINES,
+        help="engines to compare, the first one is the reference (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--dists",
+        nargs="+",
+        type=parse_dists,
+        default=[parse_dists(DEFAULT_DISTS)],
+        help="within:near distances in meters (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=1000,
+        help="number of synthetic plants, 0 to use only the sample data (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # the GRASS engine writes the sidecar files next to the inputs
+        datasets = {
+            "sample": (
+                shutil.copy(SAMPLE_C, tmpdir),
+                shutil.copy(SAMPLE_P, tmpdir),
+            )
+        }
+        if args.synthetic:
+            datasets["synthetic"] = synthetic_inputs(args.synthetic, tmpdir)
+        mismatches = compare(datasets, args.engines, args.dists)
+    if mismatches:
+        print(f"=> {mismatches} plants classified differently")
+        return 1
+    print("=> All the engines give the same classification")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
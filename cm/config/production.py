@@ -19,3 +19,7 @@ ERROR_404_HELP = False
 RESTPLUS_JSON = {
     'separators': (',', ':')
 }
+
+# path of the SQLite database shared by the workers to count the requests,
+# if not set each worker keeps its own counters in memory
+RATELIMIT_STORAGE = os.environ.get('RATELIMIT_STORAGE')
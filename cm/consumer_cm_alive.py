@@ -1,28 +1,43 @@
 #!/usr/bin/env python
+import json
 import pika
 import logging
 
 
-from app.constant import RPC_CM_ALIVE,CM_ID,CELERY_BROKER_URL
+from app.constant import RPC_CM_ALIVE,CM_ID,CELERY_BROKER_URL,GISDB
+from app.jobs import Registry
+from app.api_v1.artifact import read_manifest
 LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
               '-35s %(lineno) -5d: %(message)s')
 LOGGER = logging.getLogger(__name__)
 
 queue_name =  RPC_CM_ALIVE + str(CM_ID)
-parameters = pika.URLParameters(str(CELERY_BROKER_URL))
-connection = pika.BlockingConnection(parameters)
+registry = Registry()
 
-channel = connection.channel()
-
-channel.queue_declare(queue=queue_name)
 
+def capacity():
+    """Return the load of the CM read from the job registry and if the
+    GRASS location is ready, it never waits for the computations"""
+    manifest = read_manifest(GISDB)
+    return dict(
+        status='up',
+        cm_id=CM_ID,
+        location_warm=bool(manifest),
+        location_version=manifest.get('version'),
+        **registry.snapshot()
+    )
 
 
 def on_request(ch, method, props, body):
-    #body.status = 'up'
-
-
-    response = body
+    # keep the fields of the request and add the capacity of the CM
+    try:
+        response = json.loads(body)
+    except ValueError:
+        response = None
+    if not isinstance(response, dict):
+        response = {}
+    response.update(capacity())
+    response = json.dumps(response)
 
     ch.basic_publish(exchange='',
                      routing_key=props.reply_to,
@@ -31,10 +46,23 @@ def on_request(ch, method, props, body):
                      body=str(response))
     ch.basic_ack(delivery_tag = method.delivery_tag)
 
-channel.basic_qos(prefetch_count=1)
-channel.basic_consume(on_request, queue=queue_name)
 
-print(" [x] Awaiting RPC requests")
-LOGGER.info(" [x] Awaiting RPC requests")
-channel.start_consuming()
+def main():
+    parameters = pika.URLParameters(str(CELERY_BROKER_URL))
+    connection = pika.BlockingConnection(parameters)
+
+    channel = connection.channel()
+
+    channel.queue_declare(queue=queue_name)
+
+    channel.basic_qos(prefetch_count=1)
+    channel.basic_consume(on_request, queue=queue_name)
+
+    print(" [x] Awaiting RPC requests")
+    LOGGER.info(" [x] Awaiting RPC requests")
+    channel.start_consuming()
+
+
+if __name__ == '__main__':
+    main()
 
@@ -3,29 +3,31 @@ import pika
 
 
 
+import json
+import queue
 import socket
+import threading
+import uuid
 import requests
 import logging
 from app.constant import PORT,CM_ID,CELERY_BROKER_URL,RPC_Q,TRANFER_PROTOCOLE
+from app.constant import COMPUTE_PREFETCH,COMPUTE_SLOTS
+from app.jobs import Registry
+from app.scheduling import Scheduler,estimate_cost
 LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
               '-35s %(lineno) -5d: %(message)s')
 LOGGER = logging.getLogger(__name__)
 queue_name =  RPC_Q + str(CM_ID)
-parameters = pika.URLParameters(CELERY_BROKER_URL + "?heartbeat_interval=0")
-connection = pika.BlockingConnection(parameters)
+registry = Registry()
 
-channel = connection.channel()
-
-channel.queue_declare(queue=queue_name)
-
-
-
-def on_request(ch, method, props, body):
-    #body.status = 'up'
 
+def compute(body, correlation_id):
+    """Send the computation to the CM server, return the response"""
     print ('body',body)
 
-    headers = {'Content-Type':  'application/json'}
+    # the correlation id is used to publish the progress of the computation
+    headers = {'Content-Type':  'application/json',
+               'X-Correlation-Id': correlation_id or ''}
     ip = socket.gethostbyname(socket.gethostname())
 
     base_url = TRANFER_PROTOCOLE+ str(ip) +':'+str(PORT)+'/computation-module/compute/'
@@ -33,6 +35,10 @@ def on_request(ch, method, props, body):
     res = requests.post(base_url, data = body, headers = headers)
     response = res.text
     print ('onRequest response', response)
+    return response
+
+
+def reply(ch, method, props, response):
     ch.basic_publish(exchange='',
                      routing_key=props.reply_to,
                      properties=pika.BasicProperties(correlation_id = \
@@ -41,9 +47,77 @@ def on_request(ch, method, props, body):
 
     ch.basic_ack(delivery_tag = method.delivery_tag)
 
-channel.basic_qos(prefetch_count=1)
-channel.basic_consume(on_request, queue=queue_name)
 
-print(" [x] Awaiting RPC requests")
-channel.start_consuming()
+def on_request(ch, method, props, body):
+    """Compute the request and reply, without scheduling"""
+    reply(ch, method, props, compute(body, props.correlation_id))
+
+
+def work(scheduler, done):
+    """Run the scheduled jobs, the replies are published by the main loop
+    because the connection is not thread safe"""
+    while True:
+        method, props, body, job_id = scheduler.pop()
+        registry.unmark('queued', job_id)
+        if registry.is_cancelled(job_id):
+            # cancelled while it was waiting
+            registry.clear(job_id)
+            done.put((method, props, json.dumps({'error': f'the job {job_id} was cancelled'})))
+            continue
+        try:
+            response = compute(body, props.correlation_id)
+        except Exception as exc:
+            LOGGER.exception('computation failed')
+            response = json.dumps({'error': str(exc)})
+        done.put((method, props, response))
+
+
+def estimate(received, scheduler):
+    """Estimate the cost of the received jobs and schedule them, the input
+    files are read here and not in the thread of the connection"""
+    while True:
+        method, props, body = received.get()
+        job_id = props.correlation_id or uuid.uuid4().hex
+        registry.mark('queued', job_id)
+        cost = estimate_cost(body)
+        print (f'schedule {job_id} with cost {cost:.0f}')
+        scheduler.push(cost, (method, props, body, job_id))
+
+
+def main():
+    parameters = pika.URLParameters(CELERY_BROKER_URL + "?heartbeat_interval=0")
+    connection = pika.BlockingConnection(parameters)
+
+    channel = connection.channel()
+
+    channel.queue_declare(queue=queue_name)
+
+    # hold several requests to run the shortest first
+    scheduler = Scheduler()
+    received = queue.Queue()
+    done = queue.Queue()
+
+    def on_schedule(ch, method, props, body):
+        received.put((method, props, body))
+
+    threading.Thread(target=estimate, args=(received, scheduler), daemon=True).start()
+    # COMPUTE_SLOTS requests are sent to the CM server at the same time
+    for _ in range(COMPUTE_SLOTS):
+        threading.Thread(target=work, args=(scheduler, done), daemon=True).start()
+
+    channel.basic_qos(prefetch_count=COMPUTE_PREFETCH)
+    channel.basic_consume(on_schedule, queue=queue_name)
+
+    print(" [x] Awaiting RPC requests")
+    while connection.is_open:
+        connection.process_data_events(time_limit=0.1)
+        while True:
+            try:
+                method, props, response = done.get_nowait()
+            except queue.Empty:
+                break
+            reply(channel, method, props, response)
+
 
+if __name__ == '__main__':
+    main()
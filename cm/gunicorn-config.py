@@ -1,2 +1,7 @@
+import os
+
 bind = "0.0.0.0:80"
 workers = 15
+# load the application in the master process and fork warm workers,
+# set CM_PRELOAD=true to import also the geospatial and GRASS modules
+preload_app = os.environ.get("CM_PRELOAD", "").lower() in ("1", "true", "yes")
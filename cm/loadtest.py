@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+"""
+Load test the RPC consumers of the CM with an in-memory broker.
+
+    python3 loadtest.py --rate 20 --duration 30 --mix compute=1 alive=8 register=1
+
+The consumers of consumer_cm_compute.py and consumer_cm_alive.py run in
+threads against the in-memory broker of membroker.py, the platform side
+publishes the requests at the target rate (Poisson arrivals) and waits for
+the replies. The register requests are sent with CalculationModuleRpcClient
+and answered by a stand-in of the platform.
+
+The computation is simulated with a random service time, unless --live is
+given: in that case the compute consumers send the requests to the CM
+server as in production.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pika
+
+import consumer_cm_alive
+import consumer_cm_compute
+from app import CalculationModuleRpcClient
+from app.constant import CM_REGISTER_Q, SIGNATURE
+from membroker import Broker
+
+KINDS = ("compute", "alive", "register")
+QUEUES = {
+    "compute": consumer_cm_compute.queue_name,
+    "alive": consumer_cm_alive.queue_name,
+    "register": CM_REGISTER_Q,
+}
+PAYLOAD = {
+    "inputs_raster_selection": {},
+    "inputs_vector_selection": {
+        "wwtp_capacity": "tests/data/sample_data_c.csv",
+        "wwtp_power": "tests/data/sample_data_p.csv",
+    },
+    "inputs_parameter_selection": {"within_dist": 500, "near_dist": 5000},
+}
+
+
+def parse_mix(values):
+    """Parse the kind=weight pairs of the message mix"""
+    mix = {}
+    for value in values:
+        kind, _, weight = value.partition("=")
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f"{kind} must be one of: {', '.join(KINDS)}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+class SimulatedCM(object):
+    """Stand-in of the CM server, each computation takes a random time with
+    a lognormal distribution of the given mean"""
+
+    def __init__(self, service_time, sigma=0.5, seed=42):
+        self.service_time = service_time
+        self.sigma = sigma
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        with self.lock:
+            value = self.rng.lognormvariate(0, self.sigma)
+        # the mean of the lognormal distribution is exp(sigma^2 / 2)
+        time.sleep(self.service_time * value / np.exp(self.sigma ** 2 / 2))
+        return mock.Mock(text=json.dumps({"result": {"indicator": []}}))
+
+
+class Platform(object):
+    """Publish the requests and collect the replies"""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.connection = broker.connect()
+        self.channel = self.connection.channel()
+        self.reply_to = self.channel.queue_declare(exclusive=True).method.queue
+        self.channel.basic_consume(self.on_response, no_ack=True, queue=self.reply_to)
+        self.pending = {}
+        self.latencies = {kind: [] for kind in KINDS}
+        self.sent = {kind: 0 for kind in KINDS}
+        self.lock = threading.Lock()
+
+    def send(self, kind):
+        if kind == "register":
+            threading.Thread(target=self.register, daemon=True).start()
+            return
+        corr_id = uuid.uuid4().hex
+        with self.lock:
+            self.pending[corr_id] = (kind, time.perf_counter())
+            self.sent[kind] += 1
+        body = json.dumps(PAYLOAD) if kind == "compute" else json.dumps({"status": "?"})
+        self.broker.publish(
+            QUEUES[kind],
+            body,
+            pika.BasicProperties(reply_to=self.reply_to, correlation_id=corr_id),
+        )
+
+    def register(self):
+        with self.lock:
+            self.sent["register"] += 1
+        start = time.perf_counter()
+        CalculationModuleRpcClient().call(json.dumps(SIGNATURE))
+        with self.lock:
+            self.latencies["register"].append(time.perf_counter() - start)
+
+    def on_response(self, ch, method, props, body):
+        with self.lock:
+            kind, start = self.pending.pop(props.correlation_id, (None, None))
+            if kind is not None:
+                self.latencies[kind].append(time.perf_counter() - start)
+
+    def replied(self):
+        with self.lock:
+            return sum(len(lat) for lat in self.latencies.values())
+
+
+def answer_register(ch, method, props, body):
+    """Stand-in of the platform, answer the registration of the CM"""
+    ch.basic_publish(
+        exchange="",
+        routing_key=props.reply_to,
+        properties=pika.BasicProperties(correlation_id=props.correlation_id),
+        body=body,
+    )
+
+
+def start_consumers(broker, compute_workers, alive_workers):
+    threads = []
+    for main, count in (
+        (consumer_cm_compute.main, compute_workers),
+        (consumer_cm_alive.main, alive_workers),
+    ):
+        for _ in range(count):
+            threads.append(threading.Thread(target=main, daemon=True))
+    registry = broker.connect().channel()
+    registry.basic_consume(answer_register, no_ack=True, queue=CM_REGISTER_Q)
+    threads.append(
+        threading.Thread(target=registry.start_consuming, daemon=True)
+    )
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def run(
+    rate=10.0,
+    duration=10.0,
+    mix=None,
+    compute_workers=1,
+    alive_workers=1,
+    prefetch=None,
+    service_time=0.5,
+    timeout=30.0,
+    live=False,
+    seed=42,
+):
+    """Run the load test and return the report, a DataFrame indexed by the
+    kind of the messages, and the backlog of the queues sampled every 0.1 s"""
+    mix = mix or {"compute": 1, "alive": 8, "register": 1}
+    kinds, weights = zip(*mix.items())
+    rng = random.Random(seed)
+    broker = Broker(prefetch=prefetch)
+    backlog = []
+    patches = contextlib.ExitStack()
+    with patches:
+        patches.enter_context(broker.patch())
+        # the consumers print each message
+        patches.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        if not live:
+            patches.enter_context(
+                mock.patch.object(
+                    consumer_cm_compute.requests, "post", SimulatedCM(service_time).post
+                )
+            )
+        threads = start_consumers(broker, compute_workers, alive_workers)
+        platform = Platform(broker)
+        collector = threading.Thread(target=platform.channel.start_consuming, daemon=True)
+        collector.start()
+
+        start = time.perf_counter()
+        next_sample = start
+        next_send = start
+        while time.perf_counter() - start < duration:
+            now = time.perf_counter()
+            if now >= next_send:
+                platform.send(rng.choices(kinds, weights)[0])
+                next_send += rng.expovariate(rate)
+            if now >= next_sample:
+                sizes = broker.backlog()
+                backlog.append(
+                    dict(
+                        time=now - start,
+                        **{kind: sizes.get(QUEUES[kind], 0) for kind in KINDS},
+                    )
+                )
+                next_sample += 0.1
+            time.sleep(max(0.0, min(next_send, next_sample) - time.perf_counter()))
+        sent_time = time.perf_counter() - start
+
+        # wait for the replies of the requests already sent
+        deadline = time.perf_counter() + timeout
+        while (
+            platform.replied() < sum(platform.sent.values())
+            and time.perf_counter() < deadline
+        ):
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        broker.close()
+        for thread in threads + [collector]:
+            thread.join(timeout=1.0)
+
+    report = []
+    for kind in KINDS:
+        lat = np.array(platform.latencies[kind]) * 1000
+        report.append(
+            dict(
+                kind=kind,
+                sent=platform.sent[kind],
+                replied=len(lat),
+                timeouts=platform.sent[kind] - len(lat),
+                throughput=len(lat) / elapsed,
+                p50_ms=np.percentile(lat, 50) if len(lat) else np.nan,
+                p95_ms=np.percentile(lat, 95) if len(lat) else np.nan,
+                p99_ms=np.percentile(lat, 99) if len(lat) else np.nan,
+            )
+        )
+    report = pd.DataFrame(report).set_index("kind")
+    report.attrs["rate"] = sum(platform.sent.values()) / sent_time
+    return report, pd.DataFrame(backlog)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate", type=float, default=10.0, help="messages per second (default: %(default)s)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load (default: %(default)s)")
+    parser.add_argument(
+        "--mix",
+        nargs="+",
+        default=["compute=1", "alive=8", "register=1"],
+        help="kind=weight of the messages (default: %(default)s)",
+    )
+    parser.add_argument("--compute-workers", type=int, default=1, help="compute consumers (default: %(default)s)")
+    parser.add_argument("--alive-workers", type=int, default=1, help="alive consumers (default: %(default)s)")
+    parser.add_argument("--prefetch", type=int, default=None, help="override the prefetch count of the consumers")
+    parser.add_argument(
+        "--service-time",
+        type=float,
+        default=0.5,
+        help="mean seconds of a simulated computation (default: %(default)s)",
+    )
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for the last replies (default: %(default)s)")
+    parser.add_argument("--live", action="store_true", help="send the computations to the CM server")
+    args = parser.parse_args()
+    # the registration client logs each message
+    logging.getLogger("app").setLevel(logging.WARNING)
+    report, backlog = run(
+        rate=args.rate,
+        duration=args.duration,
+        mix=parse_mix(args.mix),
+        compute_workers=args.compute_workers,
+        alive_workers=args.alive_workers,
+        prefetch=args.prefetch,
+        service_time=args.service_time,
+        timeout=args.timeout,
+        live=args.live,
+    )
+    print(f"=> Sent {report['sent'].sum()} messages at {report.attrs['rate']:.1f} msg/s")
+    print(report.to_string(float_format="{:.2f}".format))
+    print("=> Queue backlog (messages)")
+    backlog = backlog[list(KINDS)]
+    print(
+        pd.DataFrame(dict(mean=backlog.mean(), max=backlog.max(), last=backlog.iloc[-1]))
+        .T.to_string(float_format="{:.1f}".format)
+    )
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+"""
+In-memory stand-in of the AMQP broker
+=====================================
+
+The broker implements the subset of the pika 0.12 blocking API used by the
+consumers and by CalculationModuleRpcClient: queues on the default
+exchange, server-named reply queues, prefetch, acknowledgements,
+`process_data_events` and `add_callback_threadsafe`. `Broker.patch()`
+replaces `pika.BlockingConnection`, so the unmodified consumers run against
+the broker, each one in its own thread.
+
+The consumers of a queue compete for its messages, a consumer receives a
+message only while its channel has less unacknowledged messages than the
+prefetch count.
+"""
+import collections
+import itertools
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from unittest import mock
+
+Message = collections.namedtuple("Message", "routing_key properties body published")
+
+
+class Deliver(object):
+    """Method frame passed to the consumer callbacks"""
+
+    def __init__(self, delivery_tag, routing_key, consumer_tag, redelivered=False):
+        self.delivery_tag = delivery_tag
+        self.routing_key = routing_key
+        self.consumer_tag = consumer_tag
+        self.redelivered = redelivered
+        self.exchange = ""
+
+
+class DeclareOk(object):
+    def __init__(self, queue, message_count, consumer_count):
+        self.queue = queue
+        self.message_count = message_count
+        self.consumer_count = consumer_count
+
+
+class Frame(object):
+    def __init__(self, method):
+        self.method = method
+
+
+class Broker(object):
+    """Queues shared by all the connections, prefetch overrides the
+    prefetch count requested by the consumers"""
+
+    def __init__(self, prefetch=None):
+        self.prefetch = prefetch
+        self.cond = threading.Condition()
+        self.queues = collections.defaultdict(collections.deque)
+        self.consumers = collections.defaultdict(list)
+        self.published = collections.Counter()
+        self.closed = False
+        self.connections = []
+        self._tags = itertools.count(1)
+
+    def publish(self, routing_key, body, properties=None):
+        if isinstance(body, str):
+            body = body.encode()
+        with self.cond:
+            self.queues[routing_key].append(
+                Message(routing_key, properties, body, time.monotonic())
+            )
+            self.published[routing_key] += 1
+            self.cond.notify_all()
+
+    def backlog(self):
+        """Return the number of messages waiting in each queue"""
+        with self.cond:
+            return {name: len(queue) for name, queue in self.queues.items()}
+
+    def close(self):
+        """Stop all the consumers and close the connections"""
+        with self.cond:
+            self.closed = True
+            for connection in self.connections:
+                connection.is_open = False
+            self.cond.notify_all()
+
+    def connect(self, parameters=None):
+        connection = BlockingConnection(self, parameters)
+        with self.cond:
+            self.connections.append(connection)
+        return connection
+
+    @contextmanager
+    def patch(self):
+        """Connect pika.BlockingConnection to the broker, the connection
+        parameters are not used"""
+        import pika
+
+        with mock.patch.object(pika, "BlockingConnection", self.connect):
+            with mock.patch.object(pika, "URLParameters", str):
+                yield self
+
+
+class BlockingConnection(object):
+    def __init__(self, broker, parameters=None):
+        self.broker = broker
+        self.parameters = parameters
+        self.channels = []
+        self.callbacks = collections.deque()
+        self.is_open = True
+
+    def channel(self):
+        channel = Channel(self)
+        self.channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback):
+        """Run callback in the thread of the connection, at the next
+        process_data_events"""
+        with self.broker.cond:
+            self.callbacks.append(callback)
+            self.broker.cond.notify_all()
+
+    def _next(self):
+        """Return the next delivery for the channels of the connection, it
+        is called with the broker lock"""
+        for channel in self.channels:
+            for tag, (queue, callback, no_ack) in list(channel.consumers.items()):
+                if not channel.can_receive() or not self.broker.queues[queue]:
+                    continue
+                message = self.broker.queues[queue].popleft()
+                delivery_tag = next(self.broker._tags)
+                if not no_ack:
+                    channel.unacked[delivery_tag] = message
+                return channel, callback, Deliver(delivery_tag, queue, tag), message
+        return None
+
+    def process_data_events(self, time_limit=0):
+        """Deliver the messages available to the consumers, if there are
+        none wait up to time_limit seconds (None: until a message arrives).
+        With time_limit=0 the call waits one millisecond to avoid spinning
+        in the polling loops"""
+        deadline = None if time_limit is None else time.monotonic() + max(time_limit, 0.001)
+        delivered = False
+        while True:
+            with self.broker.cond:
+                callbacks = list(self.callbacks)
+                self.callbacks.clear()
+                item = None if callbacks else self._next()
+                if not callbacks and item is None:
+                    if delivered or any(channel.stopped for channel in self.channels):
+                        return
+                    if self.broker.closed and deadline is None:
+                        return
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return
+                    self.broker.cond.wait(remaining)
+                    continue
+            for callback in callbacks:
+                callback()
+            if item is not None:
+                channel, callback, method, message = item
+                callback(channel, method, message.properties, message.body)
+            delivered = True
+
+    def sleep(self, duration):
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline and not self.broker.closed:
+            self.process_data_events(time_limit=deadline - time.monotonic())
+
+    def close(self):
+        with self.broker.cond:
+            for channel in self.channels:
+                channel.close()
+        self.is_open = False
+
+
+class Channel(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.broker = connection.broker
+        self.consumers = {}
+        self.unacked = {}
+        self.prefetch_count = 0
+        self.stopped = False
+
+    def can_receive(self):
+        prefetch = self.prefetch_count if self.broker.prefetch is None else self.broker.prefetch
+        return not prefetch or len(self.unacked) < prefetch
+
+    def queue_declare(self, queue="", exclusive=False, **kwargs):
+        queue = queue or f"amq.gen-{uuid.uuid4().hex}"
+        with self.broker.cond:
+            messages = len(self.broker.queues[queue])
+            consumers = len(self.broker.consumers[queue])
+        return Frame(DeclareOk(queue, messages, consumers))
+
+    def basic_qos(self, prefetch_size=0, prefetch_count=0, **kwargs):
+        self.prefetch_count = prefetch_count
+
+    def basic_consume(
+        self,
+        consumer_callback=None,
+        queue="",
+        no_ack=False,
+        consumer_tag=None,
+        on_message_callback=None,
+        auto_ack=None,
+        **kwargs,
+    ):
+        # the keywords of pika 1.x are accepted too
+        callback = consumer_callback or on_message_callback
+        no_ack = no_ack if auto_ack is None else auto_ack
+        consumer_tag = consumer_tag or f"ctag-{uuid.uuid4().hex}"
+        with self.broker.cond:
+            self.consumers[consumer_tag] = (queue, callback, no_ack)
+            self.broker.consumers[queue].append(self)
+            self.broker.cond.notify_all()
+        return consumer_tag
+
+    def basic_publish(self, exchange, routing_key, body, properties=None, **kwargs):
+        self.broker.publish(routing_key, body, properties)
+        return True
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        with self.broker.cond:
+            tags = [tag for tag in self.unacked if tag <= delivery_tag] if multiple else [delivery_tag]
+            for tag in tags:
+                self.unacked.pop(tag, None)
+            self.broker.cond.notify_all()
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        with self.broker.cond:
+            message = self.unacked.pop(delivery_tag, None)
+            if message is not None and requeue:
+                self.broker.queues[message.routing_key].appendleft(message)
+            self.broker.cond.notify_all()
+
+    def start_consuming(self):
+        self.stopped = False
+        while not self.stopped and not self.broker.closed:
+            self.connection.process_data_events(time_limit=None)
+
+    def stop_consuming(self):
+        with self.broker.cond:
+            self.stopped = True
+            self.broker.cond.notify_all()
+
+    def close(self):
+        """Requeue the unacknowledged messages and remove the consumers, it
+        is called with the broker lock"""
+        for message in reversed(list(self.unacked.values())):
+            self.broker.queues[message.routing_key].appendleft(message)
+        self.unacked.clear()
+        for queue, _, _ in self.consumers.values():
+            if self in self.broker.consumers[queue]:
+                self.broker.consumers[queue].remove(self)
+        self.consumers.clear()
+        self.stopped = True
+        self.broker.cond.notify_all()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Classify offline the whole reference WWTP dataset for a grid of distances
+and save the result in the reference store used by the `/compute/` route.
+
+    python3 precompute.py --dists 150:1000 100:500 --output /data/wwtp_reference.sqlite
+
+The engine used to classify the plants is recorded in the store, which is
+used only by the calculation module running with the same URBAN_ENGINE.
+"""
+import argparse
+import logging
+import os
+import pathlib
+import tempfile
+
+from app.api_v1 import calculation_module as cm
+from app.constant import INPUTS_CALCULATION_MODULE, URBAN_ENGINE, URBAN_ENGINES
+
+LOG_FORMAT = ('%(levelname) -10s %(asctime)s %(name) -30s %(funcName) '
+              '-35s %(lineno) -5d: %(message)s')
+LOGGER = logging.getLogger(__name__)
+
+DEFAULTS = {
+    inp["input_parameter_name"]: inp["input_value"]
+    for inp in INPUTS_CALCULATION_MODULE
+}
+DEFAULT_DISTS = f"{DEFAULTS['within_dist']}:{DEFAULTS['near_dist']}"
+
+
+def parse_dists(value):
+    """Convert a string `within:near` in a tuple of integers"""
+    within_dist, near_dist = (int(dist) for dist in value.split(":"))
+    if near_dist <= within_dist:
+        raise argparse.ArgumentTypeError(
+            f"near distance ({near_dist}) <= within distance ({within_dist})"
+        )
+    return within_dist, near_dist
+
+
+def split_reference(reference, tmpdir):
+    """Split the reference dataset in the capacity and power CSV files
+    expected by the calculation module"""
+    ref = cm.read_csv(reference).reset_index()
+    wwtp_c = pathlib.Path(tmpdir, "reference_c.csv")
+    wwtp_p = pathlib.Path(tmpdir, "reference_p.csv")
+    if "power" not in ref.columns:
+        # the power is not used by the classification
+        ref["power"] = 0
+    ref.drop(columns="power").to_csv(wwtp_c, index=False)
+    ref.drop(columns="capacity").to_csv(wwtp_p, index=False)
+    return wwtp_c, wwtp_p
+
+
+def classify_plants(wwtp_c, wwtp_p, inputs, within_dist, near_dist, engine):
+    """Classify the plants with the engine used by the calculation module"""
+    if engine == "buffer":
+        return cm.compute_plants(wwtp_c, wwtp_p, within_dist, near_dist)
+    return cm.query_plants(inputs, within_dist, near_dist, engine=engine)
+
+
+def precompute(dists, output, engine=URBAN_ENGINE):
+    if os.path.exists(output) and cm.store_engine(output) != engine:
+        raise ValueError(
+            f"{output} was classified with the {cm.store_engine(output)} engine, "
+            f"not with {engine}"
+        )
+    reference = cm.get_datasets({cm.WWTP: cm.URLS[cm.WWTP]})[cm.WWTP]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        wwtp_c, wwtp_p = split_reference(reference, tmpdir)
+        inputs = cm.read_inputs(wwtp_c, wwtp_p)
+        for within_dist, near_dist in dists:
+            print(
+                f"=> Classify the reference dataset using: {within_dist} and "
+                f"{near_dist} m ({engine})"
+            )
+            plants = classify_plants(wwtp_c, wwtp_p, inputs, within_dist, near_dist, engine)
+            cm.store_plants(
+                plants, inputs, within_dist, near_dist, path=output, engine=engine
+            )
+            print(f"=> Saved {len(plants)} plants in {output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--dists",
+        nargs="+",
+        type=parse_dists,
+        default=[
+            parse_dists(dists)
+            for dists in os.environ.get("PRECOMPUTE_DISTS", DEFAULT_DISTS).split()
+        ],
+        help=(
+            "grid of within:near distances in meters, "
+            f"the default distances {DEFAULT_DISTS} are always computed"
+        ),
+    )
+    parser.add_argument(
+        "--output",
+        default=os.fspath(cm.REFERENCE_STORE),
+        help="path of the reference store (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=URBAN_ENGINES,
+        default=URBAN_ENGINE,
+        help="engine used to classify the plants (default: %(default)s)",
+    )
+    args = parser.parse_args()
+    dists = set(args.dists) | {parse_dists(DEFAULT_DISTS)}
+    precompute(sorted(dists), args.output, args.engine)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Prepare the GRASS location used by the calculation module as a versioned,
+read-only artifact that the workers attach at startup.
+
+    python3 prepare.py --output /data/locations --engines kdtree pyramid --tarball
+
+The artifact is saved in `<output>/<version>` (and `<output>/<version>.tar`
+with --tarball), `<output>/current` points to the last prepared artifact.
+Set PREPARED_LOCATION to the artifact to attach it in the workers.
+"""
+import argparse
+import os
+import pathlib
+import shutil
+import tempfile
+
+from app.api_v1 import artifact
+from app.api_v1 import calculation_module as cm
+from app.constant import URBAN_ENGINES
+
+
+def prepare(output, engines, tarball=False):
+    output = pathlib.Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    tmp = pathlib.Path(tempfile.mkdtemp(dir=output))
+    try:
+        print(f"=> Build the location in {tmp}")
+        manifest = cm.build_location(tmp, engines=engines)
+        artifact.freeze(tmp)
+        target = output / manifest["version"]
+        if target.exists():
+            print(f"=> The artifact {target} already exists")
+            shutil.rmtree(tmp)
+        else:
+            os.replace(tmp, target)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    if tarball:
+        tar = output / (manifest["version"] + ".tar")
+        artifact.pack(target, tar)
+        print(f"=> Saved {tar}")
+
+    # update the link to the last artifact atomically
+    link = output / "current"
+    tmplink = output / f".current-{manifest['version']}"
+    if os.path.lexists(tmplink):
+        os.unlink(tmplink)
+    os.symlink(target.name, tmplink)
+    os.replace(tmplink, link)
+    print(f"=> Prepared location {manifest['version']}: {target}")
+    return target
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--output",
+        default=os.environ.get("PREPARED_OUTPUT", "/data/locations"),
+        help="directory of the artifacts (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--engines",
+        nargs="*",
+        choices=[engine for engine in URBAN_ENGINES if engine != "buffer"],
+        default=[],
+        help="build also the data of these engines",
+    )
+    parser.add_argument(
+        "--tarball", action="store_true", help="save the artifact also as tarball"
+    )
+    args = parser.parse_args()
+    prepare(args.output, args.engines, tarball=args.tarball)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 import logging
 import os
-from app import create_app, log
+from app import create_app, log, preload
 from app import constant
 import requests
 import threading
@@ -15,6 +15,14 @@ LOGGER = logging.getLogger(__name__)
 
 
 application = create_app(os.environ.get('FLASK_CONFIG', 'development'))
+if constant.PREPARED_LOCATION:
+    # attach the GRASS location prepared when the image was built
+    from app.api_v1 import artifact
+    artifact.attach(constant.PREPARED_LOCATION, constant.GISDB)
+if os.environ.get('CM_PRELOAD', '').lower() in ('1', 'true', 'yes'):
+    # import the heavy modules and load the KD-tree of the location once,
+    # before gunicorn forks the workers
+    preload()
 if __name__ != '__main__':
     gunicorn_logger = logging.getLogger('gunicorn.error')
     application.logger.handlers = gunicorn_logger.handlers
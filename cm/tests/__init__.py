@@ -1,4 +1,55 @@
 import unittest
 from .tests import TestAPI
+from .test_rate_limit import TestRateLimit
+from .test_startup import TestStartup
+from .test_classify import TestClassifier
+from .test_kdtree import TestUrbanTree
+from .test_stats import TestTechStats
+from .test_pyramid import TestUrbanPyramid
+from .test_profiling import TestProfiling
+from .test_progress import TestProgress
+from .test_artifact import TestArtifact
+from .test_mapset import TestMapset
+from .test_stream import TestStream
+from .test_columnar import TestColumnar
+from .test_singleflight import TestSingleFlight
+from .test_loadtest import TestLoadTest
+from .test_jobs import TestJobs
+from .test_scheduling import TestScheduling
+from .test_cancel import TestCancel
+from .test_store import TestStore
+from .test_layer import TestLayer
+from .test_tiles import TestTiles
+from .test_files import TestFiles
+from .test_download import TestDownload
+from .test_compare_engines import TestCompareEngines
 
-suite = unittest.TestLoader().loadTestsFromTestCase(TestAPI)
+loader = unittest.TestLoader()
+suite = unittest.TestSuite(
+    [
+        loader.loadTestsFromTestCase(TestAPI),
+        loader.loadTestsFromTestCase(TestRateLimit),
+        loader.loadTestsFromTestCase(TestStartup),
+        loader.loadTestsFromTestCase(TestClassifier),
+        loader.loadTestsFromTestCase(TestUrbanTree),
+        loader.loadTestsFromTestCase(TestTechStats),
+        loader.loadTestsFromTestCase(TestUrbanPyramid),
+        loader.loadTestsFromTestCase(TestProfiling),
+        loader.loadTestsFromTestCase(TestProgress),
+        loader.loadTestsFromTestCase(TestArtifact),
+        loader.loadTestsFromTestCase(TestMapset),
+        loader.loadTestsFromTestCase(TestStream),
+        loader.loadTestsFromTestCase(TestColumnar),
+        loader.loadTestsFromTestCase(TestSingleFlight),
+        loader.loadTestsFromTestCase(TestLoadTest),
+        loader.loadTestsFromTestCase(TestJobs),
+        loader.loadTestsFromTestCase(TestScheduling),
+        loader.loadTestsFromTestCase(TestCancel),
+        loader.loadTestsFromTestCase(TestStore),
+        loader.loadTestsFromTestCase(TestLayer),
+        loader.loadTestsFromTestCase(TestTiles),
+        loader.loadTestsFromTestCase(TestFiles),
+        loader.loadTestsFromTestCase(TestDownload),
+        loader.loadTestsFromTestCase(TestCompareEngines),
+    ]
+)
@@ -0,0 +1,55 @@
+import os
+import stat
+import tempfile
+import unittest
+
+from app.api_v1 import artifact
+
+
+class TestArtifact(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.prepared = os.path.join(self.tmpdir.name, "prepared")
+        permanent = os.path.join(self.prepared, "wwtp", "PERMANENT")
+        os.makedirs(permanent)
+        self.clc = os.path.join(self.tmpdir.name, "clc2018.tif")
+        with open(self.clc, "wb") as fobj:
+            fobj.write(b"clc")
+        with open(os.path.join(permanent, "DEFAULT_WIND"), "w") as fobj:
+            fobj.write("proj: 99\n")
+        self.manifest = artifact.make_manifest(
+            self.clc, "http://example.com/clc2018.tif", [121, 111, 112], "wwtp"
+        )
+        artifact.write_manifest(self.prepared, self.manifest)
+        artifact.freeze(self.prepared)
+
+    def check(self, source):
+        gisdb = os.path.join(self.tmpdir.name, "gisdb")
+        self.assertEqual(artifact.attach(source, gisdb), self.manifest)
+        wind = os.path.join(gisdb, "wwtp", "PERMANENT", "DEFAULT_WIND")
+        with open(wind) as fobj:
+            self.assertEqual(fobj.read(), "proj: 99\n")
+        self.assertFalse(os.stat(wind).st_mode & stat.S_IWUSR)
+        # the directories are writable to create the temporary mapsets
+        os.makedirs(os.path.join(gisdb, "wwtp", "mset_test"))
+        return wind
+
+    def test_manifest(self):
+        self.assertEqual(self.manifest["urban_categories"], [111, 112, 121])
+        other = artifact.make_manifest(
+            self.clc, "http://example.com/clc2018.tif", [111, 112], "wwtp"
+        )
+        self.assertNotEqual(self.manifest["version"], other["version"])
+        self.assertEqual(artifact.read_manifest(self.tmpdir.name), {})
+
+    def test_attach_directory(self):
+        wind = self.check(self.prepared)
+        source = os.path.join(self.prepared, "wwtp", "PERMANENT", "DEFAULT_WIND")
+        self.assertTrue(os.path.samefile(wind, source))
+
+    def test_attach_tarball(self):
+        tarball = artifact.pack(
+            self.prepared, os.path.join(self.tmpdir.name, "v1.tar")
+        )
+        self.check(tarball)
@@ -0,0 +1,74 @@
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+from app import cancel, jobs
+from app.exceptions import Cancelled, DeadlineExceeded
+
+
+class Module(object):
+    """Stand-in of a GRASS module that forks a child and hangs"""
+
+    def __init__(self):
+        self.popen = None
+
+    def run(self):
+        self.popen = subprocess.Popen(["sh", "-c", "sleep 60 & sleep 60; wait"])
+        if self.popen.wait():
+            raise RuntimeError("module failed")
+
+
+class TestCancel(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.registry = jobs.Registry(self.tmpdir.name)
+
+    def test_kill_tree(self):
+        proc = subprocess.Popen(["sh", "-c", "sleep 60 & sleep 60; wait"])
+        time.sleep(0.1)
+        pids = [proc.pid] + cancel.descendants(proc.pid)
+        self.assertEqual(len(pids), 3)
+        start = time.monotonic()
+        cancel.kill_tree(proc.pid)
+        proc.wait(timeout=1)
+        self.assertLess(time.monotonic() - start, 1.0)
+        time.sleep(0.05)
+        self.assertFalse(any(cancel._running(pid) for pid in pids))
+
+    def test_deadline(self):
+        with cancel.Token("late", timeout=0.05) as token:
+            cancel.check()
+            time.sleep(0.06)
+            with self.assertRaises(DeadlineExceeded):
+                cancel.check()
+            self.assertEqual(token.reason(), "timeout")
+        # no active token
+        cancel.check()
+
+    def test_cancel_registry(self):
+        self.assertFalse(self.registry.cancel("unknown"))
+        with self.registry.job("job"):
+            token = cancel.Token("job", timeout=0, registry=self.registry)
+            token.check()
+            self.assertEqual(self.registry.find("job"), ["active"])
+            self.assertTrue(self.registry.cancel("job"))
+            with self.assertRaises(Cancelled):
+                token.check()
+        # the cancellation is cleared with the job
+        self.assertFalse(self.registry.is_cancelled("job"))
+
+    def test_kill_module(self):
+        module = Module()
+        with self.registry.job("job"):
+            with cancel.Token("job", timeout=0, registry=self.registry, poll=0.05):
+                threading.Timer(0.2, self.registry.cancel, ("job",)).start()
+                start = time.monotonic()
+                with self.assertRaises(Cancelled):
+                    with cancel.watch(module):
+                        module.run()
+                elapsed = time.monotonic() - start
+        self.assertLess(elapsed, 1.0)
+        self.assertFalse(cancel.descendants(module.popen.pid))
@@ -0,0 +1,148 @@
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from app.api_v1.heatsrc import technical as tech
+from app.api_v1.heatsrc.classify import (
+    Classifier,
+    classify_plants,
+    default_config,
+    get_classifier,
+)
+
+OPERATORS = {
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "=": np.equal,
+}
+
+
+def sql_classify(plants, dist_min, dist_max):
+    """Apply the UPDATE statements once run by `tech_potential` one after
+    the other"""
+    out = pd.Series(None, index=plants.index, dtype=object)
+    dmin_sum = plants[f"dist{dist_min}m_sum"]
+    dmax_sum = plants[f"dist{dist_max}m_sum"]
+    for (dlabel, clabel), sustain in tech.SUSTAINABILITY.unstack().items():
+        dmin, dmax = (cond.strip() for cond in tech.DIST_DICT[dlabel])
+        cmin, cmax = tech.PLANT_SIZE[clabel]
+        where = plants["capacity"] > cmin
+        if cmax:
+            where &= plants["capacity"] <= cmax
+        for values, cond in ((dmin_sum, dmin), (dmax_sum, dmax)):
+            oper = cond.rstrip("-0123456789 ")
+            where &= OPERATORS[oper](values, float(cond[len(oper):]))
+        out[where] = f"{sustain}|{dlabel}|{clabel}"
+    return out
+
+
+def random_plants(size, seed=42):
+    rng = np.random.default_rng(seed)
+    bounds = [0, 2000, 5000, 5001, 50000, 50001, 150000, 150001]
+    capacity = np.where(
+        rng.random(size) < 0.3,
+        rng.choice(bounds, size) + rng.integers(-1, 2, size),
+        rng.integers(0, 300000, size),
+    )
+    return pd.DataFrame(
+        {
+            "capacity": capacity,
+            "dist150m_sum": rng.integers(0, 30, size),
+            "dist1000m_sum": rng.integers(0, 60, size),
+        }
+    )
+
+
+class TestClassifier(unittest.TestCase):
+    def check(self, classifier, plants):
+        expected = sql_classify(plants, 150, 1000)
+        plants = classify_plants(plants, 150, 1000, classifier=classifier)
+        result = (
+            plants["suitability"] + "|"
+            + plants["distance_label"] + "|"
+            + plants["plantsize_label"]
+        )
+        self.assertEqual(
+            [val if isinstance(val, str) else None for val in result],
+            [val if isinstance(val, str) else None for val in expected],
+        )
+        colors = plants["suitability"].map(tech.COLORS)
+        self.assertEqual(
+            [val if isinstance(val, str) else None for val in plants["color"]],
+            [val if isinstance(val, str) else None for val in colors],
+        )
+
+    def test_sql_rules(self):
+        self.check(get_classifier(), random_plants(100000))
+
+    def test_nan(self):
+        plants = random_plants(1000, seed=2).astype(float)
+        for col, start in (("capacity", 0), ("dist150m_sum", 10), ("dist1000m_sum", 20)):
+            plants.loc[start : start + 9, col] = np.nan
+        # the plants with NaN values are not classified
+        self.check(get_classifier(), plants)
+        self.assertTrue(classify_plants(plants, 150, 1000)["suitability"][:30].isna().all())
+
+    def test_json_config(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "classifier.json")
+            with open(path, "w") as jfile:
+                json.dump(default_config(), jfile)
+            self.check(Classifier.from_json(path), random_plants(1000, seed=1))
+
+    def test_timing(self):
+        plants = random_plants(1000000)
+        classifier = get_classifier()
+        start = time.perf_counter()
+        classifier.classify(
+            plants["capacity"].values,
+            plants["dist150m_sum"].values,
+            plants["dist1000m_sum"].values,
+        )
+        elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, 1.0)
+
+    def test_tech_potential(self):
+        plants = random_plants(1000, seed=3)
+        plants.insert(0, "cat", np.arange(1, len(plants) + 1))
+        plants["power"] = np.arange(len(plants)) * 10.0
+        joined = {}
+
+        class Proc(object):
+            def __init__(self, stdout):
+                self.outputs = {"stdout": mock.Mock(value=stdout)}
+
+        def run_command(name, **kwargs):
+            if name == "v.db.select":
+                return Proc(plants[kwargs["columns"].split(",")].to_csv(sep="|", index=False))
+            if name == "db.in.ogr":
+                with sqlite3.connect(kwargs["input"]) as conn:
+                    joined["table"] = pd.read_sql_query(
+                        f"SELECT * FROM {kwargs['layer']}", conn
+                    )
+            return Proc("")
+
+        with mock.patch.object(tech, "buffer"):
+            with mock.patch.object(tech, "run_command", side_effect=run_command) as run:
+                tech.tech_potential("wwtp", "urbanareas", 150, 1000)
+        # no SQL update per class, the classes are joined at once
+        self.assertNotIn("db.execute", [call.args[0] for call in run.call_args_list])
+        expected = tech.power_potential(classify_plants(plants.copy(), 150, 1000))
+        table = joined["table"]
+        self.assertEqual(list(table["cat"]), list(plants["cat"]))
+        for col in ("suitability", "distance_label", "plantsize_label", "color"):
+            self.assertEqual(
+                list(table[col].where(table[col].notna(), None)),
+                list(expected[col].where(expected[col].notna(), None)),
+            )
+        np.testing.assert_allclose(table["suitable"], expected["suitable"])
+        np.testing.assert_allclose(table["conditional"], expected["conditional"])
@@ -0,0 +1,137 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from shapely import wkt
+
+from app.api_v1 import calculation_module as cm
+from app.exceptions import ValidationError
+from app.api_v1.heatsrc import classify, columnar, stream
+from app.api_v1.heatsrc import technical as tech
+
+DATADIR = os.path.join(os.path.dirname(__file__), "data")
+SAMPLE_C = os.path.join(DATADIR, "sample_data_c.csv")
+SAMPLE_P = os.path.join(DATADIR, "sample_data_p.csv")
+
+
+def geoparquet(csvpath, path):
+    """Write the plants of the CSV file as GeoParquet"""
+    plants = pd.read_csv(csvpath).drop(columns="srid")
+    geoms = [wkt.loads(geom).wkb for geom in plants.pop("geometry_wkt")]
+    table = pa.Table.from_pandas(plants.assign(geometry=geoms), preserve_index=False)
+    geo = dict(
+        version="1.0.0",
+        primary_column="geometry",
+        columns=dict(
+            geometry=dict(
+                encoding="WKB", crs=dict(id=dict(authority="EPSG", code=3035))
+            )
+        ),
+    )
+    metadata = dict(table.schema.metadata, geo=json.dumps(geo))
+    pq.write_table(table.replace_schema_metadata(metadata), path)
+
+
+class TestColumnar(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.reference = cm.read_inputs(SAMPLE_C, SAMPLE_P)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def check(self, plants):
+        self.assertEqual(list(plants["gid"]), list(self.reference["gid"]))
+        self.assertEqual(list(plants["power"]), list(self.reference["power"]))
+        self.assertEqual(list(plants["srid"]), list(self.reference["srid"]))
+        for geom, ref in zip(plants["geometry_wkt"], self.reference["geometry_wkt"]):
+            self.assertTrue(wkt.loads(geom).equals_exact(wkt.loads(ref), 1e-6))
+
+    def test_formats(self):
+        # the platform can save the files with the wrong extension
+        wwtp_c, wwtp_p = self.path("capacity.csv"), self.path("power.feather")
+        geoparquet(SAMPLE_C, wwtp_c)
+        table = pa.Table.from_pandas(pd.read_csv(SAMPLE_P), preserve_index=False)
+        with pa.ipc.new_file(wwtp_p, table.schema) as writer:
+            writer.write_table(table)
+        self.assertEqual(columnar.input_format(wwtp_c), "parquet")
+        self.assertEqual(columnar.input_format(wwtp_p), "arrow")
+        self.assertEqual(columnar.input_format(SAMPLE_C), "csv")
+        self.check(cm.read_inputs(wwtp_c, wwtp_p))
+
+    def test_batches(self):
+        wwtp_c = self.path("capacity.parquet")
+        geoparquet(SAMPLE_C, wwtp_c)
+        batches = list(stream.read_batches(wwtp_c, SAMPLE_P, chunksize=4))
+        self.assertEqual([len(batch) for batch in batches], [4, 4, 1])
+        self.check(pd.concat(batches, ignore_index=True))
+
+    def test_geoparquet_output(self):
+        path = self.path("plants.parquet")
+        columnar.write_geoparquet(cm.plants2gdf(self.reference), path)
+        # full column names and point geometries
+        plants = columnar.read_table(path)
+        self.assertIn("hour_of_year", plants.columns)
+        self.assertTrue(all(geom.startswith("POINT") for geom in plants["geometry_wkt"]))
+        self.check(plants)
+
+    def test_grass_engine(self):
+        wwtp_c = self.path("capacity.parquet")
+        geoparquet(SAMPLE_C, wwtp_c)
+        # GRASS does not import the columnar inputs, no file is converted
+        with self.assertRaises(ValidationError):
+            cm.compute_plants(wwtp_c, SAMPLE_P, 150, 1000)
+        self.assertEqual(os.listdir(self.tmpdir.name), ["capacity.parquet"])
+        indicators = []
+        with mock.patch.object(cm, "URBAN_ENGINE", "buffer"):
+            self.assertEqual(cm.query_engine("columnar inputs", indicators), "kdtree")
+        self.assertIn("columnar inputs", indicators[0]["name"])
+        with mock.patch.object(cm, "URBAN_ENGINE", "pyramid"):
+            self.assertEqual(cm.query_engine("columnar inputs", indicators), "pyramid")
+        self.assertEqual(len(indicators), 1)
+
+    def test_srid(self):
+        self.assertEqual(columnar._srid(dict(id=dict(authority="EPSG", code=3035))), 3035)
+        self.assertEqual(columnar._srid(None), columnar.DEFAULT_SRID)
+        self.assertEqual(columnar._srid("EPSG:3857"), 3857)
+        # a custom CRS, without the EPSG code
+        custom = "+proj=laea +lat_0=50 +lon_0=5 +x_0=0 +y_0=0 +ellps=GRS80 +units=m"
+        for crs in (custom, dict(id=dict(authority="EPSG")), "not a crs"):
+            with self.assertRaises(ValidationError):
+                columnar._srid(crs)
+
+    def classified(self):
+        sums = np.arange(len(self.reference)) * 10.0
+        plants = classify.classify_plants(
+            self.reference.assign(dist150m_sum=sums, dist1000m_sum=2 * sums), 150, 1000
+        )
+        return tech.power_potential(plants)
+
+    def test_flatgeobuf_output(self):
+        plants = self.classified()
+        layers = cm.export_plants(self.tmpdir.name, plants, "flatgeobuf", None)
+        self.assertTrue(layers[0]["path"].endswith(".fgb"))
+        # the features are sorted by the spatial index
+        gdf = gpd.read_file(self.path(layers[0]["path"])).sort_values("gid")
+        self.assertEqual(gdf.crs.to_epsg(), 3035)
+        self.assertEqual(list(gdf["gid"]), list(plants["gid"]))
+        self.assertEqual(list(gdf["suitability"]), list(plants["suitability"]))
+        np.testing.assert_allclose(gdf["suitable"], plants["suitable"])
+        for geom, ref in zip(gdf.geometry, plants["geometry_wkt"]):
+            self.assertTrue(geom.equals_exact(wkt.loads(ref), 1e-6))
+
+    def test_empty_output(self):
+        # GRASS returns no attribute table when no plant is classified
+        plants = cm.empty_plants(self.reference, 150, 1000).assign(geometry_wkt=[])
+        for output_format in ("geoparquet", "flatgeobuf"):
+            layers = cm.export_plants(self.tmpdir.name, plants, output_format, None)
+            self.assertTrue(os.path.exists(self.path(layers[0]["path"])))
+        self.assertEqual(len(gpd.read_file(self.path(layers[0]["path"]))), 0)
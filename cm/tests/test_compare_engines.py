@@ -0,0 +1,55 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import compare_engines
+from app.api_v1 import calculation_module as cm
+from app.api_v1.heatsrc import classify
+from app.api_v1.heatsrc import technical as tech
+
+
+def classified():
+    inputs = cm.read_inputs(compare_engines.SAMPLE_C, compare_engines.SAMPLE_P)
+    sums = np.arange(len(inputs)) * 10.0
+    plants = classify.classify_plants(
+        inputs.assign(dist150m_sum=sums, dist1000m_sum=2 * sums), 150, 1000
+    )
+    return tech.power_potential(plants)
+
+
+class TestCompareEngines(unittest.TestCase):
+    def setUp(self):
+        self.reference = classified()
+
+    def run_main(self, results):
+        """Run the harness with the plants returned by each engine"""
+
+        def run_engine(engine, wwtp_c, wwtp_p, within_dist, near_dist):
+            return results[engine], 0.1
+
+        with mock.patch.object(compare_engines, "run_engine", side_effect=run_engine):
+            return compare_engines.main(
+                ["--engines", "buffer", "kdtree", "--synthetic", "0"]
+            )
+
+    def test_same(self):
+        # the rows are matched on gid, not on their order
+        plants = self.reference.iloc[::-1].reset_index(drop=True)
+        self.assertEqual(len(compare_engines.diff_plants(self.reference, plants)), 0)
+        self.assertEqual(self.run_main(dict(buffer=self.reference, kdtree=plants)), 0)
+
+    def test_changed(self):
+        plants = self.reference.copy()
+        plants.loc[2, "suitability"] = "Not suitable"
+        diff = compare_engines.diff_plants(self.reference, plants)
+        self.assertEqual(list(diff.index), [self.reference["gid"][2]])
+        self.assertEqual(diff["suitability_engine"].tolist(), ["Not suitable"])
+        self.assertEqual(self.run_main(dict(buffer=self.reference, kdtree=plants)), 1)
+
+    def test_missing(self):
+        plants = self.reference.drop(index=4)
+        diff = compare_engines.diff_plants(self.reference, plants)
+        self.assertEqual(list(diff.index), [self.reference["gid"][4]])
+        self.assertTrue(diff.filter(like="_engine").isna().all(axis=None))
+        self.assertEqual(self.run_main(dict(buffer=self.reference, kdtree=plants)), 1)
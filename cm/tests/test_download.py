@@ -0,0 +1,128 @@
+import os
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from app.api_v1 import download
+
+CONTENT = b"raster" * 100000
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits[self.path] = server.hits.get(self.path, 0) + 1
+            hits = server.hits[self.path]
+        if self.path == "/flaky" and hits == 1:
+            self.send_error(503)
+            return
+        if self.path == "/missing":
+            # fail once the other download is running
+            server.stalled.wait(10)
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(CONTENT)))
+        self.end_headers()
+        if self.path == "/stall":
+            # send part of the body and stall until the test is done
+            self.wfile.write(CONTENT[:1000])
+            self.wfile.flush()
+            server.stalled.set()
+            server.release.wait(10)
+            return
+        self.wfile.write(CONTENT)
+
+
+class TestDownload(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.hits = {}
+        self.server.lock = threading.Lock()
+        self.server.stalled = threading.Event()
+        self.server.release = threading.Event()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(self.server.release.set)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def test_download(self):
+        path = download.download(f"{self.url}/raster", self.path("raster.tif"))
+        with open(path, "rb") as fobj:
+            self.assertEqual(fobj.read(), CONTENT)
+        # the temporary file is renamed, with the mode of a file from open()
+        self.assertEqual(os.listdir(self.tmpdir.name), ["raster.tif"])
+        with open(self.path("other.tif"), "wb"):
+            pass
+        self.assertEqual(
+            stat.S_IMODE(os.stat(path).st_mode),
+            stat.S_IMODE(os.stat(self.path("other.tif")).st_mode),
+        )
+
+    def test_umask(self):
+        # the mode is read without changing the umask of the process
+        with mock.patch.object(download, "_file_mode", None):
+            with mock.patch("os.umask") as umask:
+                mode = download.file_mode()
+        self.assertFalse(umask.called)
+        self.assertEqual(mode & 0o600, 0o600)
+
+    def test_retry(self):
+        path = download.download(f"{self.url}/flaky", self.path("raster.tif"))
+        self.assertEqual(self.server.hits["/flaky"], 2)
+        self.assertEqual(path.stat().st_size, len(CONTENT))
+
+    def test_timeout(self):
+        with open(self.path("raster.tif"), "wb") as fobj:
+            fobj.write(b"previous")
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            download.download(f"{self.url}/stall", self.path("raster.tif"), timeout=0.2)
+        # the partial download is removed and the previous file is untouched
+        self.assertEqual(os.listdir(self.tmpdir.name), ["raster.tif"])
+        with open(self.path("raster.tif"), "rb") as fobj:
+            self.assertEqual(fobj.read(), b"previous")
+
+    def test_fail_fast(self):
+        files = {
+            "missing": dict(url=f"{self.url}/missing", filepath=self.path("missing.tif")),
+            "stall": dict(url=f"{self.url}/stall", filepath=self.path("stall.tif")),
+        }
+        start = time.perf_counter()
+        with self.assertRaises(requests.exceptions.HTTPError):
+            download.download_all(files)
+        # the error is raised without waiting the stalled download
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertFalse(os.path.exists(self.path("missing.tif")))
+        # the stalled download fails and removes its partial file
+        self.server.release.set()
+        for _ in range(100):
+            if not os.listdir(self.tmpdir.name):
+                break
+            time.sleep(0.05)
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+
+    def test_existing(self):
+        with open(self.path("raster.tif"), "wb") as fobj:
+            fobj.write(b"previous")
+        files = {"raster": dict(url=f"{self.url}/raster", filepath=self.path("raster.tif"))}
+        download.download_all(files)
+        self.assertEqual(self.server.hits, {})
+        paths = download.download_all(files, overwrite=True)
+        self.assertEqual(paths["raster"].stat().st_size, len(CONTENT))
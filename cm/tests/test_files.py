@@ -0,0 +1,39 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app import create_app, helper
+
+
+class TestFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        patcher = mock.patch("app.api_v1.transactions.UPLOAD_DIRECTORY", self.tmpdir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = create_app("development").test_client()
+        self.path = os.path.join(self.tmpdir.name, "plants.zip")
+        with open(self.path, "wb") as fobj:
+            fobj.write(b"plants" * 1000)
+        self.etag = helper.generate_etag(self.path)
+
+    def test_etag(self):
+        self.assertEqual(helper.read_etag(self.path), self.etag)
+        # no temporary file is left
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ["plants.zip", "plants.zip.etag"])
+
+    def test_conditional(self):
+        resp = self.client.get("/computation-module/files/plants.zip")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["ETag"], f'"{self.etag}"')
+        self.assertEqual(resp.data, b"plants" * 1000)
+        resp = self.client.get(
+            "/computation-module/files/plants.zip", headers={"If-None-Match": f'"{self.etag}"'}
+        )
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+        # the etag files are not served
+        resp = self.client.get("/computation-module/files/plants.zip.etag")
+        self.assertEqual(resp.status_code, 404)
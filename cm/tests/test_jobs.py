@@ -0,0 +1,41 @@
+import os
+import tempfile
+import time
+import unittest
+
+from app import jobs
+
+
+class TestJobs(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.registry = jobs.Registry(self.tmpdir.name, slots=2, window=10)
+
+    def test_snapshot(self):
+        # a job left by a dead worker is ignored
+        dead = os.path.join(self.tmpdir.name, "active", "job.999999999")
+        open(dead, "w").close()
+        for seconds in range(1, 21):
+            self.registry.record(seconds)
+        self.registry.mark("queued", "next")
+        with self.registry.job("running"):
+            snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot["active_jobs"], 1)
+        self.assertEqual(snapshot["queued_jobs"], 1)
+        self.assertEqual(snapshot["free_slots"], 1)
+        # only the last computations are used
+        self.assertEqual(snapshot["latency_samples"], 10)
+        self.assertEqual(snapshot["latency_p50"], 15.5)
+        self.registry.unmark("queued", "next")
+        snapshot = self.registry.snapshot()
+        self.assertEqual((snapshot["active_jobs"], snapshot["queued_jobs"]), (0, 0))
+        self.assertEqual(snapshot["latency_samples"], 10)
+
+    def test_fast(self):
+        for seconds in range(100):
+            self.registry.record(seconds / 10)
+        start = time.perf_counter()
+        for _ in range(100):
+            self.registry.snapshot()
+        self.assertLess((time.perf_counter() - start) / 100, 1e-3)
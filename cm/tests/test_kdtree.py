@@ -0,0 +1,62 @@
+import os
+import tempfile
+import pathlib
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from app.api_v1 import calculation_module as cm
+from app.api_v1.heatsrc import kdtree
+from app.api_v1.heatsrc.kdtree import UrbanTree
+
+
+class TestUrbanTree(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # urban cells of a 100 m raster
+        self.cells = (rng.integers(0, 200, (5000, 2)) + 0.5) * 100.0
+        self.plants = rng.uniform(-2000, 22000, (300, 2))
+
+    def test_query(self):
+        tree = UrbanTree(self.cells, 100.0)
+        result = tree.query(self.plants[:, 0], self.plants[:, 1], (150, 1000))
+        dists = np.hypot(
+            self.plants[:, None, 0] - self.cells[None, :, 0],
+            self.plants[:, None, 1] - self.cells[None, :, 1],
+        )
+        np.testing.assert_allclose(result["urban_dist"], dists.min(axis=1))
+        for dist in (150, 1000):
+            np.testing.assert_array_equal(
+                result[f"dist{dist}m_sum"], (dists <= dist).sum(axis=1)
+            )
+
+    def test_save_load(self):
+        tree = UrbanTree(self.cells, 100.0)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "urbanareas.kdtree")
+            tree.save(path)
+            self.assertEqual(os.listdir(tmpdir), ["urbanareas.kdtree"])
+            loaded = UrbanTree.load(path)
+        self.assertEqual(loaded.resolution, 100.0)
+        self.assertTrue(
+            tree.query(*self.plants.T, (150,)).equals(
+                loaded.query(*self.plants.T, (150,))
+            )
+        )
+
+    def test_load_engines(self):
+        tree = UrbanTree(self.cells, 100.0)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            gisdb = pathlib.Path(tmpdir)
+            with mock.patch.object(cm, "GISDB", gisdb):
+                # nothing to load before the location is prepared
+                self.assertIsNone(cm.load_engines())
+                path = kdtree.tree_path(gisdb, cm.LOCATION, cm.URB)
+                os.makedirs(os.path.dirname(path))
+                tree.save(path)
+                self.addCleanup(kdtree._trees.pop, path, None)
+                loaded = cm.load_engines()
+                # the workers get the tree loaded by the master process
+                self.assertIs(kdtree.get_tree(gisdb, cm.LOCATION, cm.URB), loaded)
+        self.assertEqual(loaded.resolution, 100.0)
@@ -0,0 +1,80 @@
+import unittest
+from unittest import mock
+
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import box
+
+from app.api_v1 import calculation_module as cm
+from app.constant import OUTPUT_BUFFER
+
+
+def plants(crs="EPSG:3035"):
+    return cm.plants2gdf(
+        pd.DataFrame(
+            dict(
+                geometry_wkt=["POINT(4397722.5 2515210.4)", "POINT(4413622.6 2560051.9)"],
+                srid=int(crs.split(":")[1]),
+                gid=[1, 2],
+                color=["#188B7D", None],
+                fillColor=["#188B7D", None],
+                opacity=[0.8, None],
+            )
+        )
+    )
+
+
+class TestLayer(unittest.TestCase):
+    def test_buffer(self):
+        gdf = plants()
+        with mock.patch.object(cm, "OUTPUT_QUAD_SEGS", 4), mock.patch.object(
+            gpd.GeoDataFrame, "to_crs"
+        ) as to_crs:
+            layer = cm.prepare_layer(gdf)
+        # the plants are already in EPSG:3035
+        self.assertFalse(to_crs.called)
+        geom = layer.geometry.iloc[0]
+        # a quarter of circle is approximated with 4 segments
+        self.assertEqual(len(geom.exterior.coords), 4 * 4 + 1)
+        self.assertAlmostEqual(geom.bounds[2] - geom.centroid.x, OUTPUT_BUFFER, places=3)
+        self.assertEqual(list(layer.columns[-4:]), ["color", "fillColor", "opacity", "geometry"])
+        # the frame of the caller is not changed
+        self.assertEqual(gdf.geom_type.tolist(), ["Point", "Point"])
+        self.assertTrue(pd.isna(gdf["color"].iloc[1]))
+
+    def test_fill_style(self):
+        gdf = plants()
+        filled = cm.fill_style(gdf)
+        self.assertEqual(filled["color"].tolist(), ["#188B7D", "#F34616"])
+        self.assertEqual(filled["fillColor"].tolist(), ["#188B7D", "#F34616"])
+        # the style of the caller is not changed
+        self.assertTrue(pd.isna(gdf["color"].iloc[1]))
+        self.assertTrue(pd.isna(gdf["fillColor"].iloc[1]))
+        self.assertTrue(pd.isna(gdf["opacity"].iloc[1]))
+
+    def test_reproject(self):
+        gdf = plants("EPSG:4326")
+        gdf["geometry"] = gpd.points_from_xy([7.0, 8.0], [46.0, 47.0], crs="EPSG:4326")
+        layer = cm.prepare_layer(gdf)
+        self.assertEqual(layer.crs, "EPSG:3035")
+        self.assertGreater(layer.geometry.iloc[0].centroid.x, 1e6)
+
+    def test_geopandas_api(self):
+        # the parts of the geopandas API used by the CM, pinned to 0.8.2
+        from geopandas.io.file import infer_schema
+
+        gdf = plants()
+        regions = gpd.GeoDataFrame(
+            dict(nuts=["A", "B"]),
+            geometry=[box(4390000, 2510000, 4400000, 2520000), box(0, 0, 1, 1)],
+            crs="EPSG:3035",
+        )
+        joined = gpd.sjoin(gdf, regions, "inner", "within")
+        self.assertEqual(joined["gid"].tolist(), [1])
+        self.assertEqual(joined["nuts"].tolist(), ["A"])
+        schema = infer_schema(gdf)
+        self.assertEqual(schema["geometry"], "Point")
+        self.assertEqual(schema["properties"]["gid"], "int")
+        self.assertEqual(schema["properties"]["color"], "str")
+        back = gdf.to_crs("EPSG:4326").to_crs("EPSG:3035")
+        self.assertAlmostEqual(back.geometry.iloc[0].x, gdf.geometry.iloc[0].x, places=3)
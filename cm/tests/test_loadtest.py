@@ -0,0 +1,20 @@
+import unittest
+
+import loadtest
+
+
+class TestLoadTest(unittest.TestCase):
+    def test_run(self):
+        report, backlog = loadtest.run(
+            rate=40,
+            duration=0.5,
+            mix={"compute": 1, "alive": 2, "register": 1},
+            compute_workers=2,
+            service_time=0.01,
+            timeout=5,
+        )
+        # all the requests are answered by the consumers
+        self.assertGreater(report["sent"].sum(), 0)
+        self.assertEqual(report["timeouts"].sum(), 0)
+        self.assertEqual(list(report["sent"]), list(report["replied"]))
+        self.assertEqual(set(backlog.columns), {"time", "compute", "alive", "register"})
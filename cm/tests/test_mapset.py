@@ -0,0 +1,46 @@
+import os
+import stat
+import tempfile
+import unittest
+
+from app.api_v1 import artifact
+from app.api_v1.heatsrc import technical as tech
+
+
+class TestMapset(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.gisdb = self.tmpdir.name
+        template = os.path.join(self.gisdb, "wwtp", tech.TEMPLATE)
+        files = {
+            "WIND": "north: 100\n",
+            "VAR": "DB_DRIVER: sqlite\n",
+            os.path.join("cell", "urbanareas"): "cells",
+            os.path.join("cellhd", "urbanareas"): "header",
+        }
+        for name, content in files.items():
+            path = os.path.join(template, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as fobj:
+                fobj.write(content)
+        # the template of a prepared location is read-only
+        artifact.freeze(self.gisdb)
+        self.template = template
+
+    def test_clone(self):
+        mapset = tech.clone_mapset(self.gisdb, "wwtp", "mset_test")
+        self.assertEqual(mapset, os.path.join(self.gisdb, "wwtp", "mset_test"))
+        # the raster is shared with the template
+        cell = os.path.join("cell", "urbanareas")
+        self.assertTrue(
+            os.path.samefile(os.path.join(mapset, cell), os.path.join(self.template, cell))
+        )
+        # the region is a writable copy
+        wind = os.path.join(mapset, "WIND")
+        self.assertFalse(os.path.samefile(wind, os.path.join(self.template, "WIND")))
+        self.assertTrue(os.stat(wind).st_mode & stat.S_IWUSR)
+        with open(wind, "w") as fobj:
+            fobj.write("north: 200\n")
+        with open(os.path.join(self.template, "WIND")) as fobj:
+            self.assertEqual(fobj.read(), "north: 100\n")
@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from app import create_app, profiling
+
+
+def grass_module():
+    profile = profiling.current()
+    with profile.grass_module("v.buffer"):
+        time.sleep(0.05)
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        patcher = mock.patch("app.profiling.PROFILE_DIRECTORY", self.tmpdir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def test_disabled(self):
+        self.assertFalse(profiling.enabled({"within_dist": "150"}))
+        self.assertTrue(profiling.enabled({"profile": "true"}))
+        self.assertIsNone(profiling.current())
+
+    def test_profile(self):
+        with profiling.Profile("job", interval=0.001):
+            grass_module()
+        self.assertIsNone(profiling.current())
+
+        with open(os.path.join(self.tmpdir.name, "job.json")) as jfile:
+            prof = json.load(jfile)
+        self.assertEqual([mod["module"] for mod in prof["grass_modules"]], ["v.buffer"])
+        self.assertGreaterEqual(prof["grass_summary"]["v.buffer"]["seconds"], 0.05)
+        self.assertGreater(prof["samples"], 0)
+
+        with open(os.path.join(self.tmpdir.name, "job.folded")) as ffile:
+            lines = ffile.read().splitlines()
+        self.assertTrue(
+            any("grass_module (test_profiling.py" in line for line in lines)
+        )
+        self.assertTrue(any(line.split()[-2].endswith("grass:v.buffer") for line in lines))
+
+    def test_endpoint(self):
+        with profiling.Profile("job", interval=0.001):
+            grass_module()
+        app = create_app("development")
+        with mock.patch("app.constant.PROFILE_DIRECTORY", self.tmpdir.name):
+            client = app.test_client()
+            resp = client.get("/computation-module/profiles/job")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(json.loads(resp.data)["job_id"], "job")
+            resp = client.get("/computation-module/profiles/job/folded")
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(b"grass:v.buffer", resp.data)
+            resp = client.get("/computation-module/profiles/missing")
+            self.assertEqual(resp.status_code, 404)
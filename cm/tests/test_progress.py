@@ -0,0 +1,45 @@
+import unittest
+from unittest import mock
+
+from app import progress
+
+
+class FakePublisher(object):
+    def __init__(self):
+        self.events = []
+
+    def publish(self, correlation_id, event):
+        self.events.append((correlation_id, event))
+
+
+class TestProgress(unittest.TestCase):
+    def test_disabled(self):
+        self.assertIsNone(progress.current())
+        progress.report("stage", 1, 2)
+
+    def test_rate_limit(self):
+        publisher = FakePublisher()
+        with mock.patch("app.progress.time.monotonic") as monotonic:
+            monotonic.return_value = 100.0
+            with progress.Progress("corr", interval=1.0, publisher=publisher):
+                for done in range(10):
+                    progress.report("buffer", done, 10)
+                monotonic.return_value = 100.5
+                progress.report("classify", 0, 10)
+                progress.report("classify", 5, 10)
+                monotonic.return_value = 101.6
+                progress.report("classify", 10, 10)
+            progress.report("export", 10, 10)
+
+        self.assertEqual(
+            [(event["stage"], event["done"], event["elapsed"]) for _, event in publisher.events],
+            [("buffer", 0, 0.0), ("classify", 0, 0.5), ("classify", 10, 1.6)],
+        )
+        self.assertTrue(all(corr == "corr" for corr, _ in publisher.events))
+
+    def test_full_queue(self):
+        publisher = progress.Publisher(maxsize=1)
+        publisher.publish("corr", {})
+        # the event is dropped without blocking
+        publisher.publish("corr", {})
+        self.assertEqual(publisher.events.qsize(), 1)
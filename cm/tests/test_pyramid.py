@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+
+from app.api_v1.heatsrc.classify import get_classifier
+from app.api_v1.heatsrc.kdtree import UrbanTree
+from app.api_v1.heatsrc.pyramid import UrbanPyramid
+
+
+class TestUrbanPyramid(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # urban patches on a 100 m raster
+        mask = np.zeros((300, 400), dtype=bool)
+        for row, col, size in zip(
+            rng.integers(0, 300, 40), rng.integers(0, 400, 40), rng.integers(1, 30, 40)
+        ):
+            mask[row : row + size, col : col + size] = True
+        self.west, self.north, self.res = 4000000.0, 3000000.0, 100.0
+        self.pyramid = UrbanPyramid.from_array(mask, self.west, self.north, self.res)
+        irow, icol = np.nonzero(mask)
+        self.tree = UrbanTree(
+            np.column_stack(
+                [
+                    self.west + (icol + 0.5) * self.res,
+                    self.north - (irow + 0.5) * self.res,
+                ]
+            ),
+            self.res,
+        )
+        self.x = self.west + rng.uniform(-2000, 42000, 2000)
+        self.y = self.north - rng.uniform(-2000, 32000, 2000)
+
+    def test_exact(self):
+        expected = self.tree.query(self.x, self.y, (150, 1000, 5000))
+        result, exact = self.pyramid.query(self.x, self.y, (150, 1000, 5000))
+        self.assertTrue(exact.values.all())
+        for col in result.columns:
+            np.testing.assert_array_equal(result[col], expected[col])
+
+    def test_classes(self):
+        classifier = get_classifier()
+        axes = (classifier.dmin, classifier.dmax)
+        for dists in ((150, 1000), (500, 5000)):
+            expected = self.tree.query(self.x, self.y, dists)
+            result, exact = self.pyramid.query(self.x, self.y, dists, axes=axes)
+            for col, axis in zip(result.columns, axes):
+                np.testing.assert_array_equal(
+                    axis.locate(result[col]), axis.locate(expected[col])
+                )
+                # the sums flagged exact are exact, the others lower bounds
+                np.testing.assert_array_equal(
+                    result[col][exact[col]], expected[col][exact[col]]
+                )
+                self.assertTrue((result[col] <= expected[col]).all())
+            # the plants decided at a coarse level have only a lower bound
+            self.assertFalse(exact.values.all())
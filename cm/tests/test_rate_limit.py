@@ -0,0 +1,54 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from app.decorators.rate_limit import MemRateLimit, SQLiteRateLimit
+
+
+class TestRateLimit(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dbpath = os.path.join(self.tmpdir.name, "ratelimit.sqlite")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def check_limit(self, limiter):
+        with mock.patch("app.decorators.rate_limit.time", return_value=1000):
+            for remaining in (2, 1, 0):
+                self.assertEqual(
+                    limiter.is_allowed("key", 3, 60), (True, remaining, 1020)
+                )
+            self.assertEqual(limiter.is_allowed("key", 3, 60), (False, 0, 1020))
+            self.assertEqual(limiter.is_allowed("other", 3, 60), (True, 2, 1020))
+        # the counter is reset in the next period
+        with mock.patch("app.decorators.rate_limit.time", return_value=1021):
+            self.assertEqual(limiter.is_allowed("key", 3, 60), (True, 2, 1080))
+
+    def test_memory(self):
+        limiter = MemRateLimit()
+        self.check_limit(limiter)
+        # expired counters are removed
+        self.assertEqual(list(limiter.counters), ["key"])
+
+    def test_sqlite(self):
+        self.check_limit(SQLiteRateLimit(self.dbpath))
+
+    def test_sqlite_shared(self):
+        # two limiters using the same file share the counters
+        first, second = SQLiteRateLimit(self.dbpath), SQLiteRateLimit(self.dbpath)
+        first.is_allowed("key", 2, 60)
+        self.assertEqual(second.is_allowed("key", 2, 60)[:2], (True, 0))
+        self.assertEqual(first.is_allowed("key", 2, 60)[:2], (False, 0))
+
+    def test_memory_overhead(self):
+        # the cost of a hit does not depend on the number of counters
+        limiter = MemRateLimit()
+        for i in range(100000):
+            limiter.is_allowed(f"client{i}", 10, 60)
+        start = time.perf_counter()
+        for i in range(1000):
+            limiter.is_allowed("client", 10, 60)
+        self.assertLess((time.perf_counter() - start) / 1000, 1e-4)
@@ -0,0 +1,52 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+
+from app import scheduling
+
+SAMPLE_C = os.path.join(os.path.dirname(__file__), "data", "sample_data_c.csv")
+
+
+def body(path):
+    return json.dumps({"inputs_vector_selection": {"wwtp_capacity": path}})
+
+
+class TestScheduling(unittest.TestCase):
+    def test_estimate(self):
+        plants, bbox = scheduling.csv_extent(SAMPLE_C)
+        self.assertEqual(plants, 9)
+        self.assertLess(bbox[0], bbox[2])
+        small = scheduling.estimate_cost(body(SAMPLE_C))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            large = os.path.join(tmpdir, "large.csv")
+            data = pd.read_csv(SAMPLE_C)
+            pd.concat([data] * 1000).to_csv(large, index=False)
+            # the count is extrapolated from the first bytes
+            plants, _ = scheduling.csv_extent(large, sample=1 << 12)
+            self.assertAlmostEqual(plants, 9000, delta=900)
+            self.assertGreater(scheduling.estimate_cost(body(large)), 100 * small)
+        # the unknown requests are scheduled as small ones
+        self.assertEqual(scheduling.estimate_cost(body("/missing.csv")), 0.0)
+        self.assertEqual(scheduling.estimate_cost(b"not json"), 0.0)
+
+    def test_shortest_first(self):
+        scheduler = scheduling.Scheduler(aging=0)
+        for cost, name in ((1000, "country"), (10, "city"), (100, "region")):
+            scheduler.push(cost, name)
+        self.assertEqual(len(scheduler), 3)
+        self.assertEqual(
+            [scheduler.pop() for _ in range(3)], ["city", "region", "country"]
+        )
+        self.assertIsNone(scheduler.pop(timeout=0.01))
+
+    def test_aging(self):
+        scheduler = scheduling.Scheduler(aging=1e6)
+        scheduler.push(1000, "country")
+        # a smaller job that arrives later waits behind the old one
+        time.sleep(0.01)
+        scheduler.push(10, "city")
+        self.assertEqual(scheduler.pop(), "country")
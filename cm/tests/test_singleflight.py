@@ -0,0 +1,83 @@
+import fcntl
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from app import singleflight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.flight = singleflight.SingleFlight(self.tmpdir.name)
+
+    def run_both(self, leader, follower):
+        """Run the follower while the leader is computing"""
+        started = threading.Event()
+        results = {}
+
+        def slow():
+            started.wait()
+            time.sleep(0.2)
+            return leader()
+
+        def run(name, func):
+            try:
+                results[name] = self.flight.run("key", func)
+            except Exception as exc:
+                results[name] = exc
+
+        thread = threading.Thread(target=run, args=("leader", slow))
+        thread.start()
+        time.sleep(0.05)
+        started.set()
+        run("follower", follower)
+        thread.join()
+        return results
+
+    def test_key(self):
+        path = os.path.join(self.tmpdir.name, "input.csv")
+        with open(path, "w") as fobj:
+            fobj.write("gid,capacity\n1,2000\n")
+        key = singleflight.request_key({"wwtp": path}, {"near_dist": "1000"})
+        self.assertEqual(key, singleflight.request_key({"wwtp": path}, {"near_dist": "1000"}))
+        self.assertNotEqual(key, singleflight.request_key({"wwtp": path}, {"near_dist": "900"}))
+        with open(path, "a") as fobj:
+            fobj.write("2,5000\n")
+        self.assertNotEqual(key, singleflight.request_key({"wwtp": path}, {"near_dist": "1000"}))
+
+    def test_shared(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {"indicator": [len(calls)]}
+
+        results = self.run_both(compute, compute)
+        self.assertEqual(results["leader"], ({"indicator": [1]}, False))
+        self.assertEqual(results["follower"], ({"indicator": [1]}, True))
+        self.assertEqual(len(calls), 1)
+
+    def test_failure(self):
+        def fail():
+            raise RuntimeError("GRASS failed")
+
+        results = self.run_both(fail, lambda: {"indicator": []})
+        # the waiting request computes again if the first one failed
+        self.assertIsInstance(results["leader"], RuntimeError)
+        self.assertEqual(results["follower"], ({"indicator": []}, False))
+
+    def test_prune(self):
+        self.flight.run("old", lambda: {"indicator": []})
+        self.flight.run("held", lambda: {"indicator": []})
+        lock_path = self.flight.paths("held")[0]
+        for name in os.listdir(self.tmpdir.name):
+            os.utime(os.path.join(self.tmpdir.name, name), (0, 0))
+        with open(lock_path) as lock:
+            # a request holds the lock of the key
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.flight.prune()
+        self.assertEqual(os.listdir(self.tmpdir.name), ["held.lock"])
@@ -0,0 +1,33 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+CMDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that must be imported only when the CM computes
+HEAVY_MODULES = ["geopandas", "pandas", "grass_session", "grass", "pika", "requests"]
+
+STARTUP = """
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+create_app("development")
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed,
+                  "loaded": [mod for mod in %r if mod in sys.modules]}))
+""" % HEAVY_MODULES
+
+
+class TestStartup(unittest.TestCase):
+    def test_cold_start(self):
+        out = subprocess.run(
+            [sys.executable, "-c", STARTUP],
+            cwd=CMDIR,
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout
+        res = json.loads(out.decode().strip().splitlines()[-1])
+        self.assertEqual(res["loaded"], [], msg="Heavy modules imported at startup")
+        self.assertLess(res["elapsed"], 5.0)
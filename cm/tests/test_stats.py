@@ -0,0 +1,70 @@
+import time
+import unittest
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point, box
+
+from app.api_v1.heatsrc import technical as tech
+
+
+class TestTechStats(unittest.TestCase):
+    def setUp(self):
+        size, nregions = 10000.0, 40
+        self.regions = gpd.GeoDataFrame(
+            {
+                "nuts_id": [
+                    f"R{i:02d}{j:02d}" for i in range(nregions) for j in range(nregions)
+                ]
+            },
+            geometry=[
+                box(i * size, j * size, (i + 1) * size, (j + 1) * size)
+                for i in range(nregions)
+                for j in range(nregions)
+            ],
+            crs="EPSG:3035",
+        )
+        rng = np.random.default_rng(0)
+        # keep the points away from the region boundaries
+        xy = rng.integers(0, nregions * 10, (20000, 2)) * 1000.0 + 500.0
+        self.ids = np.array(
+            [f"R{int(x // size):02d}{int(y // size):02d}" for x, y in xy]
+        )
+        power = rng.integers(1, 1000, len(xy)).astype(float)
+        suitable = rng.random(len(xy)) < 0.5
+        self.plants = gpd.GeoDataFrame(
+            {
+                "suitable": np.where(suitable, power, 0),
+                "conditional": np.where(suitable, 0, power),
+            },
+            geometry=[Point(x, y) for x, y in xy],
+            crs="EPSG:3035",
+        )
+
+    def test_stats(self):
+        start = time.perf_counter()
+        stats = tech.tech_stats(self.plants, self.regions, "nuts_id")
+        elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, 1.0)
+
+        expected = self.plants.drop(columns="geometry").groupby(self.ids)
+        np.testing.assert_array_equal(stats.index, sorted(set(self.ids)))
+        np.testing.assert_array_equal(stats["count"], expected.size())
+        for col in ("suitable", "conditional"):
+            np.testing.assert_allclose(stats[f"{col}_sum"], expected[col].sum())
+            np.testing.assert_array_equal(
+                stats[f"{col}_count"], expected[col].apply(lambda v: (v > 0).sum())
+            )
+
+    def test_power_potential(self):
+        plants = pd.DataFrame(
+            dict(
+                suitability=list(tech.COLORS) + [None],
+                power=[100.0, 20.0, 3.0, 4.0],
+            )
+        )
+        tech.power_potential(plants)
+        # the classes are the ones of the suitability matrix
+        self.assertEqual(list(plants["suitable"]), [100.0, 0, 0, 0])
+        self.assertEqual(list(plants["conditional"]), [0, 20.0, 0, 0])
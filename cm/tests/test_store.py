@@ -0,0 +1,125 @@
+import os
+import pathlib
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import precompute
+from app.api_v1 import calculation_module as cm
+from app.api_v1.heatsrc import classify, store
+from app.api_v1.heatsrc import technical as tech
+
+DATADIR = os.path.join(os.path.dirname(__file__), "data")
+SAMPLE_C = os.path.join(DATADIR, "sample_data_c.csv")
+SAMPLE_P = os.path.join(DATADIR, "sample_data_p.csv")
+
+
+class TestStore(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.reference = pathlib.Path(tmpdir.name, "reference.sqlite")
+        for name, value in (
+            ("PLANTS_STORE", pathlib.Path(tmpdir.name, "plants.sqlite")),
+            ("REFERENCE_STORE", self.reference),
+            ("location_version", lambda: "v1"),
+        ):
+            patcher = mock.patch.object(cm, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_keys(self):
+        keys = store.plant_keys(
+            ["POINT(4397722.57471447 2515210.45880608)", "POINT (10 20)"], [1, 2], 150, 1000
+        )
+        # the same points written with another precision and formatting
+        same = store.plant_keys(
+            ["POINT (4397722.5747144701 2515210.458806080)", "POINT(10.0 20.000)"],
+            [1.0, 2.0],
+            150,
+            1000,
+        )
+        self.assertEqual(keys, same)
+        self.assertNotEqual(keys, store.plant_keys(["POINT (10 20)"] * 2, [1, 2], 150, 1000))
+
+    def classify(self, inputs):
+        sums = np.arange(len(inputs)) * 10.0
+        plants = classify.classify_plants(
+            inputs.assign(dist150m_sum=sums, dist1000m_sum=2 * sums), 150, 1000
+        )
+        return tech.power_potential(plants)
+
+    def test_restore_power(self):
+        inputs = cm.read_inputs(SAMPLE_C, SAMPLE_P)
+        plants = self.classify(inputs)
+        cm.store_plants(plants, inputs, 150, 1000)
+
+        # only the power changed, the geometries are written differently
+        changed = inputs.assign(
+            power=inputs["power"] * 2,
+            geometry_wkt=[geom.replace("POINT(", "POINT (") for geom in inputs["geometry_wkt"]],
+        )
+        restored = cm.restore_plants(changed, 150, 1000)
+        for col in ("suitability", "distance_label", "plantsize_label"):
+            self.assertEqual(list(restored[col]), list(plants[col]))
+        np.testing.assert_allclose(restored["suitable"], plants["suitable"] * 2)
+        np.testing.assert_allclose(restored["conditional"], plants["conditional"] * 2)
+        self.assertGreater(restored["suitable"].sum(), 0)
+        self.assertGreater(restored["conditional"].sum(), 0)
+        # another distance is not in the store
+        self.assertIsNone(cm.restore_plants(changed, 100, 1000))
+
+    def test_reference_engine(self):
+        inputs = cm.read_inputs(SAMPLE_C, SAMPLE_P)
+        plants = self.classify(inputs)
+        cm.store_plants(plants, inputs, 150, 1000, path=self.reference, engine="kdtree")
+        self.assertEqual(cm.store_engine(self.reference), "kdtree")
+        # the reference store is not used by the other engines
+        self.assertIsNone(cm.restore_plants(inputs, 150, 1000, engine="buffer"))
+        restored = cm.restore_plants(inputs, 150, 1000, engine="kdtree")
+        self.assertEqual(list(restored["suitability"]), list(plants["suitability"]))
+        # precompute does not mix the engines in the same store
+        with self.assertRaises(ValueError):
+            precompute.precompute([(150, 1000)], self.reference, engine="buffer")
+
+    def test_reference_legacy(self):
+        inputs = cm.read_inputs(SAMPLE_C, SAMPLE_P)
+        plants = self.classify(inputs)
+        cm.store_plants(plants, inputs, 150, 1000, path=self.reference, engine="buffer")
+        with sqlite3.connect(self.reference) as conn:
+            conn.execute("DROP TABLE meta")
+        # the stores without the engine were classified with the buffers
+        self.assertEqual(cm.store_engine(self.reference), "buffer")
+        self.assertIsNotNone(cm.restore_plants(inputs, 150, 1000, engine="buffer"))
+        self.assertIsNone(cm.restore_plants(inputs, 150, 1000, engine="pyramid"))
+
+    def test_urban_dist(self):
+        inputs = cm.read_inputs(SAMPLE_C, SAMPLE_P)
+        plants = self.classify(inputs)
+        plants["urban_dist"] = np.arange(len(plants)) * 100.0
+        cm.store_plants(plants, inputs, 150, 1000)
+        # the restored plants have the same distance of the computed ones
+        restored = cm.restore_plants(inputs, 150, 1000)
+        np.testing.assert_allclose(restored["urban_dist"], plants["urban_dist"])
+        self.assertIn("urban_dist", cm.layer_dtypes(inputs, 150, 1000))
+
+    def test_legacy_store(self):
+        path = cm.plants_store()
+        with sqlite3.connect(path) as conn:
+            conn.execute(
+                "CREATE TABLE plants (key TEXT PRIMARY KEY, dmin_sum DOUBLE PRECISION, "
+                "dmax_sum DOUBLE PRECISION, suitability TEXT, distance_label TEXT, "
+                "plantsize_label TEXT)"
+            )
+            conn.execute("INSERT INTO plants VALUES ('a', 1, 2, 'Suitable', 'Near', 'High')")
+        # read-only stores written before the distance was saved
+        stored = store.PlantStore(path, create=False).get(["a"], 150, 1000)
+        self.assertTrue(np.isnan(stored.loc["a", "urban_dist"]))
+        self.assertEqual(stored.loc["a", "dist1000m_sum"], 2)
+        # the stores opened for writing gain the column
+        pstore = store.PlantStore(path)
+        pstore.put(["b"], self.classify(cm.read_inputs(SAMPLE_C, SAMPLE_P))[:1], 150, 1000)
+        self.assertEqual(list(pstore.get(["a", "b"], 150, 1000).index), ["a", "b"])
@@ -0,0 +1,137 @@
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from app.api_v1 import calculation_module as cm
+from app.api_v1.heatsrc import classify, stream
+from app.api_v1.heatsrc import technical as tech
+
+DATADIR = os.path.join(os.path.dirname(__file__), "data")
+SAMPLE_C = os.path.join(DATADIR, "sample_data_c.csv")
+SAMPLE_P = os.path.join(DATADIR, "sample_data_p.csv")
+
+
+class TestStream(unittest.TestCase):
+    def test_batches(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # the power file is shuffled and a plant has no power
+            wwtp_p = os.path.join(tmpdir, "power.csv")
+            power = pd.read_csv(SAMPLE_P).sample(frac=1, random_state=1)
+            power.iloc[:-1].to_csv(wwtp_p, index=False)
+            batches = list(stream.read_batches(SAMPLE_C, wwtp_p, chunksize=4, tmpdir=tmpdir))
+            reference = cm.read_inputs(SAMPLE_C, wwtp_p)
+            self.assertEqual([len(batch) for batch in batches], [4, 4, 1])
+            plants = pd.concat(batches)
+            self.assertEqual(list(plants.columns), list(reference.columns))
+            np.testing.assert_array_equal(plants["power"], reference["power"].astype(float))
+
+    def test_indicators(self):
+        plants = pd.DataFrame(
+            dict(
+                suitability=["Suitable", "Not suitable", "Suitable", np.nan],
+                power=[1000, 200, 3000, 5],
+            )
+        )
+        # the indicators of the batches are the indicators of all the plants
+        summary = (
+            pd.concat([cm.suitability_power(plants[:2]), cm.suitability_power(plants[2:])])
+            .groupby(level=0, sort=False)
+            .sum()
+        )
+        self.assertEqual(
+            cm.compute_indicators(None, summary=summary), cm.compute_indicators(plants)
+        )
+
+    def patch(self, target, name, *args, **kwargs):
+        patcher = mock.patch.object(target, name, *args, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def patch_stores(self):
+        """Use empty plants stores and a fixed location version"""
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.patch(cm, "PLANTS_STORE", pathlib.Path(tmpdir.name, "plants.sqlite"))
+        self.patch(cm, "REFERENCE_STORE", pathlib.Path(tmpdir.name, "missing.sqlite"))
+        self.patch(cm, "location_version", lambda: "v1")
+
+    def test_store_engine(self):
+        self.patch_stores()
+        inputs = cm.read_inputs(SAMPLE_C, SAMPLE_P)
+        plants = classify.classify_plants(
+            inputs.assign(dist150m_sum=50.0, dist1000m_sum=50.0), 150, 1000
+        )
+        tech.power_potential(plants)
+        # the batches classified with the KD-tree in place of the buffers
+        # are not restored by the buffer engine
+        cm.store_plants(plants, inputs, 150, 1000, path=cm.plants_store("kdtree"))
+        self.assertIsNone(cm.restore_plants(inputs, 150, 1000, engine="buffer"))
+        restored = cm.restore_plants(inputs, 150, 1000, engine="kdtree")
+        self.assertEqual(list(restored["suitability"]), list(plants["suitability"]))
+
+    def test_mixed_batches(self):
+        self.patch_stores()
+        inputs = cm.read_inputs(SAMPLE_C, SAMPLE_P)
+        dtypes = cm.layer_dtypes(inputs, 150, 1000)
+        queried = classify.classify_plants(
+            inputs.assign(dist150m_sum=50.0, dist1000m_sum=50.0), 150, 1000
+        )
+        tech.power_potential(queried)
+        cm.store_plants(queried[:4], inputs[:4], 150, 1000)
+        # the first batch is restored from the store, the next one queried
+        batches = [
+            cm.restore_plants(inputs[:4], 150, 1000),
+            queried[4:].copy(),
+        ]
+        layers = [
+            stream.project(cm.prepare_layer(cm.plants2gdf(batch)), dtypes)
+            for batch in batches
+        ]
+        for layer in layers:
+            self.assertEqual(list(layer.columns), list(dtypes) + ["geometry"])
+            self.assertEqual(
+                {col: str(dtype) for col, dtype in layer.dtypes.items() if col != "geometry"},
+                dtypes,
+            )
+        self.assertEqual(set(layers[1]["opacity"]), {0.8})
+        try:
+            import fiona
+        except ImportError:
+            return
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "plants.shp")
+            with stream.LayerWriter(path) as writer:
+                for layer in layers:
+                    writer.write(layer)
+            with fiona.open(path) as layer:
+                self.assertEqual(len(layer), len(inputs))
+
+    def test_stream_engine(self):
+        self.patch_stores()
+
+        def query(inputs, within_dist, near_dist, engine):
+            plants = classify.classify_plants(
+                inputs.assign(dist150m_sum=50.0, dist1000m_sum=50.0), within_dist, near_dist
+            )
+            return tech.power_potential(plants)
+
+        query_plants = self.patch(cm, "query_plants", side_effect=query)
+        self.patch(cm, "URBAN_ENGINE", "buffer")
+        self.patch(cm, "shapefile_layer", return_value={})
+        self.patch(stream, "LayerWriter")
+
+        result = cm.stream_plants("", SAMPLE_C, SAMPLE_P, 150, 1000, "plants.shp", [])
+        # the buffer engine is replaced by the KD-tree and reported
+        self.assertEqual(result["engine"], "kdtree")
+        self.assertIn("kdtree engine", result["indicator"][0]["name"])
+        self.assertEqual(query_plants.call_args[1]["engine"], "kdtree")
+        # the next request restores the batches from the store
+        query_plants.reset_mock()
+        again = cm.stream_plants("", SAMPLE_C, SAMPLE_P, 150, 1000, "plants.shp", [])
+        self.assertFalse(query_plants.called)
+        self.assertEqual(again["indicator"], result["indicator"])
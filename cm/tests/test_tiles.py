@@ -0,0 +1,73 @@
+import gzip
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import Point
+
+from app import create_app
+from app.api_v1.heatsrc import tiles
+
+try:
+    import mapbox_vector_tile
+except ImportError:
+    mapbox_vector_tile = None
+
+
+class TestTiles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, "plants.mbtiles")
+        gdf = gpd.GeoDataFrame(
+            pd.DataFrame(
+                dict(
+                    gid=[1, 2],
+                    suitability=["Suitable", "Conditionally"],
+                    color=["#188B7D", "#D9C259"],
+                    fillColor=["#188B7D", "#D9C259"],
+                    opacity=[0.8, 0.8],
+                )
+            ),
+            geometry=[Point(7.45, 46.95), Point(8.55, 47.37)],
+            crs="EPSG:4326",
+        )
+        tiles.write_mbtiles(gdf, self.path, maxzoom=8)
+
+    @unittest.skipIf(mapbox_vector_tile is None, "mapbox_vector_tile is missing")
+    def test_decode(self):
+        # the tile of the first point at zoom 8
+        tx, ty, px, py = tiles.tile_coords(*self.mercator(7.45, 46.95), 8)
+        data = gzip.decompress(tiles.read_tile(self.path, 8, int(tx[0]), int(ty[0])))
+        layer = mapbox_vector_tile.decode(data, default_options={"y_coord_down": True})["wwtp"]
+        self.assertEqual(layer["extent"], tiles.EXTENT)
+        (feature,) = layer["features"]
+        self.assertEqual(feature["geometry"]["type"], "Point")
+        self.assertEqual(feature["geometry"]["coordinates"], [int(px[0]), int(py[0])])
+        self.assertEqual(
+            feature["properties"],
+            dict(gid=1, suitability="Suitable", color="#188B7D", fillColor="#188B7D", opacity=0.8),
+        )
+        # both points are in the tile of zoom 0
+        data = gzip.decompress(tiles.read_tile(self.path, 0, 0, 0))
+        self.assertEqual(len(mapbox_vector_tile.decode(data)["wwtp"]["features"]), 2)
+
+    def mercator(self, lon, lat):
+        point = gpd.GeoSeries([Point(lon, lat)], crs="EPSG:4326").to_crs("EPSG:3857")
+        return point.x.values, point.y.values
+
+    def test_endpoint(self):
+        client = create_app("development").test_client()
+        with mock.patch("app.api_v1.transactions.UPLOAD_DIRECTORY", self.tmpdir.name):
+            resp = client.get("/computation-module/tiles/plants.mbtiles/0/0/0.pbf")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+            self.assertEqual(resp.data, tiles.read_tile(self.path, 0, 0, 0))
+            # no plants in the tile
+            resp = client.get("/computation-module/tiles/plants.mbtiles/8/0/0.pbf")
+            self.assertEqual(resp.status_code, 204)
+            resp = client.get("/computation-module/tiles/missing.mbtiles/0/0/0.pbf")
+            self.assertEqual(resp.status_code, 404)